@@ -0,0 +1,303 @@
+import asyncio, struct, threading
+from . import constants, session
+
+"""
+ asyncio sessions
+
+ AsyncSession has the session's send and receive surface as coroutines, over an AsyncWrapper.
+ A pack is read from the stream without blocking and then dissected by the session's regular code out of memory,
+ so every data type and wire format is handled the same way as in Session. Files sent in several packs (chunked
+ and streamed files) are received and sent on an executor thread, since their packs are read and written while
+ they are written to (or read from) disk.
+"""
+
+
+class _SessionNetwork:
+    """
+    The network the session's code reads from and writes to: reads are served out of the pack read by the
+    AsyncSession, and continue on the stream when called from an executor thread; writes go to the transport
+    """
+    def __init__(self, wrapper, loop):
+        """
+        :param wrapper: AsyncWrapper
+        :param loop: event loop the wrapper belongs to
+        """
+        self.__wrapper = wrapper
+        self.__loop = loop
+        self.__loop_thread = threading.get_ident()
+        self.__pack = memoryview(b'')
+        self.__offset = 0
+
+    @property
+    def bytes_sent(self):
+        return self.__wrapper.bytes_sent
+
+    @property
+    def bytes_received(self):
+        return self.__wrapper.bytes_received
+
+    def load(self, pack):
+        """
+        Sets the pack that following reads are served from
+        :param pack: bytes
+        """
+        self.__pack = memoryview(pack)
+        self.__offset = 0
+
+    def __on_loop(self):
+        return threading.get_ident() == self.__loop_thread
+
+    def __wait(self, coroutine):
+        """
+        Runs a coroutine on the loop and waits for its result (executor threads only)
+        :param coroutine: coroutine
+        :return: object
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    def receive_view(self, length):
+        """
+        :param length: int
+        :return: memoryview or bytes
+        """
+        available = len(self.__pack) - self.__offset
+        if length <= available:
+            view = self.__pack[self.__offset:self.__offset + length]
+            self.__offset += length
+            return view
+        if self.__on_loop():
+            raise Exception("Pack is incomplete")
+        data = bytes(self.__pack[self.__offset:])
+        self.__offset = len(self.__pack)
+        return data + self.__wait(self.__wrapper.receive(length - available))
+
+    def receive(self, length):
+        """
+        :param length: int
+        :return: bytes
+        """
+        return bytes(self.receive_view(length))
+
+    def receive_into(self, view):
+        """
+        :param view: bytearray or memoryview
+        :return: int
+        """
+        view = memoryview(view)
+        view[:] = self.receive_view(len(view))
+        return len(view)
+
+    def read_header(self):
+        """
+        :return: bytes
+        """
+        return self.receive(struct.unpack("!B", self.receive(1))[0])
+
+    def send(self, data):
+        """
+        :param data: bytes-like object
+        """
+        self.send_buffers([data])
+
+    def send_buffers(self, buffers):
+        """
+        :param buffers: list; bytes-like objects
+        """
+        if self.__on_loop():
+            self.__wrapper.send_buffers(buffers)
+        else:
+            # the transport may keep references to the buffers after the write returns
+            buffers = [buffer if isinstance(buffer, bytes) else bytes(buffer) for buffer in buffers]
+            self.__wait(self.__wrapper.write(buffers))
+
+
+class AsyncSession(session.Session):
+    """
+    asyncio server-client session
+    Note: must be created while the event loop is running
+    """
+    def __init__(self, network, session_key, compress_mode=False, cipher_suite=constants.SUITE_EAX,
+                 wire_version=constants.WIRE_V1, is_client=True, dictionary=None, transcript=None):
+        """
+        :param network: AsyncWrapper
+        (see Session for the other parameters)
+        """
+        self.__wrapper = network
+        self.__loop = asyncio.get_running_loop()
+        self.__network = _SessionNetwork(network, self.__loop)
+        session.Session.__init__(self, self.__network, session_key, compress_mode, cipher_suite, wire_version,
+                                 is_client, dictionary, transcript)
+        self.__send_lock = asyncio.Lock()
+        self.__receive_lock = asyncio.Lock()
+
+    def get_wrapper(self):
+        """
+        Returns the session's connection
+        :return: AsyncWrapper
+        """
+        return self.__wrapper
+
+    def _call_later(self, delay, callback):
+        # auto batching flushes on the loop, after any send in progress
+        return self.__loop.call_later(delay, lambda: self.__loop.create_task(self.__send(callback)))
+
+    async def __send(self, send, *args):
+        """
+        Runs a session send on the loop and waits for the transport's buffer to drain
+        :param send: callable
+        :param args: send's arguments
+        """
+        async with self.__send_lock:
+            send(*args)
+            await self.__wrapper.drain()
+
+    async def __send_in_executor(self, send, *args):
+        """
+        Runs a session send on an executor thread (files)
+        :param send: callable
+        :param args: send's arguments
+        """
+        async with self.__send_lock:
+            await self.__loop.run_in_executor(None, send, *args)
+
+    async def __read_pack(self):
+        """
+        Reads a complete pack from the stream
+        :return: tuple (bytes, bool); the pack and whether it's complete (False for the header pack of a file sent
+                 in several packs, and for a segmented pack's header)
+        """
+        receive = self.__wrapper.receive
+        first = await receive(1)
+        if first[0] & session._V2_MARKER:
+            parts = [first]
+            data_type = first[0] & session._V2_TYPE_MASK
+            if data_type == constants.SEND_OBJECT or data_type == constants.SEND_LIST:
+                parts.append(await receive(1))
+            length = shift = 0
+            byte = session._V2_MARKER
+            while byte & 0x80:
+                if shift > 63:
+                    raise Exception("Invalid pack length")
+                part = await receive(1)
+                parts.append(part)
+                byte = part[0]
+                length |= (byte & 0x7f) << shift
+                shift += 7
+            parts.append(await receive(length + session._TAG_SIZE))
+            return b''.join(parts), True
+
+        header = await receive(first[0])
+        data_type = header[0]
+        is_complete = True
+        if data_type in (constants.SEND_BYTES, constants.SEND_TEXT, constants.SEND_BATCH, constants.SEND_TICKET):
+            body_length = sum(struct.unpack(session._BYTES_UNPACK_FORMAT, header)[2:])
+        elif data_type == constants.SEND_COMPLETE_FILE:
+            body_length = sum(struct.unpack(session._FILE_UNPACK_FORMAT, header)[2:])
+        elif data_type == constants.SEND_OBJECT or data_type == constants.SEND_LIST:
+            if len(header) == session._LEGACY_OBJECT_HEADER_SIZE:
+                body_length = struct.unpack(session._LEGACY_OBJECT_UNPACK_FORMAT, header)[2]
+            else:
+                body_length = sum(struct.unpack(session._OBJECT_UNPACK_FORMAT, header)[3:])
+        elif data_type == constants.SEND_FILE or data_type == constants.SEND_FILE_STREAM:
+            body_length = sum(struct.unpack(session._FILE_HEADER_UNPACK, header))
+            is_complete = False
+        elif data_type == constants.SEND_SEGMENTED:
+            # received and decrypted segment by segment on an executor thread
+            body_length = 0
+            is_complete = False
+        else:
+            body_length = 0
+
+        return first + header + await receive(body_length), is_complete
+
+    async def receive(self):
+        """
+        Receives data from node (server or client)
+        :return: DataType
+        """
+        async with self.__receive_lock:
+            if self.pending():
+                return session.Session.receive(self)
+            while True:
+                pack, is_complete = await self.__read_pack()
+                self.__network.load(pack)
+                if not is_complete:
+                    return await self.__loop.run_in_executor(None, session.Session.receive, self)
+                # a resumption ticket is taken in and the next pack is read
+                data = self._receive_pack()
+                if data is not session._SESSION_PACK:
+                    return data
+
+    async def receive_ticket(self):
+        """
+        Receives the resumption ticket the server sends before its first message (see Session.receive_ticket())
+        :return: Ticket or None
+        """
+        async with self.__receive_lock:
+            pack, is_complete = await self.__read_pack()
+            self.__network.load(pack)
+            if not is_complete:
+                return await self.__loop.run_in_executor(None, session.Session.receive_ticket, self)
+            return session.Session.receive_ticket(self)
+
+    def receive_stream(self, max_buffered=None):
+        """
+        Not supported: a stream's packs are read from the socket while it's read (see Session.receive_stream())
+        """
+        raise Exception("Streamed receive isn't supported by AsyncSession")
+
+    async def send_bytes(self, data):
+        """
+        Sends bytes
+        :param data: bytes
+        """
+        await self.__send(session.Session.send_bytes, self, data)
+
+    async def send_text(self, text:str):
+        """
+        Sends text
+        :param text: str
+        """
+        await self.__send(session.Session.send_text, self, text)
+
+    async def send_object(self, obj:dict):
+        """
+        Send a dictionary
+        :param obj: dict
+        """
+        await self.__send(session.Session.send_object, self, obj)
+
+    async def send_list(self, list_items:list):
+        """
+        Sends list or tuple
+        :param list_items: list, tuple
+        """
+        await self.__send(session.Session.send_list, self, list_items)
+
+    async def flush(self):
+        """
+        Sends the pending batch, if any
+        """
+        await self.__send(session.Session.flush, self)
+
+    async def issue_ticket(self, ticket_keys):
+        """
+        Sends the client a resumption ticket of this session
+        :param ticket_keys: TicketKeys; server's ticket keys
+        """
+        await self.__send(session.Session.issue_ticket, self, ticket_keys)
+
+    async def send_raw_file(self, filename:str, bin_file):
+        """
+        Sends complete file at once
+        :param filename: str; original file name
+        :param bin_file: bytes; file's content
+        """
+        await self.__send_in_executor(session.Session.send_raw_file, self, filename, bin_file)
+
+    async def send_file(self, path:str):
+        """
+        Sends a file from disk
+        :param path: str; file's path
+        """
+        await self.__send_in_executor(session.Session.send_file, self, path)
@@ -0,0 +1,125 @@
+import asyncio, struct
+
+"""
+ asyncio connections
+
+ AsyncWrapper is the asyncio counterpart of the socket wrapper: reads are coroutines, while writes go straight to the
+ transport's buffer (call `drain()` to wait until the buffer goes down). Idle connections cost no thread, so one
+ process can hold many thousands of them.
+"""
+
+
+class AsyncWrapper:
+    """
+    asyncio stream wrapper
+    """
+    def __init__(self, reader, writer):
+        """
+        :param reader: StreamReader
+        :param writer: StreamWriter
+        """
+        self.reader = reader
+        self.writer = writer
+        # buffers held while the wrapper is corked (see cork)
+        self.__corked = None
+        # bytes written to the transport and read from the stream (see metrics module)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def receive(self, length):
+        """
+        Receives exactly `length` bytes
+        :param length: int
+        :return: bytes
+        """
+        if length == 0:
+            return b''
+        if self.__corked:
+            self.__flush_corked()
+        try:
+            data = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise Exception("Connection is lost")
+        self.bytes_received += length
+        return data
+
+    async def read_header(self):
+        """
+        Returns pack's header segment
+        :return: bytes
+        """
+        header_length = struct.unpack("!B", await self.receive(1))[0]
+        return await self.receive(header_length)
+
+    def cork(self):
+        """
+        Holds written data until `uncork()` is called, so several packs reach the transport in one write (see
+        Wrapper.cork). Reading sends the held data first
+        """
+        if self.__corked is None:
+            self.__corked = []
+
+    def uncork(self):
+        """
+        Writes the held data to the transport and stops holding
+        """
+        self.__flush_corked()
+        self.__corked = None
+
+    def __flush_corked(self):
+        """
+        Writes the held data to the transport in one write
+        """
+        if self.__corked:
+            buffers, self.__corked = self.__corked, []
+            data = b''.join(buffers)
+            self.writer.write(data)
+            self.bytes_sent += len(data)
+
+    def send(self, data):
+        """
+        Writes data to the transport's buffer
+        :param data: bytes-like object
+        """
+        if self.__corked is not None:
+            self.__corked.append(bytes(data))
+        else:
+            self.writer.write(data)
+            self.bytes_sent += len(data)
+
+    def send_buffers(self, buffers):
+        """
+        Writes several buffers, in the given order, to the transport's buffer
+        :param buffers: list; bytes-like objects
+        """
+        if self.__corked is not None:
+            self.__corked.extend(bytes(buffer) for buffer in buffers)
+        else:
+            self.writer.writelines(buffers)
+            self.bytes_sent += sum(len(buffer) for buffer in buffers)
+
+    async def drain(self):
+        """
+        Waits until the transport's buffer is small enough to write more
+        """
+        await self.writer.drain()
+
+    async def write(self, buffers):
+        """
+        Writes several buffers and waits for the transport's buffer to drain
+        :param buffers: list; bytes-like objects
+        """
+        self.send_buffers(buffers)
+        await self.writer.drain()
+
+    def close(self):
+        """
+        Closes connection
+        """
+        self.writer.close()
+
+    async def wait_closed(self):
+        """
+        Waits until the connection is closed
+        """
+        await self.writer.wait_closed()
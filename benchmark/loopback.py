@@ -0,0 +1,262 @@
+import argparse, contextlib, datetime, json, os, pickle, platform, socket, tempfile, time
+import tabulate
+from Crypto.Hash import SHA256
+from Crypto.Signature import pss
+from .. import handshake, datatypes, reactor
+from ..service.baseserver import BaseServer
+from ..service.baseclient import BaseClient
+
+"""
+ Loopback benchmark
+
+ Runs a BaseServer and BaseClient over the loopback interface and measures the library end to end (handshake,
+ session, encryption, compression and the sockets), so changes to the session or handshake modules can be compared
+ between runs:
+ * handshakes/s - BaseClient connections per second, for each handshake mode: no certificate, and certificate
+   (measured with a cold certificate cache, and with the verified certificate cached, see handshake.CertificateCache)
+ * messages/s and MB/s - for each Session data type (bytes, text, object, list, raw file, chunked file), payload
+   size, and compression on and off. The client sends messages for a while and the time runs until the server
+   confirms it received all of them. Payloads are random hex text, which compresses to about half its size
+ The certificate is signed by a CA key generated for the run, the same way the CA server signs it.
+
+ Run: python -m <package>.benchmark.loopback [--sizes 64 1024 ...] [--types bytes text ...] [--duration SECONDS]
+                                            [--json] [--output FILE]
+ The JSON output (a document with the run's environment and results) is meant to be kept and compared over time.
+"""
+
+SIZES = (64, 1024, 16 * 1024, 256 * 1024, 1024 * 1024)
+TYPES = ("bytes", "text", "object", "list", "raw file", "file")
+# seconds each case is measured for
+DURATION = 1.0
+RSA_KEY_SIZE = 1024
+CA_KEY_SIZE = 2048
+# the client's last message of a case; the server confirms it got all the messages before it
+_DONE = "benchmark done"
+
+
+def __payload(size):
+    """
+    Returns a text payload of the given size (random hex, compresses to about half)
+    :param size: int; bytes
+    :return: str
+    """
+    return os.urandom(size // 2 + 1).hex()[:size]
+
+
+def __sender(session, data_type, size, directory):
+    """
+    Returns a function that sends one message of the given data type and size
+    :param session: Session
+    :param data_type: str; one of TYPES
+    :param size: int; payload size in bytes
+    :param directory: str; directory for the chunked file's source
+    :return: callable
+    """
+    text = __payload(size)
+    data = text.encode()
+    if data_type == "bytes":
+        return lambda: session.send_bytes(data)
+    elif data_type == "text":
+        return lambda: session.send_text(text)
+    elif data_type == "object":
+        return lambda: session.send_object({"data": text})
+    elif data_type == "list":
+        return lambda: session.send_list([text])
+    elif data_type == "raw file":
+        return lambda: session.send_raw_file("benchmark.bin", data)
+    elif data_type == "file":
+        path = os.path.join(directory, "benchmark-%d.bin" % size)
+        with open(path, "wb") as _file:
+            _file.write(data)
+        return lambda: session.send_file(path)
+    raise Exception("Unknown data type: {}".format(data_type))
+
+
+def __certificate(ca_key, rsa_key):
+    """
+    Signs a certificate of the server's key with the CA's key (as the CA server does)
+    :param ca_key: RSA key; CA's private key
+    :param rsa_key: RSA key; server's key
+    :return: dict; certificate and signature
+    """
+    current = datetime.datetime.now()
+    validity = (current - datetime.timedelta(minutes=1), current + datetime.timedelta(days=1))
+    serialized_cert = pickle.dumps(("benchmark", rsa_key.publickey().export_key(), validity))
+    return {"certificate": serialized_cert, "signature": pss.new(ca_key).sign(SHA256.new(serialized_cert))}
+
+
+class _Loopback:
+    """
+    A BaseServer listening on a free loopback port, run by its own reactor thread
+    """
+    def __init__(self, rsa_key, certificate=None):
+        """
+        :param rsa_key: RSA key; server's key
+        :param certificate: dict or None; server's certificate (certificate mode)
+        """
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+        self.__reactor = reactor.Reactor()
+        self.__server = BaseServer(rsa_key, event_loop=self.__reactor)
+        self.__server.set_cert_mode(certificate)
+        self.__server.handler = self.__sink
+
+    @staticmethod
+    def __sink(session):
+        """
+        Server's session handler; receives messages and confirms each client's last one, until the client closes
+        the connection
+        :param session: Session
+        """
+        try:
+            while True:
+                received = session.receive()
+                if isinstance(received, datatypes.Text) and received.get_data() == _DONE:
+                    session.send_text(_DONE)
+        except Exception:
+            pass
+
+    def __enter__(self):
+        # with a shared reactor start() returns once the server listens
+        self.__server.start("127.0.0.1", self.port)
+        self.__reactor.run_in_thread()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__server.stop()
+        self.__reactor.stop()
+
+    def connect(self, ca_public_key=None, compress=True):
+        """
+        Connects a new client
+        :param ca_public_key: RSA public key or None; CA's key (certificate mode)
+        :param compress: bool; whether the client's session compresses sent packs
+        :return: BaseClient
+        """
+        client = BaseClient()
+        if ca_public_key:
+            client.set_cert_mode(ca_public_key)
+        client.connect("127.0.0.1", self.port)
+        if not compress:
+            client.get_session().set_compression_policy(None)
+        return client
+
+
+def __close(client):
+    """
+    Closes a client's connection
+    :param client: BaseClient
+    """
+    client.get_wrapper().connection.close()
+
+
+def measure_handshakes(loopback, ca_public_key=None, cold_cache=False, duration=DURATION):
+    """
+    Connects clients back to back for a while
+    :param loopback: _Loopback; running server
+    :param ca_public_key: RSA public key or None; CA's key (certificate mode)
+    :param cold_cache: bool; clears the verified certificates cache before every connection
+    :param duration: float; seconds
+    :return: float; handshakes per second
+    """
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if cold_cache:
+            handshake.certificate_cache.clear()
+        __close(loopback.connect(ca_public_key))
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def measure_messages(loopback, data_type, size, compress, directory, duration=DURATION):
+    """
+    Sends messages of one data type and size over a new connection for a while
+    :param loopback: _Loopback; running server
+    :param data_type: str; one of TYPES
+    :param size: int; payload size in bytes
+    :param compress: bool; compression on or off
+    :param directory: str; directory for the chunked file's source
+    :param duration: float; seconds
+    :return: tuple (float, float); messages per second and MB per second
+    """
+    client = loopback.connect(compress=compress)
+    try:
+        session = client.get_session()
+        send = __sender(session, data_type, size, directory)
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            send()
+            count += 1
+        session.send_text(_DONE)
+        session.receive()
+        elapsed = time.perf_counter() - start
+    finally:
+        __close(client)
+    return count / elapsed, count * size / elapsed / (1024 * 1024)
+
+
+def run(sizes=SIZES, types=TYPES, duration=DURATION):
+    """
+    Runs the benchmark. The services' connection logs are discarded while it runs
+    :param sizes: iterable; payload sizes in bytes
+    :param types: iterable; data types (see TYPES)
+    :param duration: float; seconds per case
+    :return: dict; the run's environment, and the handshakes and messages results
+    """
+    rsa_key = handshake.generate_rsa_keys(RSA_KEY_SIZE)
+    ca_key = handshake.generate_rsa_keys(CA_KEY_SIZE)
+    certificate = __certificate(ca_key, rsa_key)
+    handshakes = []
+    messages = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            tempfile.TemporaryDirectory() as directory:
+        with _Loopback(rsa_key) as loopback:
+            handshakes.append({"mode": "no certificate",
+                               "handshakes_per_sec": round(measure_handshakes(loopback, duration=duration), 1)})
+            for data_type in types:
+                for size in sizes:
+                    for compress in (False, True):
+                        rate, throughput = measure_messages(loopback, data_type, size, compress, directory, duration)
+                        messages.append({"type": data_type, "size": size, "compression": compress,
+                                         "messages_per_sec": round(rate, 1), "mb_per_sec": round(throughput, 2)})
+        with _Loopback(rsa_key, certificate) as loopback:
+            for mode, cold_cache in (("certificate", True), ("certificate (cached)", False)):
+                rate = measure_handshakes(loopback, ca_key.publickey(), cold_cache, duration)
+                handshakes.append({"mode": mode, "handshakes_per_sec": round(rate, 1)})
+
+    return {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "duration": duration, "handshakes": handshakes, "messages": messages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback client-server benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="payload sizes in bytes")
+    parser.add_argument("--types", nargs="+", default=TYPES, choices=TYPES, help="data types")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per case")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.types, args.duration)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(tabulate.tabulate([[result["mode"], result["handshakes_per_sec"]] for result in results["handshakes"]],
+                                headers=["handshake", "handshakes/s"]))
+        print()
+        print(tabulate.tabulate([[result["type"], result["size"], "on" if result["compression"] else "off",
+                                  result["messages_per_sec"], result["mb_per_sec"]]
+                                 for result in results["messages"]],
+                                headers=["data type", "size", "compression", "messages/s", "MB/s"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse, json
+import tabulate
+from .. import ciphers
+
+"""
+ Cipher suites benchmark
+
+ Measures the encryption throughput (MB/s) of every supported cipher suite across payload sizes on the local
+ machine. Small payloads mostly measure the per-message cost (cipher setup, nonce, MAC); large payloads measure
+ the cipher itself.
+
+ Run: python -m <package>.benchmark.suites [--sizes 64 1024 ...] [--total MB] [--json]
+"""
+
+SIZES = (64, 256, 1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024)
+# bytes encrypted per measurement
+TOTAL_SIZE = 32 * 1024 * 1024
+
+
+def run(sizes=SIZES, total_size=TOTAL_SIZE):
+    """
+    Runs the benchmark
+    :param sizes: iterable; payload sizes in bytes
+    :param total_size: int; bytes to encrypt for each suite and size
+    :return: list; dict per suite and size
+    """
+    results = []
+    for suite_id, suite in ciphers.SUITES.items():
+        for size in sizes:
+            rounds = max(1, total_size // size)
+            results.append({"suite": suite.name, "size": size,
+                            "mb_per_sec": round(ciphers.measure_throughput(suite_id, size, rounds), 2)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cipher suites throughput benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="payload sizes in bytes")
+    parser.add_argument("--total", type=int, default=TOTAL_SIZE // (1024 * 1024),
+                        help="MB to encrypt per suite and size")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.total * 1024 * 1024)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        names = [suite.name for suite in ciphers.SUITES.values()]
+        rows = [[size] + [result["mb_per_sec"] for name in names for result in results
+                          if result["suite"] == name and result["size"] == size] for size in args.sizes]
+        print(tabulate.tabulate(rows, headers=["size (bytes)"] + [name + " MB/s" for name in names]))
+        print("preferred order: " + ", ".join(ciphers.get_suite(suite_id).name
+                                                for suite_id in ciphers.preferred_suites()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import struct, socket
 from . import ca_consts
-from .. import socket_wrapper as sw
+from .. import sock as sw
 from Crypto.Cipher import PKCS1_OAEP
 
 class ClientCredentials:
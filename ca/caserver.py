@@ -1,6 +1,7 @@
 import struct, socket, threading, datetime, pickle
 from . import ca_consts
-from ..sock import  Wrapper, NonBlockingSocket
+from ..sock import  Wrapper
+from .. import reactor, metrics
 from .models import database as db
 from .models import client as db_client
 from Crypto.Cipher import PKCS1_OAEP
@@ -56,11 +57,13 @@ class CAServer:
     * Anyone who wishes to verify certificates granted by the CA server must know the up to date
       CA server public key in advance
     """
-    def __init__(self, ip, port, key):
+    def __init__(self, ip, port, key, event_loop=None):
         """
         :param ip: str; server's ip address
         :param port: int; server's port number
         :param key: bytes; server's private and public key pair
+        :param event_loop: Reactor; shared reactor that accepts the connections. The server runs its own (on a thread
+                           of its own) if not provided
         """
         self.__private_key = self.__public_key = None
         self.set_keys(key)
@@ -68,6 +71,8 @@ class CAServer:
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__bind(ip, port)
         self.__is_running = False
+        self.__owns_reactor = event_loop is None
+        self.__reactor = event_loop or reactor.Reactor()
 
     def get_database(self):
         """
@@ -91,7 +96,7 @@ class CAServer:
         """
         try:
             self.__socket.bind((ip, port))
-            self.__socket.listen(5)
+            self.__socket.listen(socket.SOMAXCONN)
         except socket.error as e:
             print (e)
 
@@ -100,13 +105,19 @@ class CAServer:
         Starts listening to connections
         """
         self.__is_running = True
-        threading.Thread(target=self.__accept_connections).start()
+        self.__socket.setblocking(False)
+        self.__reactor.register(self.__socket, reactor.EVENT_READ, self.__accept_connections)
+        if self.__owns_reactor:
+            self.__reactor.run_in_thread()
 
     def stop(self):
         """
         Stops server
         """
         self.__is_running = False
+        self.__reactor.unregister(self.__socket)
+        if self.__owns_reactor:
+            self.__reactor.stop()
 
     def close(self):
         """
@@ -116,18 +127,21 @@ class CAServer:
             self.stop()
         self.__socket.close()
 
-    def __accept_connections(self):
+    def __accept_connections(self, server_socket, mask):
         """
-        Accepts new connections
+        Accepts new connections (called by the reactor when the socket is readable)
+        :param server_socket: socket; listening socket
+        :param mask: int; ready events
         """
-        wrap = NonBlockingSocket(self.__socket)
         while self.__is_running:
-            wrap.select()
-            if wrap.is_readable():
-                connection, addr = self.__socket.accept()
-                print(addr)
-                # handles new requests
-                threading.Thread(target=self.__handle_certificate_request, args=(Wrapper(connection),)).start()
+            try:
+                connection, addr = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            connection.setblocking(True)
+            print(addr)
+            # handles new requests
+            threading.Thread(target=self.__handle_certificate_request, args=(Wrapper(connection),)).start()
 
     def __handle_certificate_request(self, network):
         """
@@ -135,17 +149,18 @@ class CAServer:
         :param network: Wrapper; socket wrapper
         :return: None
         """
-        cipher = PKCS1_OAEP.new(self.__private_key)
-        header = network.read_header()
-        id_len, password_len, key_len = struct.unpack("! x I I I", header)
-        client_id = (cipher.decrypt(network.receive(id_len))).decode("utf-8")
-        password = (cipher.decrypt(network.receive(password_len))).decode("utf-8")
-        public_key = network.receive(key_len)
-        client = self.__database.get(client_id)
-        if client and self.__database.verify_client(client.id, password):
-            self.__grant_certificate(client.id, public_key, network)
-        else:
-            network.send(struct.pack("!B B", 1, ca_consts.CERTIFICATE_DENIED))
+        with metrics.active_session("ca"):
+            cipher = PKCS1_OAEP.new(self.__private_key)
+            header = network.read_header()
+            id_len, password_len, key_len = struct.unpack("! x I I I", header)
+            client_id = (cipher.decrypt(network.receive(id_len))).decode("utf-8")
+            password = (cipher.decrypt(network.receive(password_len))).decode("utf-8")
+            public_key = network.receive(key_len)
+            client = self.__database.get(client_id)
+            if client and self.__database.verify_client(client.id, password):
+                self.__grant_certificate(client.id, public_key, network)
+            else:
+                network.send(struct.pack("!B B", 1, ca_consts.CERTIFICATE_DENIED))
 
     def __grant_certificate(self, client_id, client_public_key, network):
         """
@@ -0,0 +1,158 @@
+import abc, os, time
+from . import constants
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Hash import SHA256
+
+"""
+ Cipher suites
+
+ The session's traffic is encrypted with an AEAD cipher agreed during the handshake. The server offers the suites
+ it supports and the client picks the first of its preferred suites that is offered. EAX is always supported
+ so peers that don't negotiate keep working.
+ * EAX - AES in EAX mode. Two passes over the data (CTR + OMAC); the protocol's original mode
+ * GCM - AES in GCM mode. One pass, uses AES-NI and carry-less multiplication where available
+ * ChaCha20-Poly1305 - fast on machines without AES hardware support. Uses 24 bytes nonces (XChaCha20), so random
+   nonces are safe to use
+"""
+
+
+class CipherSuite(abc.ABC):
+    """
+    AEAD cipher suite. Subclasses implement `new()`
+    """
+    def __init__(self, suite_id, name, key_size, nonce_size):
+        """
+        :param suite_id: int; suite's id on the wire
+        :param name: str; display name
+        :param key_size: int; cipher key size in bytes
+        :param nonce_size: int; nonce size in bytes
+        """
+        self.id = suite_id
+        self.name = name
+        self.key_size = key_size
+        self.nonce_size = nonce_size
+
+    def derive_key(self, session_key):
+        """
+        Returns the cipher key for a session key. A session key of the suite's key size is used as is
+        :param session_key: bytes; the key exchanged during the handshake
+        :return: bytes
+        """
+        if len(session_key) == self.key_size:
+            return session_key
+        return HKDF(session_key, self.key_size, b'', SHA256, context=self.name.encode("utf-8"))
+
+    def derive_traffic_key(self, session_key, transcript):
+        """
+        Returns the cipher key of a connection's v2 packs, bound to the handshake's transcript
+        :param session_key: bytes; the key exchanged during the handshake
+        :param transcript: bytes; the handshake's offer and selection
+        :return: bytes
+        """
+        return HKDF(session_key, self.key_size, b'', SHA256,
+                    context=b"SDTP v2 traffic key " + self.name.encode("utf-8") + transcript)
+
+    @abc.abstractmethod
+    def new(self, key, nonce=None):
+        """
+        Returns a new cipher object
+        :param key: bytes; cipher key (see derive_key)
+        :param nonce: bytes; None for a random nonce
+        :return: cipher object
+        """
+
+
+class AESSuite(CipherSuite):
+    """
+    AES based suite
+    """
+    def __init__(self, suite_id, name, mode):
+        """
+        :param suite_id: int
+        :param name: str
+        :param mode: int; AES mode
+        """
+        CipherSuite.__init__(self, suite_id, name, 16, 16)
+        self.__mode = mode
+
+    def new(self, key, nonce=None):
+        return AES.new(key, self.__mode, nonce if nonce is not None else os.urandom(self.nonce_size))
+
+
+class ChaChaSuite(CipherSuite):
+    """
+    ChaCha20-Poly1305 suite
+    """
+    def __init__(self):
+        CipherSuite.__init__(self, constants.SUITE_CHACHA20_POLY1305, "ChaCha20-Poly1305", 32, 24)
+
+    def new(self, key, nonce=None):
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce if nonce is not None else os.urandom(self.nonce_size))
+
+
+SUITES = {
+    constants.SUITE_EAX: AESSuite(constants.SUITE_EAX, "AES-EAX", AES.MODE_EAX),
+    constants.SUITE_GCM: AESSuite(constants.SUITE_GCM, "AES-GCM", AES.MODE_GCM),
+    constants.SUITE_CHACHA20_POLY1305: ChaChaSuite()
+}
+
+# measured preference order of this machine (see preferred_suites)
+__preference = None
+
+
+def get_suite(suite_id):
+    """
+    Returns a cipher suite by its id. Raises exception if the suite isn't supported
+    :param suite_id: int
+    :return: CipherSuite
+    """
+    if suite_id not in SUITES:
+        raise Exception("Unsupported cipher suite")
+    return SUITES[suite_id]
+
+
+def measure_throughput(suite_id, size, rounds=1):
+    """
+    Measures encryption throughput of a suite on this machine
+    :param suite_id: int
+    :param size: int; payload size in bytes
+    :param rounds: int; number of payloads to encrypt
+    :return: float; MB per second
+    """
+    suite = get_suite(suite_id)
+    key = os.urandom(suite.key_size)
+    data = os.urandom(size)
+    start = time.perf_counter()
+    for i in range(rounds):
+        suite.new(key).encrypt_and_digest(data)
+    elapsed = time.perf_counter() - start
+
+    return size * rounds / elapsed / (1024 * 1024) if elapsed else float("inf")
+
+
+def preferred_suites():
+    """
+    Returns all supported suites ordered from fastest to slowest on this machine.
+    The order is measured once, on first use, with a short encryption run of each suite
+    :return: tuple; suite ids
+    """
+    global __preference
+    if __preference is None:
+        speeds = {suite_id: measure_throughput(suite_id, 256 * 1024, 4) for suite_id in SUITES}
+        __preference = tuple(sorted(SUITES, key=lambda suite_id: speeds[suite_id], reverse=True))
+    return __preference
+
+
+def choose_suite(offered, preference=None):
+    """
+    Chooses the first preferred suite that is offered by the other side
+    :param offered: iterable; suite ids offered by the server
+    :param preference: iterable; suite ids in order of preference (measured order if not provided)
+    :return: int; suite id (EAX if no preferred suite is offered)
+    """
+    offered = set(offered)
+    for suite_id in preference if preference is not None else preferred_suites():
+        if suite_id in offered:
+            return suite_id
+    return constants.SUITE_EAX
@@ -0,0 +1,334 @@
+import zlib, time, threading, collections
+from . import constants
+
+"""
+ Compression policy
+
+ Compressing every pack isn't always worth it: small packs grow under zlib and already compressed data (images,
+ archives, media) doesn't shrink. The policy decides per pack:
+ * Packs under a size threshold are sent as is
+ * Large packs are probed first by compressing a small sample with the fastest level. An incompressible sample
+   skips the pack
+ * Each data type is compressed with its own level (fast levels for files, better ones for text and objects)
+ * Packs that don't shrink are sent as is
+ The policy records the achieved ratio and compression time per data type. When the recent ratio of a data type
+ isn't paying off, compression turns itself off for that data type and is probed again after a number of packs.
+
+ Compression streams
+
+ Small messages compress badly on their own because every zlib.compress call starts from an empty window.
+ In stream mode each direction keeps one compression context (compressobj/decompressobj) for all small packs
+ (bytes, text, objects and lists), and every pack ends with a sync flush, so repeated structures are referenced
+ from previous packs. A preset dictionary (zdict) agreed during the handshake can fill the window in advance.
+ Dictionaries are registered on both sides under the same id (1-255); train one from traffic samples with
+ train_dictionary() or the tools/train_dictionary script.
+"""
+
+# pack compression (the value is sent in the pack's header)
+NONE = 0
+ZLIB = 1
+STREAM = 2
+# every sync flush ends with an empty stored block; it's removed before sending and restored before decompressing
+_SYNC_TAIL = b'\x00\x00\xff\xff'
+# zlib's window size, larger dictionaries aren't useful
+DICTIONARY_SIZE = 32 * 1024
+
+DEFAULT_LEVEL = 6
+DEFAULT_LEVELS = {
+    constants.SEND_COMPLETE_FILE: 1,
+    constants.SEND_FILE_STREAM: 1
+}
+# packs under this size (bytes) aren't compressed
+MIN_SIZE = 256
+# sample size of the probe (packs smaller than twice the sample are compressed directly)
+PROBE_SIZE = 4096
+# compressed / original size above which compression isn't paying off
+MAX_RATIO = 0.9
+# weight of the most recent pack in the moving ratio
+_RATIO_WEIGHT = 0.2
+# packs of a data type to compress before the moving ratio is trusted
+_WARMUP = 8
+# packs sent as is before a disabled data type is probed again
+RETRY_AFTER = 64
+
+
+__dictionaries = collections.OrderedDict()
+
+
+def register_dictionary(dictionary_id, dictionary):
+    """
+    Registers a preset dictionary. Both sides must register the same dictionary under the same id
+    :param dictionary_id: int; 1-255
+    :param dictionary: bytes; the most useful content should be at the end
+    """
+    if not 0 < dictionary_id < 256:
+        raise Exception("Dictionary id must be between 1 and 255")
+    __dictionaries[dictionary_id] = bytes(dictionary[-DICTIONARY_SIZE:])
+
+
+def get_dictionary(dictionary_id):
+    """
+    Returns a registered dictionary. Raises exception if it isn't registered
+    :param dictionary_id: int
+    :return: bytes
+    """
+    if dictionary_id not in __dictionaries:
+        raise Exception("Unknown compression dictionary")
+    return __dictionaries[dictionary_id]
+
+
+def dictionary_ids():
+    """
+    Returns the ids of the registered dictionaries, in registration order
+    :return: tuple
+    """
+    return tuple(__dictionaries)
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE, k=8, min_share=0.05):
+    """
+    Builds a preset dictionary out of traffic samples.
+    Finds byte sequences built of k bytes long substrings that appear in many samples, scores each sequence by the
+    number of samples its substrings appear in, and packs the best ones so the best is at the end (closest to the
+    data, cheapest to reference).
+    :param samples: iterable; samples (bytes), each one a typical pack's payload
+    :param size: int; max dictionary size
+    :param k: int; length of the counted substrings
+    :param min_share: float; min part of the samples a substring must appear in
+    :return: bytes
+    """
+    samples = [bytes(sample) for sample in samples if len(sample) >= k]
+    if not samples:
+        return b''
+    # number of samples each substring appears in
+    frequency = collections.Counter()
+    for sample in samples:
+        frequency.update({sample[i:i + k] for i in range(len(sample) - k + 1)})
+    min_count = max(2, int(len(samples) * min_share))
+
+    # runs of common substrings form the candidate segments
+    segments = set()
+    for sample in samples:
+        start = None
+        for i in range(len(sample) - k + 2):
+            is_common = i <= len(sample) - k and frequency[sample[i:i + k]] >= min_count
+            if is_common and start is None:
+                start = i
+            elif not is_common and start is not None:
+                segments.add(sample[start:i - 1 + k])
+                start = None
+
+    def score(segment):
+        return sum(frequency[substring] for substring in {segment[i:i + k] for i in range(len(segment) - k + 1)})
+
+    # substrings already in the dictionary; segments that mostly repeat them are skipped
+    covered = set()
+    chosen = []
+    dictionary_size = 0
+    for segment in sorted(segments, key=score, reverse=True):
+        if dictionary_size + len(segment) > size:
+            continue
+        substrings = {segment[i:i + k] for i in range(len(segment) - k + 1)}
+        if len(substrings - covered) * 2 < len(substrings):
+            continue
+        covered |= substrings
+        chosen.append(segment)
+        dictionary_size += len(segment)
+
+    return b''.join(reversed(chosen))
+
+
+class CompressionStream:
+    """
+    Compression context of one direction, kept across packs
+    """
+    def __init__(self, level=DEFAULT_LEVEL, dictionary=None):
+        """
+        :param level: int; zlib level
+        :param dictionary: bytes; preset dictionary
+        """
+        if dictionary:
+            self.__compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            self.__compressor = zlib.compressobj(level)
+
+    def compress(self, data):
+        """
+        Compresses a pack's payload. Every compressed payload must be decompressed, in order, by the other side
+        :param data: bytes-like object
+        :return: bytes
+        """
+        compressed = self.__compressor.compress(data) + self.__compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressed[:-len(_SYNC_TAIL)] if compressed.endswith(_SYNC_TAIL) else compressed
+
+
+class DecompressionStream:
+    """
+    Decompression context of one direction, kept across packs
+    """
+    def __init__(self, dictionary=None):
+        """
+        :param dictionary: bytes; preset dictionary
+        """
+        if dictionary:
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            self.__decompressor = zlib.decompressobj()
+
+    def decompress(self, data, max_length=0):
+        """
+        Decompresses a pack's payload
+        :param data: bytes-like object
+        :param max_length: int; max size of the decompressed payload (0 for no limit). Raises exception if it's larger
+        :return: bytes
+        """
+        data = self.__decompressor.decompress(bytes(data) + _SYNC_TAIL, max_length)
+        if self.__decompressor.unconsumed_tail:
+            raise Exception("Decompressed payload is too large")
+        return data
+
+
+class CompressionStats:
+    """
+    Compression statistics of a data type
+    """
+    def __init__(self):
+        self.packs = 0
+        # packs that went through zlib (whether they shrank or not)
+        self.attempted_packs = 0
+        self.skipped_packs = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compression_time = 0.0
+        # moving compressed / original size ratio
+        self.ratio = None
+        self.is_enabled = True
+        # packs left to send as is while compression is off
+        self.skips_left = 0
+
+    def as_dict(self):
+        """
+        Returns the statistics
+        :return: dict
+        """
+        return {"packs": self.packs, "attempted_packs": self.attempted_packs,
+                "skipped_packs": self.skipped_packs, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "compression_time": self.compression_time, "ratio": self.ratio, "enabled": self.is_enabled}
+
+
+class CompressionPolicy:
+    """
+    Decides whether and how each pack is compressed, and turns compression off where it doesn't pay off
+    """
+    def __init__(self, min_size=MIN_SIZE, levels=None, probe_size=PROBE_SIZE, max_ratio=MAX_RATIO,
+                 retry_after=RETRY_AFTER):
+        """
+        :param min_size: int; packs under this size aren't compressed
+        :param levels: dict; data type (SEND_* constant) -> zlib level, added to the default levels
+        :param probe_size: int; probe sample size, 0 to compress without probing
+        :param max_ratio: float; compressed / original size above which compression isn't paying off
+        :param retry_after: int; packs sent as is before a disabled data type is probed again
+        """
+        self.min_size = min_size
+        self.levels = dict(DEFAULT_LEVELS)
+        self.levels.update(levels or {})
+        self.probe_size = probe_size
+        self.max_ratio = max_ratio
+        self.retry_after = retry_after
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def get_stats(self):
+        """
+        Returns compression statistics per data type
+        :return: dict; data type -> dict
+        """
+        with self.__lock:
+            return {data_type: stats.as_dict() for data_type, stats in self.__stats.items()}
+
+    def __get_stats(self, data_type):
+        """
+        Returns a data type's statistics, creates them on first use
+        :param data_type: int
+        :return: CompressionStats
+        """
+        stats = self.__stats.get(data_type)
+        if stats is None:
+            stats = self.__stats[data_type] = CompressionStats()
+        return stats
+
+    def __should_compress(self, data, stats, is_stream):
+        """
+        Decides whether a pack should be compressed (before compressing it)
+        :param data: bytes-like object
+        :param stats: CompressionStats; pack's data type statistics
+        :param is_stream: bool; whether the pack would go through a compression stream
+        :return: bool
+        """
+        # small packs are the ones that gain from a stream's window
+        if len(data) < self.min_size and not is_stream:
+            return False
+        if not stats.is_enabled:
+            stats.skips_left -= 1
+            if stats.skips_left > 0:
+                return False
+            # probes the data type again
+            stats.is_enabled = True
+            stats.ratio = None
+        if self.probe_size and len(data) >= self.probe_size * 2:
+            sample = data[:self.probe_size]
+            if len(zlib.compress(sample, 1)) > len(sample) * self.max_ratio:
+                return False
+        return True
+
+    def __record(self, stats, size, compressed_size, elapsed):
+        """
+        Records a compressed pack and turns compression off for its data type if it isn't paying off
+        :param stats: CompressionStats
+        :param size: int; original size
+        :param compressed_size: int
+        :param elapsed: float; compression time in seconds
+        """
+        stats.attempted_packs += 1
+        stats.compression_time += elapsed
+        ratio = compressed_size / size
+        stats.ratio = ratio if stats.ratio is None else stats.ratio + (ratio - stats.ratio) * _RATIO_WEIGHT
+        if stats.attempted_packs >= _WARMUP and stats.ratio > self.max_ratio:
+            stats.is_enabled = False
+            stats.skips_left = self.retry_after
+
+    def compress(self, data, data_type, stream=None):
+        """
+        Compresses a pack's payload if the policy decides it's worth it
+        :param data: bytes-like object
+        :param data_type: int; pack's type (SEND_* constant)
+        :param stream: CompressionStream; the direction's compression stream, None for one-shot compression.
+                       Once a payload goes through the stream it's sent compressed even if it didn't shrink,
+                       since it's part of the stream's window
+        :return: tuple (bytes, int); the payload to send and its compression (NONE, ZLIB or STREAM)
+        """
+        with self.__lock:
+            stats = self.__get_stats(data_type)
+            stats.packs += 1
+            stats.bytes_in += len(data)
+            should_compress = self.__should_compress(data, stats, stream is not None)
+
+        result, compression = data, NONE
+        if should_compress:
+            start = time.perf_counter()
+            if stream is not None:
+                result = compressed = stream.compress(data)
+                compression = STREAM
+            else:
+                compressed = zlib.compress(data, self.levels.get(data_type, DEFAULT_LEVEL))
+                if len(compressed) < len(data):
+                    result, compression = compressed, ZLIB
+            elapsed = time.perf_counter() - start
+        with self.__lock:
+            if should_compress:
+                self.__record(stats, len(data), len(compressed), elapsed)
+            else:
+                stats.skipped_packs += 1
+            stats.bytes_out += len(result)
+
+        return result, compression
@@ -5,8 +5,50 @@ SEND_LIST = LIST = 4
 SEND_OBJECT = OBJECT = 5
 SEND_COMPLETE_FILE = FILE = 6
 SAVED_FILE = 7
+SEND_FILE_STREAM = 8
+SEND_BATCH = 9
+SEND_SEGMENTED = 10
+# resumption ticket (see tickets module)
+SEND_TICKET = 11
+# data type of payloads received as they're read (see Session.receive_stream())
+STREAM = 12
 
 SEND_CERTIFICATE = 0
 CERT_FAILED = 1
 CERT_SUCCEEDED = 2
-SEND_SESSION_KEY = 3
\ No newline at end of file
+SEND_SESSION_KEY = 3
+SEND_OFFER = 4
+# sent instead of the handshake's first pack when the server is overloaded
+SERVER_BUSY = 5
+SEND_KEY_SHARE = 6
+# session resumption (see tickets module)
+SEND_RESUME = 7
+RESUME_ACCEPTED = 8
+RESUME_REJECTED = 9
+
+# key exchange methods
+KEY_EXCHANGE_RSA = 0
+KEY_EXCHANGE_ECDH = 1
+
+# handshake options (offered by the server, selected by the client)
+OPTION_CIPHER_SUITES = 0
+OPTION_WIRE_VERSIONS = 1
+OPTION_DICTIONARIES = 2
+# random value of a server that accepts resumption tickets
+OPTION_SERVER_RANDOM = 3
+# random value of the server, offered with wire format v2 (bound into the v2 traffic key, see session module)
+OPTION_CONNECTION_RANDOM = 4
+
+# cipher suites
+SUITE_EAX = 0
+SUITE_GCM = 1
+SUITE_CHACHA20_POLY1305 = 2
+
+# wire format versions
+WIRE_V1 = 1
+WIRE_V2 = 2
+
+# serializers
+SERIALIZER_PICKLE = 0
+SERIALIZER_MARSHAL = 1
+SERIALIZER_JSON = 2
@@ -1,4 +1,4 @@
-from . import constants
+from . import constants, disksink
 import os
 
 class DataType:
@@ -62,3 +62,121 @@ class List(DataType):
 
     def length(self):
         return len(self.get_data())
+
+class Stream(DataType):
+    """
+    A file or a large payload received as it's read (see Session.receive_stream()). File-like and iterable (yields
+    bytes); text payloads are read as their UTF-8 bytes. Must be read to its end (or closed) before the session's next
+    message is received; a stream left unread is read and discarded then
+    """
+    def __init__(self, name, size, payload_type, pieces):
+        """
+        :param name: str or None; file's name (None for bytes and text)
+        :param size: int or None; payload's size (None if it's compressed and its size is known only once it's read)
+        :param payload_type: int; FILE, BYTES or TEXT
+        :param pieces: iterator; the payload's pieces, received as they're taken
+        """
+        DataType.__init__(self, constants.STREAM, None)
+        self.__name = name
+        self.__size = size
+        self.__payload_type = payload_type
+        self.__pieces = pieces
+        self.__pending = memoryview(b'')
+        self.__received = 0
+
+    def get_name(self):
+        return self.__name
+
+    def get_size(self):
+        return self.__size
+
+    def get_payload_type(self):
+        return self.__payload_type
+
+    def get_received(self):
+        """
+        Returns the number of the payload's bytes handed over so far
+        :return: int
+        """
+        return self.__received
+
+    def __next_piece(self):
+        """
+        Takes the next received piece
+        :return: bool; False once the payload was read to its end
+        """
+        if self.__pieces is None:
+            return False
+        for piece in self.__pieces:
+            if len(piece):
+                self.__pending = memoryview(piece)
+                return True
+        self.__pieces = None
+        return False
+
+    def readinto(self, buffer):
+        """
+        Receives the payload's next bytes into a buffer
+        :param buffer: writable bytes-like object
+        :return: int; number of bytes read, 0 at the payload's end
+        """
+        view = memoryview(buffer).cast("B")
+        if not self.__pending and not self.__next_piece():
+            return 0
+        length = min(len(view), len(self.__pending))
+        view[:length] = self.__pending[:length]
+        self.__pending = self.__pending[length:]
+        self.__received += length
+        return length
+
+    def read(self, size=-1):
+        """
+        Receives the payload's next bytes
+        :param size: int; max bytes to read; -1 reads the rest of the payload (held in memory)
+        :return: bytes; empty at the payload's end
+        """
+        if size is None or size < 0:
+            return b''.join(iter(self))
+        if not self.__pending and not self.__next_piece():
+            return b''
+        data = bytes(self.__pending[:size])
+        self.__pending = self.__pending[len(data):]
+        self.__received += len(data)
+        return data
+
+    def __iter__(self):
+        while self.__pending or self.__next_piece():
+            data = bytes(self.__pending)
+            self.__pending = memoryview(b'')
+            self.__received += len(data)
+            yield data
+
+    def save(self, path=None):
+        """
+        Writes the rest of the payload to a file, piece by piece. The file is written under a temporary name and
+        moved to its path only once the payload is read to its end and verified, so a failed transfer leaves no file
+        behind (see disksink module)
+        :param path: str; file's path (the file's name in the package's directory if not provided)
+        """
+        if not path:
+            if not self.__name:
+                raise Exception("Payload has no file name")
+            # the name is the sender's; it's not allowed to point outside the directory
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.basename(self.__name))
+        size = self.__size - self.__received if self.__size is not None else None
+        with disksink.DiskSink(path, size) as sink:
+            for data in self:
+                sink.write(data)
+
+    def close(self):
+        """
+        Reads and discards the rest of the payload (the payload is still verified)
+        """
+        for data in self:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
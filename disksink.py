@@ -0,0 +1,231 @@
+import os, queue, shutil, threading
+
+"""
+ Disk sink
+
+ Writes a received file to disk without stalling the receiving thread on disk I/O: received data is collected into
+ writes of a few MB and handed to a write-behind thread, which writes them at their offsets (pwrite). The file is
+ written under a temporary name in the target directory, preallocated to the announced size where the platform
+ supports it (posix_fallocate), and moved to its name (atomic rename) only once it's complete, so a failed transfer
+ leaves no partial file behind. The announced size is the sender's word, so only sizes up to max_preallocate that
+ leave some of the disk free are preallocated; larger files are extended by their writes as they arrive.
+ fsync policies:
+ * FSYNC_NONE - the data is left to the OS to flush (fastest; the file may be lost or incomplete after a crash)
+ * FSYNC_COMMIT - the file is flushed before it's renamed, and the directory after (the file is on disk once it
+   appears under its name)
+ * FSYNC_PERIODIC - same as FSYNC_COMMIT, and the file is also flushed every interval bytes while it's written, so
+   the flush at the end is short and dirty pages don't pile up
+"""
+
+FSYNC_NONE = 0
+FSYNC_COMMIT = 1
+FSYNC_PERIODIC = 2
+# bytes written between flushes (FSYNC_PERIODIC)
+FSYNC_INTERVAL = 64 * 1024 * 1024
+# received data is collected into writes of this size
+WRITE_SIZE = 4 * 1024 * 1024
+# max writes waiting for the write-behind thread; the receiving thread waits once they're queued
+_QUEUE_DEPTH = 4
+# max size preallocated (bytes)
+MAX_PREALLOCATE = 256 * 1024 * 1024
+# part of the disk's free space a preallocation may take
+_PREALLOCATE_SHARE = 0.5
+
+
+def _pwrite(fd, data, offset):
+    """
+    Writes all the data at the given offset
+    :param fd: int; file descriptor
+    :param data: bytes-like object
+    :param offset: int
+    """
+    view = memoryview(data).cast("B")
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+class DiskSink:
+    """
+    A file written to disk on a write-behind thread and moved into place once complete
+    """
+    def __init__(self, path, total_size=None, fsync=FSYNC_NONE, fsync_interval=FSYNC_INTERVAL,
+                 write_size=WRITE_SIZE, max_preallocate=MAX_PREALLOCATE):
+        """
+        :param path: str; file's path
+        :param total_size: int or None; file's announced size, preallocated on disk (up to max_preallocate)
+        :param fsync: int; FSYNC_NONE, FSYNC_COMMIT or FSYNC_PERIODIC
+        :param fsync_interval: int; bytes written between flushes (FSYNC_PERIODIC)
+        :param write_size: int; received data is collected into writes of this size
+        :param max_preallocate: int; max size preallocated; 0 turns preallocation off
+        """
+        self.path = path
+        directory, name = os.path.split(os.path.abspath(path))
+        self.__directory = directory
+        self.__temp_path = os.path.join(directory, ".{}.{}.part".format(name, os.urandom(4).hex()))
+        self.__fd = os.open(self.__temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0),
+                            0o666)
+        self.__total_size = total_size
+        self.__fsync = fsync
+        self.__fsync_interval = fsync_interval
+        self.__write_size = write_size
+        self.__pending = bytearray()
+        self.__offset = 0
+        self.__error = None
+        self.__queue = queue.Queue(_QUEUE_DEPTH)
+        if total_size and total_size <= max_preallocate:
+            self.__preallocate(total_size)
+        self.__thread = threading.Thread(target=self.__write_behind, daemon=True)
+        self.__thread.start()
+
+    def __preallocate(self, size):
+        """
+        Reserves the file's blocks, so the writes don't extend the file and the file isn't fragmented. Skipped where
+        it isn't supported, and when the file would take more than half of the disk's free space (the writes extend
+        the file then)
+        :param size: int
+        """
+        if not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            if size > shutil.disk_usage(self.__directory).free * _PREALLOCATE_SHARE:
+                return
+            os.posix_fallocate(self.__fd, 0, size)
+        except OSError:
+            pass
+
+    def __write_behind(self):
+        """
+        Write-behind thread; writes queued data until the end mark. Once a write fails the rest is discarded, and
+        the error is raised on the receiving thread
+        """
+        unsynced = 0
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            if self.__error is not None:
+                continue
+            offset, data = item
+            try:
+                _pwrite(self.__fd, data, offset)
+                if self.__fsync == FSYNC_PERIODIC:
+                    unsynced += len(data)
+                    if unsynced >= self.__fsync_interval:
+                        os.fsync(self.__fd)
+                        unsynced = 0
+            except Exception as e:
+                self.__error = e
+
+    def __check(self):
+        """
+        Raises the exception of a failed write
+        """
+        if self.__error is not None:
+            raise self.__error
+
+    def __queue_write(self, data):
+        """
+        Hands data over to the write-behind thread (waits while its queue is full)
+        :param data: bytes-like object
+        """
+        self.__queue.put((self.__offset, data))
+        self.__offset += len(data)
+
+    def write(self, data):
+        """
+        Writes the file's next data. Returns once it's copied or queued. Raises the exception of a failed write
+        :param data: bytes-like object
+        """
+        self.__check()
+        if not self.__pending and len(data) >= self.__write_size and isinstance(data, bytes):
+            # immutable, so it's queued as it is
+            self.__queue_write(data)
+            return
+        self.__pending += data
+        if len(self.__pending) >= self.__write_size:
+            self.__queue_write(self.__pending)
+            self.__pending = bytearray()
+
+    def get_size(self):
+        """
+        Returns the number of bytes written so far (including data not on disk yet)
+        :return: int
+        """
+        return self.__offset + len(self.__pending)
+
+    def __stop(self):
+        """
+        Waits until the write-behind thread is done
+        """
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+
+    def commit(self):
+        """
+        Writes the rest of the data, flushes the file according to the fsync policy and moves it to its name.
+        Raises exception (and removes the file) if a write failed or the file's size doesn't match the announced size
+        """
+        try:
+            if self.__pending:
+                self.__queue_write(self.__pending)
+                self.__pending = bytearray()
+            self.__stop()
+            self.__check()
+            if self.__total_size is not None and self.__offset != self.__total_size:
+                raise Exception("File is incomplete")
+            if self.__fsync != FSYNC_NONE:
+                os.fsync(self.__fd)
+            os.close(self.__fd)
+            self.__fd = None
+            os.replace(self.__temp_path, self.path)
+        except Exception:
+            self.abort()
+            raise
+        if self.__fsync != FSYNC_NONE:
+            self.__sync_directory()
+
+    def __sync_directory(self):
+        """
+        Flushes the directory's entry of the renamed file (where directories can be opened)
+        """
+        try:
+            fd = os.open(self.__directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def abort(self):
+        """
+        Stops writing and removes the file
+        """
+        self.__pending = bytearray()
+        self.__stop()
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        try:
+            os.remove(self.__temp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
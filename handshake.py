@@ -1,12 +1,33 @@
-import struct, pickle, datetime
-from . import constants
+import struct, pickle, datetime, os, hmac, threading, collections
+from . import constants, ciphers, compression, metrics, tracing
 from .ca.caclient import ClientCredentials, CAClient
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
 from Crypto.Hash import SHA256
 from Crypto.Signature import pss
+from Crypto.PublicKey import ECC
+from Crypto.Protocol.DH import key_agreement, import_x25519_public_key
+from Crypto.Protocol.KDF import HKDF
 
 __INT_SIZE = 4
+# option id, value length
+__OPTION_FORMAT = "!B H"
+__OPTION_SIZE = 3
+# header size, action, public key length, signature length
+__SERVER_SHARE_FORMAT = "!B B H H"
+__SERVER_SHARE_UNPACK = "!x H H"
+# header size, action, public key length, selected options count
+__CLIENT_SHARE_FORMAT = "!B B H B"
+__CLIENT_SHARE_UNPACK = "!x H B"
+__ECDH_KEY_SIZE = 32
+# header size, action, ticket length, client random length, selected options count
+__RESUME_FORMAT = "!B B H B B"
+__RESUME_UNPACK = "!x H B B"
+__RANDOM_SIZE = 32
+__RESUMED_KEY_SIZE = 32
+__CONFIRMATION_SIZE = 16
+# max verified certificates kept by the client (see CertificateCache)
+CERTIFICATE_CACHE_SIZE = 128
 
 def generate_rsa_keys(size):
     """
@@ -25,12 +46,130 @@ def read_key(path):
         key = RSA.import_key(k_file.read())
     return key
 
+"""
+ Tracing
+ Handshakes are traced as "handshake.<mode>.<side>" spans and their phases as spans of their own (see tracing module)
+"""
+
+def __measured(mode, side):
+    """
+    Decorates a handshake function (or coroutine function) to count it (see metrics module) and trace it
+    :param mode: str; handshake's mode (rsa, rsa_cert, ecdh or ecdh_cert)
+    :param side: str; server or client
+    :return: decorator
+    """
+    def decorator(function):
+        traced = tracing.traced("handshake.{}.{}".format(mode, side))(function)
+        return metrics.measure_handshake(mode, side)(traced)
+    return decorator
+
+def __read_header(network):
+    """
+    Reads the next pack's header (waiting for the other side)
+    :param network: Wrapper; socket wrapper
+    :return: bytes
+    """
+    with tracing.span("handshake.read_header"):
+        return network.read_header()
+
+async def __read_header_async(network):
+    """
+    Reads the next pack's header (waiting for the other side)
+    :param network: AsyncWrapper
+    :return: bytes
+    """
+    with tracing.span("handshake.read_header"):
+        return await network.read_header()
+
+def __import_key(public_key):
+    """
+    Imports a received RSA public key
+    :param public_key: bytes; exported key
+    :return: RSA key
+    """
+    with tracing.span("handshake.import_key"):
+        return RSA.importKey(public_key)
+
+def __rsa_decrypt(private_key, cipher_key):
+    """
+    Decrypts the client's symmetric key
+    :param private_key: RSA private key; server's private key
+    :param cipher_key: bytes; encrypted symmetric key
+    :return: bytes
+    """
+    with tracing.span("handshake.rsa_decrypt"):
+        return PKCS1_OAEP.new(private_key).decrypt(cipher_key)
+
 """
  The protocol uses hybrid encryption with both RSA and AES encryption algorithms.
  During the handshake the client and the server perform keys exchange with the server's public key
  and client's generated symmetric key (encrypted with the server's key)
+
+ Session parameters are negotiated on the way: the server sends an offer (options and their supported values)
+ along with its key or certificate, and the client attaches its selection to the symmetric key pack.
+ Options: cipher suites, wire format version, preset compression dictionary, server random (resumption),
+ connection random (wire format v2: its packs' implicit nonces are used under a key bound to the offer and
+ selection, so a replayed key exchange pack doesn't repeat a connection's keys and nonces)
 """
 
+class HandshakeResult:
+    """
+    Session parameters agreed during the handshake
+    """
+    def __init__(self, session_key, cipher_suite=constants.SUITE_EAX, wire_version=constants.WIRE_V1, is_client=True,
+                 dictionary=None):
+        """
+        :param session_key: bytes; the exchanged symmetric key
+        :param cipher_suite: int; negotiated cipher suite
+        :param wire_version: int; negotiated wire format version
+        :param is_client: bool; whether this side initiated the connection
+        :param dictionary: int or None; negotiated preset compression dictionary
+        """
+        self.session_key = session_key
+        self.cipher_suite = cipher_suite
+        self.wire_version = wire_version
+        self.is_client = is_client
+        self.dictionary = dictionary
+        # whether the session was resumed with a ticket instead of a key exchange
+        self.resumed = False
+        # the offer and selection (packed), bound into the v2 traffic key
+        self.transcript = b''
+        # whether the server issues resumption tickets (client side): its ticket is the first pack after the handshake
+        self.tickets = False
+
+class ServerBusy(Exception):
+    """
+    Raised by the client's handshake when the server refuses the connection because it's overloaded
+    """
+    def __init__(self, retry_after):
+        """
+        :param retry_after: float; seconds the server suggests to wait before reconnecting
+        """
+        Exception.__init__(self, "Server is busy, retry after {} seconds".format(retry_after))
+        self.retry_after = retry_after
+
+def busy_pack(header_first, retry_after=1.0):
+    """
+    Builds the busy response a server sends instead of its handshake when it refuses a connection.
+    The pack replaces the handshake's first pack, so it's recognized at the point the client reads the server's key
+    (an empty key), certificate header or key share header
+    :param header_first: bool; whether the server's handshake starts with a header (certificate and ECDH
+                         handshakes) rather than the RSA key's length
+    :param retry_after: float; seconds the client should wait before reconnecting
+    :return: bytes
+    """
+    pack = struct.pack("!B B H", 3, constants.SERVER_BUSY, min(int(retry_after * 1000), 0xffff))
+    return pack if header_first else struct.pack("!I", 0) + pack
+
+def __check_busy(header):
+    """
+    Raises ServerBusy if a header is the server's busy response
+    :param header: bytes; pack's header
+    """
+    if header[:1] == bytes([constants.SERVER_BUSY]):
+        retry_after = struct.unpack("!x H", header[:3])[0] / 1000
+        raise ServerBusy(retry_after)
+
 def request_certificate(cert_id, password, key, ca_public_key, server_credentials):
     """
     Requests certificate from CA server.
@@ -45,18 +184,152 @@ def request_certificate(cert_id, password, key, ca_public_key, server_credential
     client = CAClient(credentials, ca_public_key)
     return client.run(server_credentials[0], server_credentials[1])
 
-def __send_symmetric_key(network, symmetric_key, server_public_key):
+def __pack_options(options):
+    """
+    Packs handshake options
+    :param options: dict; option id -> value (bytes)
+    :return: bytes
+    """
+    pack = bytearray()
+    for option, value in options.items():
+        pack += struct.pack(__OPTION_FORMAT, option, len(value)) + value
+    return bytes(pack)
+
+def __receive_options(network, count):
+    """
+    Receives handshake options
+    :param network: Wrapper; socket wrapper
+    :param count: int; number of options
+    :return: dict; option id -> value (bytes)
+    """
+    options = {}
+    for i in range(count):
+        option, length = struct.unpack(__OPTION_FORMAT, network.receive(__OPTION_SIZE))
+        options[option] = network.receive(length)
+    return options
+
+def __offer(suites, wire_versions, dictionaries=None, tickets=None):
+    """
+    Returns the server's offer
+    :param suites: iterable; supported cipher suites ids
+    :param wire_versions: iterable; supported wire format versions
+    :param dictionaries: iterable or None; preset compression dictionaries ids (all registered if None)
+    :param tickets: TicketKeys or None; server's ticket keys. A server random is offered if set (resumption)
+    :return: dict; option id -> supported values (a byte each, the server random aside)
+    """
+    offer = {constants.OPTION_CIPHER_SUITES: bytes(suites), constants.OPTION_WIRE_VERSIONS: bytes(wire_versions)}
+    dictionaries = compression.dictionary_ids() if dictionaries is None else dictionaries
+    if dictionaries:
+        offer[constants.OPTION_DICTIONARIES] = bytes(dictionaries)
+    if tickets is not None:
+        offer[constants.OPTION_SERVER_RANDOM] = os.urandom(__RANDOM_SIZE)
+    if constants.WIRE_V2 in offer[constants.OPTION_WIRE_VERSIONS]:
+        offer[constants.OPTION_CONNECTION_RANDOM] = os.urandom(__RANDOM_SIZE)
+    return offer
+
+def __pack_offer(offer):
+    """
+    Builds the server's offer pack
+    :param offer: dict; option id -> supported values
+    :return: bytes
+    """
+    return struct.pack("!B B B", 2, constants.SEND_OFFER, len(offer)) + __pack_options(offer)
+
+def __receive_offer(network):
+    """
+    Receives the server's offer
+    :param network: Wrapper; socket wrapper
+    :return: dict; option id -> value (bytes)
+    """
+    action, count = struct.unpack("!B B", __read_header(network))
+    if action != constants.SEND_OFFER:
+        raise Exception("Handshake offer expected")
+    return __receive_options(network, count)
+
+def __select(offer, suites, wire_version, dictionaries=None):
+    """
+    Selects session parameters out of the server's offer
+    :param offer: dict; server's offer
+    :param suites: iterable or None; client's cipher suites in order of preference (measured order if None)
+    :param wire_version: int; requested wire format version (v1 is used if the server doesn't support it)
+    :param dictionaries: iterable or None; preset compression dictionaries in order of preference (all registered
+                         if None). No dictionary is used if none of them is offered
+    :return: tuple (dict, HandshakeResult); selection pack options and the selected parameters
+    """
+    suite = ciphers.choose_suite(offer.get(constants.OPTION_CIPHER_SUITES, b''), suites)
+    if wire_version not in offer.get(constants.OPTION_WIRE_VERSIONS, b''):
+        wire_version = constants.WIRE_V1
+    # v2 packs' nonces repeat on every connection, so v2 needs the server's random in the traffic key
+    if wire_version == constants.WIRE_V2 and constants.OPTION_CONNECTION_RANDOM not in offer:
+        wire_version = constants.WIRE_V1
+    selection = {constants.OPTION_CIPHER_SUITES: bytes([suite]),
+                 constants.OPTION_WIRE_VERSIONS: bytes([wire_version])}
+    offered_dictionaries = offer.get(constants.OPTION_DICTIONARIES, b'')
+    dictionary = None
+    for dictionary_id in compression.dictionary_ids() if dictionaries is None else dictionaries:
+        if dictionary_id in offered_dictionaries:
+            dictionary = dictionary_id
+            selection[constants.OPTION_DICTIONARIES] = bytes([dictionary])
+            break
+    result = HandshakeResult(None, suite, wire_version, True, dictionary)
+    result.transcript = __pack_options(offer) + __pack_options(selection)
+    result.tickets = constants.OPTION_SERVER_RANDOM in offer
+    return selection, result
+
+def __apply_selection(selection, offer):
+    """
+    Validates client's selection against the server's offer. Raises exception if an option wasn't offered
+    :param selection: dict; options selected by the client
+    :param offer: dict; server's offer
+    :return: HandshakeResult; the session key isn't set
+    """
+    for option, value in selection.items():
+        if option not in offer or len(value) != 1 or value[0] not in offer[option]:
+            raise Exception("Unsupported handshake option")
+    suite = selection.get(constants.OPTION_CIPHER_SUITES, bytes([constants.SUITE_EAX]))[0]
+    wire_version = selection.get(constants.OPTION_WIRE_VERSIONS, bytes([constants.WIRE_V1]))[0]
+    dictionary = selection[constants.OPTION_DICTIONARIES][0] if constants.OPTION_DICTIONARIES in selection else None
+    if wire_version == constants.WIRE_V2 and constants.OPTION_CONNECTION_RANDOM not in offer:
+        raise Exception("Unsupported handshake option")
+    result = HandshakeResult(None, suite, wire_version, False, dictionary)
+    result.transcript = __pack_options(offer) + __pack_options(selection)
+    return result
+
+def __send_symmetric_key(network, symmetric_key, server_public_key, selection=None):
     """
     Sends client's symmetric key to server (Part of the handshake process)
     :param network: Wrapper; socket wrapper
     :param symmetric_key: bytes; client's generate key
     :param server_public_key: server's public for the encryption of the symmetric key
+    :param selection: dict; options selected out of the server's offer
+    """
+    with tracing.span("handshake.rsa_encrypt"):
+        cipher = PKCS1_OAEP.new(server_public_key)
+        cipher_key = cipher.encrypt(symmetric_key)
+    if selection is None:
+        key_len = struct.pack("!B B I", 5, constants.SEND_SESSION_KEY, len(cipher_key))
+        network.send(bytearray(key_len + cipher_key))
+    else:
+        key_len = struct.pack("!B B I B", 6, constants.SEND_SESSION_KEY, len(cipher_key), len(selection))
+        network.send_buffers([key_len, cipher_key, __pack_options(selection)])
+
+def __receive_key_pack(network, private_key, header=None):
+    """
+    Receives client's symmetric key and the options it selected (part of the handshake process)
+    :param network: Wrapper; socket wrapper
+    :param private_key: RSA private key; server's private key, used to decrypt the symmetric key
+    :param header: bytes; the pack's header, if it was already read
+    :return: tuple (bytes, dict); client's symmetric key and selected options
     """
-    cipher = PKCS1_OAEP.new(server_public_key)
-    cipher_key = cipher.encrypt(symmetric_key)
-    key_len = struct.pack("!B B I", 5, constants.SEND_SESSION_KEY, len(cipher_key))
-    data = bytearray(key_len + cipher_key)
-    network.send(data)
+    header = header or __read_header(network)
+    action, key_len = struct.unpack("!B I", header[:5])
+    if action == constants.SEND_SESSION_KEY:
+        cipher_key = network.receive(key_len)
+        selection = __receive_options(network, header[5]) if len(header) > 5 else {}
+        symmetric_key = __rsa_decrypt(private_key, cipher_key)
+
+        return symmetric_key, selection
+    return None, {}
 
 def __receive_symmetric_key(network, private_key):
     """
@@ -65,14 +338,108 @@ def __receive_symmetric_key(network, private_key):
     :param private_key: RSA private key; server's private key, used to decrypt the symmetric key
     :return: bytes; client's symmetric key
     """
-    header = network.read_header()
-    action, key_len = struct.unpack("!B I", header)
-    if action == constants.SEND_SESSION_KEY:
-        cipher_key = network.receive(key_len)
-        cipher = PKCS1_OAEP.new(private_key)
-        symmetric_key = cipher.decrypt(cipher_key)
+    return __receive_key_pack(network, private_key)[0]
+
+# the network service's key exchange (see service/network.py)
+_send_symmetric_key = __send_symmetric_key
+_receive_symmetric_key = __receive_symmetric_key
+
+def __receive_session(network, private_key, offer, tickets=None):
+    """
+    Receives client's symmetric key (or resumption ticket) and selection and returns the session's parameters
+    :param network: Wrapper; socket wrapper
+    :param private_key: RSA private key; server's private key
+    :param offer: dict; server's offer
+    :param tickets: TicketKeys or None; server's ticket keys
+    :return: HandshakeResult or None
+    """
+    result, header = __read_resumption(network, offer, tickets)
+    if result:
+        return result
+    symmetric_key, selection = __receive_key_pack(network, private_key, header)
+    if symmetric_key is None:
+        return None
+    result = __apply_selection(selection, offer)
+    result.session_key = symmetric_key
+    return result
+
+class CertificateCache:
+    """
+    LRU cache of the certificates the client verified, so reconnecting to the same server skips the signature
+    verification, the certificate's parsing and the server key's import. Entries are keyed by the certificate's
+    and signature's digest along with the CA key they were verified with, and expire at the certificate's end date
+    """
+    def __init__(self, max_size=CERTIFICATE_CACHE_SIZE):
+        """
+        :param max_size: int; max number of certificates (0 turns the cache off)
+        """
+        self.max_size = max_size
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+    @staticmethod
+    def key(cert_data, signature, ca_key):
+        """
+        Returns a certificate's cache key
+        :param cert_data: bytes; certificate
+        :param signature: bytes; CA server's signature
+        :param ca_key: RSA public key; CA server's public key
+        :return: tuple
+        """
+        return SHA256.new(bytes(cert_data) + bytes(signature)).digest(), ca_key.n, ca_key.e
 
-        return symmetric_key
+    def get(self, key):
+        """
+        Returns a verified certificate's validity and server key. Expired entries are removed
+        :param key: tuple; cache key
+        :return: tuple (tuple, RSA public key) or None; validity (start and end dates) and the server's key
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and datetime.datetime.now() > entry[0][1]:
+                del self.__entries[key]
+                entry = None
+            if entry is None:
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return entry
+
+    def put(self, key, validity, public_key):
+        """
+        Keeps a verified certificate
+        :param key: tuple; cache key
+        :param validity: tuple; certificate's start and end dates
+        :param public_key: RSA public key; server's key
+        """
+        with self.__lock:
+            if self.max_size <= 0:
+                return
+            self.__entries[key] = (validity, public_key)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the entries
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def get_stats(self):
+        """
+        Returns the cache's size, hits and misses
+        :return: dict
+        """
+        with self.__lock:
+            return {"size": len(self.__entries), "hits": self.__hits, "misses": self.__misses}
+
+# certificates verified by the client handshakes
+certificate_cache = CertificateCache()
 
 def __verify_cert_signature(certificate, signature, ca_key):
     """
@@ -84,12 +451,131 @@ def __verify_cert_signature(certificate, signature, ca_key):
     """
     h = SHA256.new(certificate)
     try:
-        pss.new(ca_key).verify(h, signature)
+        with tracing.span("handshake.verify_certificate"):
+            pss.new(ca_key).verify(h, signature)
         return True
     except Exception as e:
         print (e)
         return False
 
+"""
+ Session resumption
+ A server with ticket keys offers a random value and issues a ticket after the handshake (see tickets module).
+ A client holding a valid ticket of the server answers the offer with a resume pack (ticket, client random and
+ selection) instead of its key exchange pack, and skips the certificate's verification. If the server opens the
+ ticket, both sides derive the session key from the ticket's resumption secret, both randoms, the offer and the
+ selection (HKDF), and the server accepts with a confirmation value the client verifies. Otherwise the server
+ rejects and the client goes on with the full handshake.
+ Resume pack: header, ticket, client random, selection. Response: header (accepted: with the confirmation)
+"""
+
+def __resumed_keys(secret, ticket, client_random, offer, selection):
+    """
+    Derives a resumed session's key and the server's confirmation value
+    :param secret: bytes; ticket's resumption secret
+    :param ticket: bytes; the ticket
+    :param client_random: bytes
+    :param offer: dict; server's offer (including the server random)
+    :param selection: dict; client's selection
+    :return: tuple (bytes, bytes); session key and confirmation
+    """
+    transcript = b"SDTP resumed session" + bytes(ticket) + bytes(client_random) + __pack_options(offer) + \
+                 __pack_options(selection)
+    keys = HKDF(secret, __RESUMED_KEY_SIZE + __CONFIRMATION_SIZE, b'', SHA256, context=transcript)
+    return keys[:__RESUMED_KEY_SIZE], keys[__RESUMED_KEY_SIZE:]
+
+def __can_resume(ticket, offer):
+    """
+    Returns whether the client resumes the session with a ticket
+    :param ticket: Ticket or None; client's ticket
+    :param offer: dict; server's offer
+    :return: bool
+    """
+    return ticket is not None and ticket.is_valid() and constants.OPTION_SERVER_RANDOM in offer
+
+def __pack_resume(ticket, client_random, selection):
+    """
+    Builds the client's resume pack
+    :param ticket: bytes; the ticket
+    :param client_random: bytes
+    :param selection: dict; options selected out of the server's offer
+    :return: list; pack's segments
+    """
+    return [struct.pack(__RESUME_FORMAT, 5, constants.SEND_RESUME, len(ticket), len(client_random), len(selection)),
+            ticket, client_random, __pack_options(selection)]
+
+def __answer_resume(network, tickets, ticket, client_random, offer, selection):
+    """
+    Opens a resumption ticket and sends the server's response
+    :param network: Wrapper or AsyncWrapper
+    :param tickets: TicketKeys or None; server's ticket keys
+    :param ticket: bytes; client's ticket
+    :param client_random: bytes
+    :param offer: dict; server's offer
+    :param selection: dict; client's selection
+    :return: HandshakeResult or None; None if the ticket was rejected
+    """
+    secret = tickets.open(bytes(ticket)) if tickets is not None else None
+    if secret is None:
+        network.send(bytearray(struct.pack("!B B", 1, constants.RESUME_REJECTED)))
+        return None
+    result = __apply_selection(selection, offer)
+    result.session_key, confirmation = __resumed_keys(secret, ticket, client_random, offer, selection)
+    result.resumed = True
+    network.send_buffers([struct.pack("!B B", 1 + __CONFIRMATION_SIZE, constants.RESUME_ACCEPTED), confirmation])
+    return result
+
+def __check_resumed(response, ticket, client_random, offer, selection, result):
+    """
+    Checks the server's response to the resume pack. Raises exception if the confirmation doesn't match
+    :param response: bytes; response's header
+    :param ticket: Ticket; client's ticket
+    :param client_random: bytes
+    :param offer: dict; server's offer
+    :param selection: dict; client's selection
+    :param result: HandshakeResult; the selected parameters
+    :return: HandshakeResult or None; None if the server rejected the ticket
+    """
+    if response[:1] != bytes([constants.RESUME_ACCEPTED]):
+        return None
+    result.session_key, confirmation = __resumed_keys(ticket.secret, ticket.ticket, client_random, offer, selection)
+    if not hmac.compare_digest(bytes(response[1:]), confirmation):
+        raise Exception("Session resumption failed")
+    result.resumed = True
+    return result
+
+def __read_resumption(network, offer, tickets):
+    """
+    Reads the header of the client's pack following the offer, and answers it first if it's a resume pack
+    :param network: Wrapper; socket wrapper
+    :param offer: dict; server's offer
+    :param tickets: TicketKeys or None; server's ticket keys
+    :return: tuple (HandshakeResult, bytes); the resumed session's parameters (None if the session isn't resumed)
+             and the header of the client's next pack (None if resumed)
+    """
+    header = __read_header(network)
+    if header[:1] != bytes([constants.SEND_RESUME]):
+        return None, header
+    ticket_len, random_len, count = struct.unpack(__RESUME_UNPACK, header)
+    ticket = network.receive(ticket_len)
+    client_random = network.receive(random_len)
+    selection = __receive_options(network, count)
+    result = __answer_resume(network, tickets, ticket, client_random, offer, selection)
+    return (result, None) if result else (None, __read_header(network))
+
+def __resume(network, ticket, offer, suites, wire_version, dictionaries):
+    """
+    Sends the resume pack and receives the server's response
+    :param network: Wrapper; socket wrapper
+    :param ticket: Ticket; client's ticket
+    :param offer: dict; server's offer
+    :return: HandshakeResult or None; None if the server rejected the ticket
+    """
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    client_random = os.urandom(__RANDOM_SIZE)
+    network.send_buffers(__pack_resume(ticket.ticket, client_random, selection))
+    return __check_resumed(__read_header(network), ticket, client_random, offer, selection, result)
+
 """
  Handshake with certificate
 
@@ -106,52 +592,100 @@ def read_certification(network):
     :param network: Warpper; socket wrapper
     :return: tuple (bytes, dict); CA server signature and certificate data
     """
-    header = network.read_header()
+    header = __read_header(network)
     cert_len, signature_len = struct.unpack("!x I I", header)
     cert_data = network.receive(cert_len)
     signature = network.receive(signature_len)
 
     return signature, cert_data
 
-def server_handshake_cert(private_key, network, cert):
+@__measured("rsa_cert", "server")
+def server_handshake_cert(private_key, network, cert, suites=tuple(ciphers.SUITES),
+                          wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None, tickets=None):
     """
     Establish Server side connection with a client with a certificate
     :param private_key: RAS private key; Server's private key
     :param network: Wrapper;
     :param cert: Certificate; Certificate provided and signed by the CA server
-    :return: None or bytes; returns received generated symmetric key by client in case certificate was verified
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: None or HandshakeResult; session's parameters (including client's generated symmetric key) in case
+             certificate was verified
     """
     header = struct.pack("! B B I I", 9, constants.SEND_CERTIFICATE,
                                   len(cert["certificate"]), len(cert["signature"]))
-    data = bytearray(header + cert["certificate"] + cert["signature"])
-    network.send(data)
-    response_header = network.read_header()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers([header, cert["certificate"], cert["signature"], __pack_offer(offer)])
+    result, response_header = __read_resumption(network, offer, tickets)
+    if result:
+        return result
     response = struct.unpack("!B", response_header[:1])[0]
     if response == constants.CERT_FAILED:
         raise Exception("Client couldn't verify given certificate")
     elif response == constants.CERT_SUCCEEDED:
-        return __receive_symmetric_key(network, private_key)
+        return __receive_session(network, private_key, offer)
     else:
         return None
 
-def client_handshake_cert(symmetric_key, network, ca_public_key):
+@__measured("rsa_cert", "client")
+def client_handshake_cert(symmetric_key, network, ca_public_key, suites=None, wire_version=constants.WIRE_V1,
+                          dictionaries=None, ticket=None):
     """
     Establish client side connection with server using a certificate.
     Raises exception if certificate is invalid. In this case the establishment will fail and will be terminated.
     :param symmetric_key: bytes; generated AES cipher key
     :param network: Wrapper; socket wrapper
     :param ca_public_key: RSA public key; CA server public key
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
     """
-    header = network.read_header()
+    header = __read_header(network)
+    __check_busy(header)
     cert_len, signature_len = struct.unpack("!x I I", header)
     cert_data = network.receive(cert_len)
     signature = network.receive(signature_len)
+    offer = __receive_offer(network)
+    if __can_resume(ticket, offer):
+        result = __resume(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    public_key = __accept_certificate(network, cert_data, signature, ca_public_key)
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    __send_symmetric_key(network, symmetric_key, public_key, selection)
+    result.session_key = symmetric_key
+    return result
+
+def __accept_certificate(network, cert_data, signature, ca_public_key):
+    """
+    Verifies server's certificate and sends the verification response.
+    Raises exception if the certificate is invalid
+    :param network: Wrapper or AsyncWrapper
+    :param cert_data: bytes; certificate
+    :param signature: bytes; CA server's signature
+    :param ca_public_key: RSA public key; CA server public key
+    :return: RSA public key; server's public key
+    """
+    cache_key = CertificateCache.key(cert_data, signature, ca_public_key)
+    entry = certificate_cache.get(cache_key)
+    if entry is not None:
+        validity, public_key = entry
+        if validity[0] <= datetime.datetime.now():
+            network.send(bytearray(struct.pack("!B B", 1, constants.CERT_SUCCEEDED)))
+            return public_key
     if __verify_cert_signature(cert_data, signature, ca_public_key):
         _id, public_key, validity = pickle.loads(cert_data)
         current = datetime.datetime.now()
         if validity[0] <= current <= validity[1]:
             network.send(bytearray(struct.pack("!B B", 1, constants.CERT_SUCCEEDED)))
-            __send_symmetric_key(network, symmetric_key, RSA.importKey(public_key))
+            public_key = __import_key(public_key)
+            certificate_cache.put(cache_key, validity, public_key)
+            return public_key
         else:
             network.send(bytearray(struct.pack("!B B", 1, constants.CERT_FAILED)))
             raise Exception("Certificate is outdated!")
@@ -164,25 +698,590 @@ def client_handshake_cert(symmetric_key, network, ca_public_key):
  Handling regular connections establishment with no certificate requirements (just keys exchange)
 """
 
-def server_handshake(rsa_key, network):
+@__measured("rsa", "server")
+def server_handshake(rsa_key, network, suites=tuple(ciphers.SUITES),
+                     wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None, tickets=None):
     """
     Server's side connection establishment
     :param rsa_key: RSA key; sever's RSA key pair
     :param network: Wrapper; socket wrapper
-    :return: bytes; client's symmetric key
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: HandshakeResult; session's parameters, including client's symmetric key
     """
     public_key = rsa_key.publickey().export_key()
     pack_public_key = struct.pack("! I", len(public_key))
-    network.send(bytearray(pack_public_key) + public_key)
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers([pack_public_key, public_key, __pack_offer(offer)])
 
-    return __receive_symmetric_key(network, rsa_key)
+    return __receive_session(network, rsa_key, offer, tickets)
 
-def client_handshake(network, symmetric_key):
+@__measured("rsa", "client")
+def client_handshake(network, symmetric_key, suites=None, wire_version=constants.WIRE_V1, dictionaries=None,
+                     ticket=None):
     """
     Establishes client side connection
     :param network: Wrapper; socket wrapper
     :param symmetric_key: bytes; client's symmetric key
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
+    """
+    with tracing.span("handshake.read_header"):
+        public_key_len = struct.unpack("!I",  network.receive(__INT_SIZE))[0]
+    if public_key_len == 0:
+        __check_busy(__read_header(network))
+        raise Exception("Server's public key is missing")
+    public_key = network.receive(public_key_len)
+    offer = __receive_offer(network)
+    if __can_resume(ticket, offer):
+        result = __resume(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    __send_symmetric_key(network, symmetric_key, __import_key(public_key), selection)
+    result.session_key = symmetric_key
+    return result
+
+"""
+ Ephemeral key agreement (ECDH)
+ Both sides generate a fresh X25519 key pair for every connection and exchange the public keys (key shares);
+ the session key is derived from the shared secret with HKDF, bound to both key shares, the offer and the selection.
+ No RSA operation is needed, so the handshake is a lot cheaper than the RSA key exchange, and recorded traffic
+ can't be decrypted later with the server's key (forward secrecy).
+ With a certificate, the server signs its key share and offer with its certified RSA key (one RSA operation).
+ Server: key share, offer. Client: key share, selection
+"""
+
+def __new_key_share():
+    """
+    Generates an ephemeral X25519 key pair
+    :return: tuple (ECC key, bytes); private key and the raw public key
     """
-    public_key_len = struct.unpack("!I",  network.receive(__INT_SIZE))[0]
-    public_key = RSA.importKey(network.receive(public_key_len))
-    __send_symmetric_key(network, symmetric_key, public_key)
\ No newline at end of file
+    with tracing.span("handshake.key_share"):
+        key = ECC.generate(curve="Curve25519")
+        return key, key.public_key().export_key(format="raw")
+
+def __derive_session_key(private_key, peer_public_key, client_share, server_share, offer, selection):
+    """
+    Derives the session key from the key agreement and the handshake's transcript
+    :param private_key: ECC key; own ephemeral key
+    :param peer_public_key: bytes; other side's key share
+    :param client_share: bytes; client's key share
+    :param server_share: bytes; server's key share
+    :param offer: dict; server's offer
+    :param selection: dict; client's selection
+    :return: bytes
+    """
+    try:
+        peer_key = import_x25519_public_key(bytes(peer_public_key))
+    except ValueError:
+        raise Exception("Invalid key share")
+    transcript = b"SDTP session key" + client_share + server_share + __pack_options(offer) + __pack_options(selection)
+    with tracing.span("handshake.key_agreement"):
+        return key_agreement(eph_priv=private_key, eph_pub=peer_key,
+                             kdf=lambda secret: HKDF(secret, __ECDH_KEY_SIZE, b'', SHA256, context=transcript))
+
+def __pack_server_share(public_key, signature=b''):
+    """
+    Builds the server's key share pack
+    :param public_key: bytes; server's key share
+    :param signature: bytes; key share and offer signature (certificate mode)
+    :return: list; pack's segments
+    """
+    return [struct.pack(__SERVER_SHARE_FORMAT, 5, constants.SEND_KEY_SHARE, len(public_key), len(signature)),
+            public_key, signature]
+
+def __pack_client_share(public_key, selection):
+    """
+    Builds the client's key share pack
+    :param public_key: bytes; client's key share
+    :param selection: dict; options selected out of the server's offer
+    :return: list; pack's segments
+    """
+    return [struct.pack(__CLIENT_SHARE_FORMAT, 4, constants.SEND_KEY_SHARE, len(public_key), len(selection)),
+            public_key, __pack_options(selection)]
+
+def __unpack_share_header(header, unpack_format):
+    """
+    Validates and unpacks a key share pack's header. Raises exception if it isn't a key share
+    :param header: bytes; pack's header segment
+    :param unpack_format: str; server's or client's key share header format
+    :return: tuple; the header's lengths
+    """
+    __check_busy(header)
+    if header[:1] != bytes([constants.SEND_KEY_SHARE]) or len(header) != struct.calcsize(unpack_format):
+        raise Exception("Key share expected")
+    return struct.unpack(unpack_format, header)
+
+def __share_digest(public_key, offer):
+    """
+    Returns the digest the server signs in certificate mode
+    :param public_key: bytes; server's key share
+    :param offer: dict; server's offer
+    :return: SHA256 hash object
+    """
+    return SHA256.new(bytes(public_key) + __pack_options(offer))
+
+def __sign_share(private_key, public_key, offer):
+    """
+    Signs the server's key share and offer
+    :param private_key: RSA private key; server's certified key
+    :param public_key: bytes; server's key share
+    :param offer: dict; server's offer
+    :return: bytes; signature
+    """
+    with tracing.span("handshake.sign_share"):
+        return pss.new(private_key).sign(__share_digest(public_key, offer))
+
+def __verify_share(public_key, offer, signature, rsa_public_key):
+    """
+    Verifies the server's key share signature. Raises exception if it's invalid
+    """
+    try:
+        with tracing.span("handshake.verify_share"):
+            pss.new(rsa_public_key).verify(__share_digest(public_key, offer), signature)
+    except (ValueError, TypeError):
+        raise Exception("Key share signature is invalid")
+
+def __receive_client_share(network, key, public_key, offer, tickets=None):
+    """
+    Receives client's key share (or resumption ticket) and selection and returns the session's parameters
+    :param network: Wrapper; socket wrapper
+    :param key: ECC key; server's ephemeral key
+    :param public_key: bytes; server's key share
+    :param offer: dict; server's offer
+    :param tickets: TicketKeys or None; server's ticket keys
+    :return: HandshakeResult
+    """
+    result, header = __read_resumption(network, offer, tickets)
+    if result:
+        return result
+    key_len, count = __unpack_share_header(header, __CLIENT_SHARE_UNPACK)
+    client_share = network.receive(key_len)
+    selection = __receive_options(network, count)
+    result = __apply_selection(selection, offer)
+    result.session_key = __derive_session_key(key, client_share, client_share, public_key, offer, selection)
+    return result
+
+def __send_client_share(network, server_share, offer, suites, wire_version, dictionaries):
+    """
+    Selects the session's parameters, sends the client's key share and selection
+    :return: HandshakeResult
+    """
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    key, public_key = __new_key_share()
+    result.session_key = __derive_session_key(key, server_share, public_key, server_share, offer, selection)
+    network.send_buffers(__pack_client_share(public_key, selection))
+    return result
+
+@__measured("ecdh", "server")
+def server_handshake_ecdh(network, suites=tuple(ciphers.SUITES), wire_versions=(constants.WIRE_V1, constants.WIRE_V2),
+                          dictionaries=None, tickets=None):
+    """
+    Server's side ephemeral key agreement
+    :param network: Wrapper; socket wrapper
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: HandshakeResult; session's parameters
+    """
+    key, public_key = __new_key_share()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers(__pack_server_share(public_key) + [__pack_offer(offer)])
+    return __receive_client_share(network, key, public_key, offer, tickets)
+
+@__measured("ecdh", "client")
+def client_handshake_ecdh(network, suites=None, wire_version=constants.WIRE_V1, dictionaries=None, ticket=None):
+    """
+    Client's side ephemeral key agreement
+    :param network: Wrapper; socket wrapper
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
+    """
+    key_len, signature_len = __unpack_share_header(__read_header(network), __SERVER_SHARE_UNPACK)
+    server_share = network.receive(key_len)
+    network.receive(signature_len)
+    offer = __receive_offer(network)
+    if __can_resume(ticket, offer):
+        result = __resume(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    return __send_client_share(network, server_share, offer, suites, wire_version, dictionaries)
+
+@__measured("ecdh_cert", "server")
+def server_handshake_ecdh_cert(private_key, network, cert, suites=tuple(ciphers.SUITES),
+                               wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None, tickets=None):
+    """
+    Server's side ephemeral key agreement with a certificate. The key share is signed with the certified key
+    :param private_key: RSA key; server's private key (the certificate's key)
+    :param network: Wrapper; socket wrapper
+    :param cert: Certificate; Certificate provided and signed by the CA server
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: None or HandshakeResult; session's parameters in case the certificate was verified
+    """
+    key, public_key = __new_key_share()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    signature = __sign_share(private_key, public_key, offer)
+    header = struct.pack("! B B I I", 9, constants.SEND_CERTIFICATE, len(cert["certificate"]), len(cert["signature"]))
+    network.send_buffers([header, cert["certificate"], cert["signature"]] +
+                         __pack_server_share(public_key, signature) + [__pack_offer(offer)])
+    result, response_header = __read_resumption(network, offer, tickets)
+    if result:
+        return result
+    response = struct.unpack("!B", response_header[:1])[0]
+    if response == constants.CERT_FAILED:
+        raise Exception("Client couldn't verify given certificate")
+    elif response == constants.CERT_SUCCEEDED:
+        return __receive_client_share(network, key, public_key, offer)
+    return None
+
+@__measured("ecdh_cert", "client")
+def client_handshake_ecdh_cert(network, ca_public_key, suites=None, wire_version=constants.WIRE_V1,
+                               dictionaries=None, ticket=None):
+    """
+    Client's side ephemeral key agreement with server's certificate verification.
+    Raises exception if the certificate or the key share signature is invalid
+    :param network: Wrapper; socket wrapper
+    :param ca_public_key: RSA public key; CA server public key
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
+    """
+    header = __read_header(network)
+    __check_busy(header)
+    cert_len, cert_signature_len = struct.unpack("!x I I", header)
+    cert_data = network.receive(cert_len)
+    cert_signature = network.receive(cert_signature_len)
+    key_len, signature_len = __unpack_share_header(__read_header(network), __SERVER_SHARE_UNPACK)
+    server_share = network.receive(key_len)
+    signature = network.receive(signature_len)
+    offer = __receive_offer(network)
+    if __can_resume(ticket, offer):
+        result = __resume(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    rsa_public_key = __accept_certificate(network, cert_data, cert_signature, ca_public_key)
+    __verify_share(server_share, offer, signature, rsa_public_key)
+    return __send_client_share(network, server_share, offer, suites, wire_version, dictionaries)
+
+"""
+ asyncio handshakes
+ The same handshakes over an AsyncWrapper (see asyncsock module). Create the session with
+ `AsyncSession.from_handshake()`
+"""
+
+async def __receive_options_async(network, count):
+    """
+    Receives handshake options
+    :param network: AsyncWrapper
+    :param count: int; number of options
+    :return: dict; option id -> value (bytes)
+    """
+    options = {}
+    for i in range(count):
+        option, length = struct.unpack(__OPTION_FORMAT, await network.receive(__OPTION_SIZE))
+        options[option] = await network.receive(length)
+    return options
+
+async def __receive_offer_async(network):
+    """
+    Receives the server's offer
+    :param network: AsyncWrapper
+    :return: dict; option id -> value (bytes)
+    """
+    action, count = struct.unpack("!B B", await __read_header_async(network))
+    if action != constants.SEND_OFFER:
+        raise Exception("Handshake offer expected")
+    return await __receive_options_async(network, count)
+
+async def __read_resumption_async(network, offer, tickets):
+    """
+    Reads the header of the client's pack following the offer, and answers it first if it's a resume pack
+    (see __read_resumption)
+    :param network: AsyncWrapper
+    :return: tuple (HandshakeResult, bytes)
+    """
+    header = await __read_header_async(network)
+    if header[:1] != bytes([constants.SEND_RESUME]):
+        return None, header
+    ticket_len, random_len, count = struct.unpack(__RESUME_UNPACK, header)
+    ticket = await network.receive(ticket_len)
+    client_random = await network.receive(random_len)
+    selection = await __receive_options_async(network, count)
+    result = __answer_resume(network, tickets, ticket, client_random, offer, selection)
+    await network.drain()
+    return (result, None) if result else (None, await __read_header_async(network))
+
+async def __resume_async(network, ticket, offer, suites, wire_version, dictionaries):
+    """
+    Sends the resume pack and receives the server's response (see __resume)
+    :param network: AsyncWrapper
+    :return: HandshakeResult or None
+    """
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    client_random = os.urandom(__RANDOM_SIZE)
+    network.send_buffers(__pack_resume(ticket.ticket, client_random, selection))
+    await network.drain()
+    return __check_resumed(await __read_header_async(network), ticket, client_random, offer, selection, result)
+
+async def __receive_session_async(network, private_key, offer, tickets=None):
+    """
+    Receives client's symmetric key (or resumption ticket) and selection and returns the session's parameters
+    :param network: AsyncWrapper
+    :param private_key: RSA private key; server's private key
+    :param offer: dict; server's offer
+    :param tickets: TicketKeys or None; server's ticket keys
+    :return: HandshakeResult or None
+    """
+    result, header = await __read_resumption_async(network, offer, tickets)
+    if result:
+        return result
+    action, key_len = struct.unpack("!B I", header[:5])
+    if action != constants.SEND_SESSION_KEY:
+        return None
+    cipher_key = await network.receive(key_len)
+    selection = await __receive_options_async(network, header[5]) if len(header) > 5 else {}
+    result = __apply_selection(selection, offer)
+    result.session_key = __rsa_decrypt(private_key, cipher_key)
+    return result
+
+@__measured("rsa", "server")
+async def async_server_handshake(rsa_key, network, suites=tuple(ciphers.SUITES),
+                                 wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None,
+                                 tickets=None):
+    """
+    Server's side connection establishment (see server_handshake)
+    :param rsa_key: RSA key; sever's RSA key pair
+    :param network: AsyncWrapper
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: HandshakeResult; session's parameters, including client's symmetric key
+    """
+    public_key = rsa_key.publickey().export_key()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers([struct.pack("! I", len(public_key)), public_key, __pack_offer(offer)])
+    await network.drain()
+
+    return await __receive_session_async(network, rsa_key, offer, tickets)
+
+@__measured("rsa", "client")
+async def async_client_handshake(network, symmetric_key, suites=None, wire_version=constants.WIRE_V1,
+                                 dictionaries=None, ticket=None):
+    """
+    Establishes client side connection (see client_handshake)
+    :param network: AsyncWrapper
+    :param symmetric_key: bytes; client's symmetric key
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
+    """
+    with tracing.span("handshake.read_header"):
+        public_key_len = struct.unpack("!I", await network.receive(__INT_SIZE))[0]
+    if public_key_len == 0:
+        __check_busy(await __read_header_async(network))
+        raise Exception("Server's public key is missing")
+    public_key = await network.receive(public_key_len)
+    offer = await __receive_offer_async(network)
+    if __can_resume(ticket, offer):
+        result = await __resume_async(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    __send_symmetric_key(network, symmetric_key, __import_key(public_key), selection)
+    await network.drain()
+    result.session_key = symmetric_key
+    return result
+
+@__measured("rsa_cert", "server")
+async def async_server_handshake_cert(private_key, network, cert, suites=tuple(ciphers.SUITES),
+                                      wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None,
+                                      tickets=None):
+    """
+    Establish Server side connection with a client with a certificate (see server_handshake_cert)
+    :param private_key: RAS private key; Server's private key
+    :param network: AsyncWrapper
+    :param cert: Certificate; Certificate provided and signed by the CA server
+    :param suites: iterable; cipher suites to offer
+    :param wire_versions: iterable; wire format versions to offer
+    :param dictionaries: iterable; preset compression dictionaries to offer (all registered if not provided)
+    :param tickets: TicketKeys; server's ticket keys, to accept resumption tickets
+    :return: None or HandshakeResult
+    """
+    header = struct.pack("! B B I I", 9, constants.SEND_CERTIFICATE, len(cert["certificate"]), len(cert["signature"]))
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers([header, cert["certificate"], cert["signature"], __pack_offer(offer)])
+    await network.drain()
+    result, response_header = await __read_resumption_async(network, offer, tickets)
+    if result:
+        return result
+    response = struct.unpack("!B", response_header[:1])[0]
+    if response == constants.CERT_FAILED:
+        raise Exception("Client couldn't verify given certificate")
+    elif response == constants.CERT_SUCCEEDED:
+        return await __receive_session_async(network, private_key, offer)
+    else:
+        return None
+
+@__measured("rsa_cert", "client")
+async def async_client_handshake_cert(symmetric_key, network, ca_public_key, suites=None,
+                                      wire_version=constants.WIRE_V1, dictionaries=None, ticket=None):
+    """
+    Establish client side connection with server using a certificate (see client_handshake_cert).
+    Raises exception if certificate is invalid
+    :param symmetric_key: bytes; generated AES cipher key
+    :param network: AsyncWrapper
+    :param ca_public_key: RSA public key; CA server public key
+    :param suites: iterable; cipher suites in order of preference (fastest on this machine first if not provided)
+    :param wire_version: int; requested wire format version
+    :param dictionaries: iterable; preset compression dictionaries in order of preference (all registered if not
+                         provided)
+    :param ticket: Ticket; server's resumption ticket. The full handshake is made if the server rejects it
+    :return: HandshakeResult; session's parameters
+    """
+    header = await __read_header_async(network)
+    __check_busy(header)
+    cert_len, signature_len = struct.unpack("!x I I", header)
+    cert_data = await network.receive(cert_len)
+    signature = await network.receive(signature_len)
+    offer = await __receive_offer_async(network)
+    if __can_resume(ticket, offer):
+        result = await __resume_async(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    try:
+        public_key = __accept_certificate(network, cert_data, signature, ca_public_key)
+    finally:
+        await network.drain()
+    selection, result = __select(offer, suites, wire_version, dictionaries)
+    __send_symmetric_key(network, symmetric_key, public_key, selection)
+    await network.drain()
+    result.session_key = symmetric_key
+    return result
+
+async def __receive_client_share_async(network, key, public_key, offer, tickets=None):
+    """
+    Receives client's key share (or resumption ticket) and selection (see __receive_client_share)
+    :return: HandshakeResult
+    """
+    result, header = await __read_resumption_async(network, offer, tickets)
+    if result:
+        return result
+    key_len, count = __unpack_share_header(header, __CLIENT_SHARE_UNPACK)
+    client_share = await network.receive(key_len)
+    selection = await __receive_options_async(network, count)
+    result = __apply_selection(selection, offer)
+    result.session_key = __derive_session_key(key, client_share, client_share, public_key, offer, selection)
+    return result
+
+@__measured("ecdh", "server")
+async def async_server_handshake_ecdh(network, suites=tuple(ciphers.SUITES),
+                                      wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None,
+                                      tickets=None):
+    """
+    Server's side ephemeral key agreement (see server_handshake_ecdh)
+    :param network: AsyncWrapper
+    :return: HandshakeResult
+    """
+    key, public_key = __new_key_share()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    network.send_buffers(__pack_server_share(public_key) + [__pack_offer(offer)])
+    await network.drain()
+    return await __receive_client_share_async(network, key, public_key, offer, tickets)
+
+@__measured("ecdh", "client")
+async def async_client_handshake_ecdh(network, suites=None, wire_version=constants.WIRE_V1, dictionaries=None,
+                                      ticket=None):
+    """
+    Client's side ephemeral key agreement (see client_handshake_ecdh)
+    :param network: AsyncWrapper
+    :return: HandshakeResult
+    """
+    key_len, signature_len = __unpack_share_header(await __read_header_async(network), __SERVER_SHARE_UNPACK)
+    server_share = await network.receive(key_len)
+    await network.receive(signature_len)
+    offer = await __receive_offer_async(network)
+    if __can_resume(ticket, offer):
+        result = await __resume_async(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    result = __send_client_share(network, server_share, offer, suites, wire_version, dictionaries)
+    await network.drain()
+    return result
+
+@__measured("ecdh_cert", "server")
+async def async_server_handshake_ecdh_cert(private_key, network, cert, suites=tuple(ciphers.SUITES),
+                                           wire_versions=(constants.WIRE_V1, constants.WIRE_V2), dictionaries=None,
+                                           tickets=None):
+    """
+    Server's side ephemeral key agreement with a certificate (see server_handshake_ecdh_cert)
+    :param network: AsyncWrapper
+    :return: None or HandshakeResult
+    """
+    key, public_key = __new_key_share()
+    offer = __offer(suites, wire_versions, dictionaries, tickets)
+    signature = __sign_share(private_key, public_key, offer)
+    header = struct.pack("! B B I I", 9, constants.SEND_CERTIFICATE, len(cert["certificate"]), len(cert["signature"]))
+    network.send_buffers([header, cert["certificate"], cert["signature"]] +
+                         __pack_server_share(public_key, signature) + [__pack_offer(offer)])
+    await network.drain()
+    result, response_header = await __read_resumption_async(network, offer, tickets)
+    if result:
+        return result
+    response = struct.unpack("!B", response_header[:1])[0]
+    if response == constants.CERT_FAILED:
+        raise Exception("Client couldn't verify given certificate")
+    elif response == constants.CERT_SUCCEEDED:
+        return await __receive_client_share_async(network, key, public_key, offer)
+    return None
+
+@__measured("ecdh_cert", "client")
+async def async_client_handshake_ecdh_cert(network, ca_public_key, suites=None, wire_version=constants.WIRE_V1,
+                                           dictionaries=None, ticket=None):
+    """
+    Client's side ephemeral key agreement with server's certificate verification (see client_handshake_ecdh_cert)
+    :param network: AsyncWrapper
+    :return: HandshakeResult
+    """
+    header = await __read_header_async(network)
+    __check_busy(header)
+    cert_len, cert_signature_len = struct.unpack("!x I I", header)
+    cert_data = await network.receive(cert_len)
+    cert_signature = await network.receive(cert_signature_len)
+    key_len, signature_len = __unpack_share_header(await __read_header_async(network), __SERVER_SHARE_UNPACK)
+    server_share = await network.receive(key_len)
+    signature = await network.receive(signature_len)
+    offer = await __receive_offer_async(network)
+    if __can_resume(ticket, offer):
+        result = await __resume_async(network, ticket, offer, suites, wire_version, dictionaries)
+        if result:
+            return result
+    try:
+        rsa_public_key = __accept_certificate(network, cert_data, cert_signature, ca_public_key)
+    finally:
+        await network.drain()
+    __verify_share(server_share, offer, signature, rsa_public_key)
+    result = __send_client_share(network, server_share, offer, suites, wire_version, dictionaries)
+    await network.drain()
+    return result
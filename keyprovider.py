@@ -0,0 +1,164 @@
+import os, threading, queue
+from Crypto.PublicKey import RSA
+
+"""
+ RSA key provider
+
+ Generating an RSA key (prime generation) takes from tens of milliseconds to seconds, so services don't generate
+ their keys in their constructors:
+ * KeyProvider - a long lived key (servers). Loaded from its file if it was persisted, otherwise generated on first
+   use (or in the background with `prefetch()`) and saved to the file, so the next process start just loads it
+ * KeyPool - ephemeral keys (one per client). A background thread keeps a few keys generated ahead, so taking a key
+   doesn't wait for prime generation
+"""
+
+DEFAULT_KEY_SIZE = 1024
+# keys a pool keeps generated ahead
+POOL_CAPACITY = 4
+
+
+class KeyProvider:
+    """
+    Provides a long lived RSA key, loaded from disk or generated lazily
+    """
+    def __init__(self, size=DEFAULT_KEY_SIZE, path=None, key=None):
+        """
+        :param size: int; generated key's size in bits
+        :param path: str; file of the persisted key (PEM). The key is loaded from it if it exists, otherwise the
+                     generated key is saved to it (readable by the owner only)
+        :param key: RSA key; a ready key, provided as is
+        """
+        self.size = size
+        self.path = path
+        self.__key = key
+        self.__lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the key. Loads or generates it on first call (waits for a prefetch in progress)
+        :return: RSA key
+        """
+        with self.__lock:
+            if self.__key is None:
+                if self.path and os.path.exists(self.path):
+                    with open(self.path, "rb") as key_file:
+                        self.__key = RSA.import_key(key_file.read())
+                else:
+                    self.__key = RSA.generate(self.size)
+                    if self.path:
+                        self.__save(self.__key)
+            return self.__key
+
+    def is_ready(self):
+        """
+        Returns whether the key was loaded or generated already
+        :return: bool
+        """
+        return self.__key is not None
+
+    def prefetch(self):
+        """
+        Loads or generates the key on a background thread, if it isn't ready. Returns immediately
+        """
+        if not self.is_ready():
+            threading.Thread(target=self.get, daemon=True).start()
+
+    def __save(self, key):
+        """
+        Writes the key to its file (replaced at once, so other processes never read a partial key)
+        :param key: RSA key
+        """
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "wb") as key_file:
+            key_file.write(key.export_key())
+        os.replace(temp_path, self.path)
+
+
+def provider(rsa_key=None, size=DEFAULT_KEY_SIZE):
+    """
+    Returns the provider of a service's key
+    :param rsa_key: RSA key, KeyProvider or None; a ready key, a provider, or None for a key generated on first use
+    :param size: int; generated key's size in bits
+    :return: KeyProvider
+    """
+    if isinstance(rsa_key, KeyProvider):
+        return rsa_key
+    return KeyProvider(size, key=rsa_key)
+
+
+class KeyPool:
+    """
+    Ephemeral RSA keys, generated ahead on a background thread
+    """
+    def __init__(self, size=DEFAULT_KEY_SIZE, capacity=POOL_CAPACITY):
+        """
+        :param size: int; keys' size in bits
+        :param capacity: int; keys kept generated ahead (at least one)
+        """
+        self.size = size
+        self.capacity = max(1, capacity)
+        self.__keys = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__filling = False
+
+    def start(self):
+        """
+        Starts generating keys ahead. Returns immediately
+        """
+        with self.__lock:
+            if self.__filling or self.__keys.qsize() >= self.capacity:
+                return
+            self.__filling = True
+        threading.Thread(target=self.__fill, daemon=True).start()
+
+    def get(self):
+        """
+        Takes a key out of the pool. Waits for the background thread if none is ready
+        :return: RSA key
+        """
+        self.start()
+        key = self.__keys.get()
+        self.start()
+        return key
+
+    def ready(self):
+        """
+        Returns the number of keys generated ahead
+        :return: int
+        """
+        return self.__keys.qsize()
+
+    def __fill(self):
+        """
+        Background thread; generates keys until the pool is full
+        """
+        try:
+            while True:
+                with self.__lock:
+                    if self.__keys.qsize() >= self.capacity:
+                        self.__filling = False
+                        return
+                self.__keys.put(RSA.generate(self.size))
+        except Exception:
+            with self.__lock:
+                self.__filling = False
+            raise
+
+
+__pools = {}
+__pools_lock = threading.Lock()
+
+
+def get_pool(size=DEFAULT_KEY_SIZE):
+    """
+    Returns the process' shared pool of keys of the given size, and starts filling it
+    :param size: int; keys' size in bits
+    :return: KeyPool
+    """
+    with __pools_lock:
+        pool = __pools.get(size)
+        if pool is None:
+            pool = __pools[size] = KeyPool(size)
+    pool.start()
+    return pool
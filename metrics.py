@@ -0,0 +1,471 @@
+import contextlib, functools, http.server, inspect, threading, time
+from . import constants
+
+"""
+ Metrics
+
+ Counters, gauges and summaries (count and sum) of the data path and the services, kept in a registry:
+ * sessions - packs and payload bytes sent and received per pack type, bytes written to and read from the socket
+   (wire bytes), compression input and output bytes, and the time spent in encryption, decryption, compression,
+   decompression, (de)serialization, socket reads (including the wait for the next pack) and socket writes
+ * handshakes - handshakes per mode, side and result (full, resumed or failed), and their durations
+ * servers - active and total sessions of BaseServer, AsyncBaseServer, ProxyServer, NetworkServer and CAServer
+ Metrics are off by default; call `enable()` before creating the sessions to measure. While off, the data path
+ only checks one attribute per pack. `snapshot()` returns the registry's values and `serve()` exports them in the
+ Prometheus text format from a local port. Each session also keeps its own values (Session.get_metrics()).
+ Note: every process has its own registry (see prefork module); export each process on its own port.
+"""
+
+COUNTER = "counter"
+GAUGE = "gauge"
+SUMMARY = "summary"
+
+SENT = "sent"
+RECEIVED = "received"
+
+# timed operations
+ENCRYPT = "encrypt"
+DECRYPT = "decrypt"
+COMPRESS = "compress"
+DECOMPRESS = "decompress"
+SERIALIZE = "serialize"
+DESERIALIZE = "deserialize"
+# waiting for and reading the next pack, and socket writes
+READ = "read"
+WRITE = "write"
+
+# pack types' labels
+TYPE_NAMES = {constants.SEND_BYTES: "bytes", constants.SEND_TEXT: "text", constants.SEND_FILE: "file",
+              constants.SEND_LIST: "list", constants.SEND_OBJECT: "object", constants.SEND_COMPLETE_FILE: "raw_file",
+              constants.SEND_FILE_STREAM: "file_stream", constants.SEND_BATCH: "batch",
+              constants.SEND_SEGMENTED: "segmented", constants.SEND_TICKET: "ticket"}
+
+DEFAULT_EXPORTER_IP = "127.0.0.1"
+
+_enabled = False
+
+
+def enable(status=True):
+    """
+    Turns metrics on or off. Sessions created while metrics are off aren't measured
+    :param status: bool
+    """
+    global _enabled
+    _enabled = status
+
+
+def is_enabled():
+    """
+    Returns whether metrics are on
+    :return: bool
+    """
+    return _enabled
+
+
+class Metric:
+    """
+    A metric family: a value (or a count and a sum, for summaries) per label values
+    """
+    def __init__(self, name, description, kind, label_names=()):
+        """
+        :param name: str; metric's name
+        :param description: str; metric's help text
+        :param kind: str; COUNTER, GAUGE or SUMMARY
+        :param label_names: tuple; names of the labels
+        """
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def add(self, amount, *labels):
+        """
+        Adds to a counter or a gauge (negative amounts decrease gauges)
+        :param amount: int or float
+        :param labels: label values, in the order of the label names
+        """
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """
+        Sets a gauge
+        :param value: int or float
+        :param labels: label values
+        """
+        with self.__lock:
+            self.__values[labels] = value
+
+    def observe(self, value, *labels):
+        """
+        Adds an observation to a summary
+        :param value: float
+        :param labels: label values
+        """
+        with self.__lock:
+            count, total = self.__values.get(labels, (0, 0.0))
+            self.__values[labels] = (count + 1, total + value)
+
+    def get(self, *labels):
+        """
+        Returns the value of the given label values
+        :param labels: label values
+        :return: int, float or tuple (int, float); tuple of count and sum for summaries
+        """
+        with self.__lock:
+            return self.__values.get(labels, (0, 0.0) if self.kind == SUMMARY else 0)
+
+    def values(self):
+        """
+        Returns a copy of all the values
+        :return: dict; label values tuple -> value
+        """
+        with self.__lock:
+            return dict(self.__values)
+
+
+class Registry:
+    """
+    A set of metric families
+    """
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def __metric(self, name, description, kind, label_names):
+        """
+        Returns the registered metric family of the name, registers it if it doesn't exist
+        :return: Metric
+        """
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = self.__metrics[name] = Metric(name, description, kind, label_names)
+            elif metric.kind != kind or metric.label_names != tuple(label_names):
+                raise Exception("Metric {} is registered with another type or labels".format(name))
+            return metric
+
+    def counter(self, name, description, label_names=()):
+        """
+        :param name: str
+        :param description: str
+        :param label_names: tuple
+        :return: Metric
+        """
+        return self.__metric(name, description, COUNTER, label_names)
+
+    def gauge(self, name, description, label_names=()):
+        """
+        :param name: str
+        :param description: str
+        :param label_names: tuple
+        :return: Metric
+        """
+        return self.__metric(name, description, GAUGE, label_names)
+
+    def summary(self, name, description, label_names=()):
+        """
+        :param name: str
+        :param description: str
+        :param label_names: tuple
+        :return: Metric
+        """
+        return self.__metric(name, description, SUMMARY, label_names)
+
+    def metrics(self):
+        """
+        Returns the registered metric families
+        :return: list of Metric
+        """
+        with self.__lock:
+            return list(self.__metrics.values())
+
+    def snapshot(self):
+        """
+        Returns the current values of all the metrics
+        :return: dict; name -> {"type", "help", "values": [{"labels": dict, "value": number}]}. Summaries' values
+                 are {"count": int, "sum": float}
+        """
+        snapshot = {}
+        for metric in self.metrics():
+            values = []
+            for labels, value in sorted(metric.values().items()):
+                if metric.kind == SUMMARY:
+                    value = {"count": value[0], "sum": value[1]}
+                values.append({"labels": dict(zip(metric.label_names, labels)), "value": value})
+            snapshot[metric.name] = {"type": metric.kind, "help": metric.description, "values": values}
+        return snapshot
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        :return: str
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append("# HELP {} {}".format(metric.name, metric.description))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for labels, value in sorted(metric.values().items()):
+                labels = _format_labels(metric.label_names, labels)
+                if metric.kind == SUMMARY:
+                    lines.append("{}_count{} {}".format(metric.name, labels, value[0]))
+                    lines.append("{}_sum{} {}".format(metric.name, labels, float(value[1])))
+                else:
+                    lines.append("{}{} {}".format(metric.name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(names, values):
+    """
+    Formats label values for the Prometheus text format
+    :param names: tuple; label names
+    :param values: tuple; label values
+    :return: str
+    """
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join("{}=\"{}\"".format(name, value) for name, value in zip(names, escaped)) + "}"
+
+
+class _DataPath:
+    """
+    The sessions' metric families in a registry
+    """
+    def __init__(self, registry):
+        """
+        :param registry: Registry
+        """
+        self.frames = registry.counter("sdtp_frames_total", "Packs sent and received", ("direction", "type"))
+        self.payload_bytes = registry.counter("sdtp_payload_bytes_total",
+                                              "Payload bytes of the packs, before compression and encryption",
+                                              ("direction", "type"))
+        self.wire_bytes = registry.counter("sdtp_wire_bytes_total", "Bytes written to and read from the sockets",
+                                           ("direction",))
+        self.compression_input = registry.counter("sdtp_compression_input_bytes_total",
+                                                  "Bytes given to the compression policy")
+        self.compression_output = registry.counter("sdtp_compression_output_bytes_total",
+                                                   "Bytes out of the compression policy (compressed or not)")
+        self.operation_seconds = registry.summary("sdtp_operation_seconds", "Time spent in data path operations",
+                                                  ("operation",))
+
+
+registry = Registry()
+_data_path = _DataPath(registry)
+_handshakes = registry.counter("sdtp_handshakes_total", "Completed and failed handshakes",
+                               ("mode", "side", "result"))
+_handshake_seconds = registry.summary("sdtp_handshake_seconds", "Handshakes' durations", ("mode", "side"))
+_active_sessions = registry.gauge("sdtp_active_sessions", "Sessions currently handled by servers", ("server",))
+_sessions = registry.counter("sdtp_sessions_total", "Sessions handled by servers", ("server",))
+
+
+class SessionMetrics:
+    """
+    One session's data path metrics. Values are added to the session's own registry and to the process' registry
+    """
+    def __init__(self, network):
+        """
+        :param network: Wrapper, AsyncWrapper or any network with `bytes_sent` and `bytes_received` counters
+        """
+        self.__network = network
+        self.__registry = Registry()
+        self.__data_paths = (_DataPath(self.__registry), _data_path)
+        # wire bytes already counted (the handshake's bytes aren't the session's)
+        self.__bytes_sent = getattr(network, "bytes_sent", 0)
+        self.__bytes_received = getattr(network, "bytes_received", 0)
+        self.__lock = threading.Lock()
+
+    def frame(self, direction, pack_type, payload_size):
+        """
+        Counts a sent or received pack
+        :param direction: str; SENT or RECEIVED
+        :param pack_type: int; pack's type (SEND_BYTES, SEND_TEXT etc.)
+        :param payload_size: int; payload's size before compression and encryption
+        """
+        name = TYPE_NAMES.get(pack_type, str(pack_type))
+        for data_path in self.__data_paths:
+            data_path.frames.add(1, direction, name)
+            data_path.payload_bytes.add(payload_size, direction, name)
+        self.__update_wire_bytes()
+
+    def compressed(self, size, compressed_size):
+        """
+        Counts a payload that went through the compression policy
+        :param size: int; payload's size
+        :param compressed_size: int; size out of the policy
+        """
+        for data_path in self.__data_paths:
+            data_path.compression_input.add(size)
+            data_path.compression_output.add(compressed_size)
+
+    def timed(self, operation, started):
+        """
+        Adds an operation's duration
+        :param operation: str; ENCRYPT, DECRYPT, COMPRESS, DECOMPRESS, SERIALIZE, DESERIALIZE, READ or WRITE
+        :param started: float; operation's start (time.perf_counter())
+        """
+        elapsed = time.perf_counter() - started
+        for data_path in self.__data_paths:
+            data_path.operation_seconds.observe(elapsed, operation)
+
+    def __update_wire_bytes(self):
+        """
+        Adds the bytes written and read by the network since the last update
+        """
+        with self.__lock:
+            sent = getattr(self.__network, "bytes_sent", 0)
+            received = getattr(self.__network, "bytes_received", 0)
+            sent_delta, self.__bytes_sent = sent - self.__bytes_sent, sent
+            received_delta, self.__bytes_received = received - self.__bytes_received, received
+        for data_path in self.__data_paths:
+            if sent_delta:
+                data_path.wire_bytes.add(sent_delta, SENT)
+            if received_delta:
+                data_path.wire_bytes.add(received_delta, RECEIVED)
+
+    def snapshot(self):
+        """
+        Returns the session's values (see Registry.snapshot), with its compression ratio
+        :return: dict
+        """
+        self.__update_wire_bytes()
+        snapshot = self.__registry.snapshot()
+        data_path = self.__data_paths[0]
+        size = data_path.compression_input.get()
+        snapshot["compression_ratio"] = data_path.compression_output.get() / size if size else None
+        return snapshot
+
+
+def session_metrics(network):
+    """
+    Returns a new session's metrics, None while metrics are off
+    :param network: the session's network
+    :return: SessionMetrics or None
+    """
+    return SessionMetrics(network) if _enabled else None
+
+
+def __record_handshake(mode, side, started, result):
+    """
+    Counts a handshake and adds its duration
+    :param mode: str
+    :param side: str; "server" or "client"
+    :param started: float; handshake's start (time.perf_counter())
+    :param result: HandshakeResult or None; None if the handshake failed
+    """
+    if result is None:
+        outcome = "failed"
+    else:
+        outcome = "resumed" if getattr(result, "resumed", False) else "full"
+    _handshakes.add(1, mode, side, outcome)
+    _handshake_seconds.observe(time.perf_counter() - started, mode, side)
+
+
+def measure_handshake(mode, side):
+    """
+    Decorates a handshake function (or coroutine function) to count it and measure its duration
+    :param mode: str; handshake's mode label (e.g. "rsa", "ecdh_cert")
+    :param side: str; "server" or "client"
+    :return: decorator
+    """
+    def decorator(handshake):
+        if inspect.iscoroutinefunction(handshake):
+            @functools.wraps(handshake)
+            async def measured(*args, **kwargs):
+                if not _enabled:
+                    return await handshake(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    result = await handshake(*args, **kwargs)
+                except BaseException:
+                    __record_handshake(mode, side, started, None)
+                    raise
+                __record_handshake(mode, side, started, result)
+                return result
+        else:
+            @functools.wraps(handshake)
+            def measured(*args, **kwargs):
+                if not _enabled:
+                    return handshake(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    result = handshake(*args, **kwargs)
+                except BaseException:
+                    __record_handshake(mode, side, started, None)
+                    raise
+                __record_handshake(mode, side, started, result)
+                return result
+        return measured
+    return decorator
+
+
+def session_opened(server):
+    """
+    Counts a session a server started handling
+    :param server: str; server's label
+    :return: bool; whether the session was counted (call `session_closed()` when it ends if so)
+    """
+    if not _enabled:
+        return False
+    _sessions.add(1, server)
+    _active_sessions.add(1, server)
+    return True
+
+
+def session_closed(server):
+    """
+    Counts the end of a session counted by `session_opened()`
+    :param server: str; server's label
+    """
+    _active_sessions.add(-1, server)
+
+
+@contextlib.contextmanager
+def active_session(server):
+    """
+    Counts the session handled within the block as active
+    :param server: str; server's label
+    """
+    counted = session_opened(server)
+    try:
+        yield
+    finally:
+        if counted:
+            session_closed(server)
+
+
+def snapshot():
+    """
+    Returns the process' metrics (see Registry.snapshot)
+    :return: dict
+    """
+    return registry.snapshot()
+
+
+class _ExporterHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, ip=DEFAULT_EXPORTER_IP):
+    """
+    Turns metrics on and serves them in the Prometheus text format (any path) on a background thread
+    :param port: int; exporter's port (0 for any free port)
+    :param ip: str; exporter's address (local only by default)
+    :return: ThreadingHTTPServer; call its `shutdown()` to stop serving. `server_address` holds the bound address
+    """
+    enable()
+    server = http.server.ThreadingHTTPServer((ip, port), _ExporterHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
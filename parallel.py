@@ -0,0 +1,117 @@
+import os, threading, concurrent.futures
+from . import transfer
+
+"""
+ Parallel segmented encryption
+
+ A large payload encrypted in one AEAD call runs on one core. In segmented mode the payload is split into
+ fixed size segments, each one encrypted and authenticated on its own (nonce: the pack's random prefix followed by
+ the segment's index), so the segments are encrypted and decrypted on a thread pool at once; the cipher's C code
+ runs outside the GIL. The pack's header is authenticated with every segment, so segments can't be dropped,
+ reordered or moved to another pack.
+ The receiver reads each segment into its place in a buffer allocated once for the whole payload, and decrypts it
+ there (in place) on the pool while the next segment is read from the socket.
+"""
+
+SEGMENT_SIZE = 1024 * 1024
+# payloads smaller than this are encrypted in one piece
+MIN_SIZE = 4 * 1024 * 1024
+_TAG_SIZE = 16
+
+__pool = None
+__pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the thread pool segments are encrypted on (a thread per core, created on first use)
+    :return: ThreadPoolExecutor
+    """
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="segments")
+        return __pool
+
+
+def segment_count(length, segment_size):
+    """
+    Returns the number of segments of a payload
+    :param length: int; payload's length
+    :param segment_size: int
+    :return: int
+    """
+    return (length + segment_size - 1) // segment_size
+
+
+def encrypt(new_cipher, prefix, data, segment_size=SEGMENT_SIZE, associated_data=b''):
+    """
+    Encrypts a payload's segments in parallel
+    :param new_cipher: callable; returns a session cipher for a given nonce
+    :param prefix: bytes; pack's random nonce prefix
+    :param data: bytes-like object; payload
+    :param segment_size: int
+    :param associated_data: bytes; authenticated with every segment (the pack's header)
+    :return: tuple (bytearray, bytearray); the segments' MACs (in order) and the cipher data
+    """
+    view = memoryview(data).cast("B")
+    count = segment_count(len(view), segment_size)
+    tags = bytearray(count * _TAG_SIZE)
+    cipher_data = bytearray(len(view))
+    output = memoryview(cipher_data)
+
+    def encrypt_segment(index):
+        start = index * segment_size
+        end = min(start + segment_size, len(view))
+        cipher = new_cipher(transfer.chunk_nonce(prefix, index))
+        cipher.update(associated_data)
+        cipher.encrypt(view[start:end], output=output[start:end])
+        tags[index * _TAG_SIZE:(index + 1) * _TAG_SIZE] = cipher.digest()
+
+    # consumes the results so a failed segment raises here
+    for result in get_pool().map(encrypt_segment, range(count)):
+        pass
+    return tags, cipher_data
+
+
+def decrypt(new_cipher, prefix, tags, receive_into, buffer, segment_size=SEGMENT_SIZE, associated_data=b''):
+    """
+    Receives a payload's cipher segments into a buffer and decrypts them there in parallel, each segment as soon as
+    it's received. Raises exception if a segment fails verification
+    :param new_cipher: callable; returns a session cipher for a given nonce
+    :param prefix: bytes; pack's nonce prefix
+    :param tags: bytes-like object; the segments' MACs
+    :param receive_into: callable; fills a memoryview from the socket
+    :param buffer: bytearray; the payload's size, holds the decrypted payload once done
+    :param segment_size: int
+    :param associated_data: bytes; pack's header
+    """
+    view = memoryview(buffer)
+    count = segment_count(len(view), segment_size)
+    if len(tags) != count * _TAG_SIZE:
+        raise Exception("Invalid segments")
+
+    def decrypt_segment(index):
+        segment = view[index * segment_size:min((index + 1) * segment_size, len(view))]
+        cipher = new_cipher(transfer.chunk_nonce(prefix, index))
+        cipher.update(associated_data)
+        cipher.decrypt(segment, output=segment)
+        try:
+            cipher.verify(tags[index * _TAG_SIZE:(index + 1) * _TAG_SIZE])
+        except ValueError:
+            raise Exception("Verification failed")
+
+    pool = get_pool()
+    futures = []
+    try:
+        for index in range(count):
+            receive_into(view[index * segment_size:min((index + 1) * segment_size, len(view))])
+            futures.append(pool.submit(decrypt_segment, index))
+    except Exception:
+        # segments aren't left decrypting into the buffer after a failed receive
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        raise
+    for future in futures:
+        future.result()
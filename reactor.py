@@ -0,0 +1,247 @@
+import selectors, socket, threading, heapq, itertools, collections, time, traceback
+
+"""
+ Reactor
+
+ Event loop for the blocking services (servers, non-blocking client connections, proxy and CA server).
+ Sockets are registered with a callback and the loop sleeps in the OS selector (epoll, kqueue or poll, whichever
+ is the best on the platform) until a socket is ready, a timer is due or another thread hands it a callback, so
+ idle services use no CPU and a single reactor serves thousands of sockets.
+ Callbacks run on the reactor's thread and should not block for long; long work belongs on a thread of its own.
+"""
+
+EVENT_READ = selectors.EVENT_READ
+EVENT_WRITE = selectors.EVENT_WRITE
+
+
+class Timer:
+    """
+    Scheduled call (see Reactor.call_later)
+    """
+    def __init__(self, when, callback, args):
+        """
+        :param when: float; monotonic time to run at
+        :param callback: callable
+        :param args: tuple; callback's arguments
+        """
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancels the call if it didn't run yet
+        """
+        self.cancelled = True
+
+
+class Reactor:
+    """
+    selectors based event loop with timers and callbacks from other threads
+    """
+    def __init__(self):
+        self.__selector = selectors.DefaultSelector()
+        self.__timers = []
+        self.__sequence = itertools.count()
+        self.__ready = collections.deque()
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__thread_id = None
+        # wakes the selector up when another thread adds a callback or a timer
+        self.__wakeup_reader, self.__wakeup_writer = socket.socketpair()
+        self.__wakeup_reader.setblocking(False)
+        self.__wakeup_writer.setblocking(False)
+        self.__selector.register(self.__wakeup_reader, EVENT_READ, self.__clear_wakeup)
+
+    def is_running(self):
+        """
+        Returns whether the reactor is running
+        :return: bool
+        """
+        return self.__running
+
+    def __on_reactor_thread(self):
+        return self.__thread_id is None or self.__thread_id == threading.get_ident()
+
+    def __wakeup(self):
+        try:
+            self.__wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # the reactor is woken up already (or closed)
+            pass
+
+    def __clear_wakeup(self, reader, mask):
+        try:
+            while reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def __change_selector(self, change, *args):
+        """
+        Changes the watched sockets. The reactor's thread changes them right away and other threads queue the change
+        while the reactor runs. While it doesn't run, any thread changes them right away, holding the lock so
+        `run()` doesn't start selecting in the middle
+        :param change: callable; the change
+        :param args: change's arguments
+        """
+        with self.__lock:
+            if self.__thread_id is None:
+                change(*args)
+                return
+        if self.__thread_id == threading.get_ident():
+            change(*args)
+        else:
+            self.call_soon(change, *args)
+
+    def register(self, fileobj, events, callback):
+        """
+        Watches a socket (or any selectable file object). Safe to call from any thread
+        :param fileobj: socket or file object
+        :param events: int; EVENT_READ, EVENT_WRITE or both
+        :param callback: callable; receives the file object and the ready events
+        """
+        self.__change_selector(self.__selector.register, fileobj, events, callback)
+
+    def modify(self, fileobj, events, callback):
+        """
+        Changes a watched socket's events or callback. Safe to call from any thread
+        :param fileobj: socket or file object
+        :param events: int; EVENT_READ, EVENT_WRITE or both
+        :param callback: callable
+        """
+        self.__change_selector(self.__selector.modify, fileobj, events, callback)
+
+    def unregister(self, fileobj):
+        """
+        Stops watching a socket. Safe to call from any thread
+        :param fileobj: socket or file object
+        """
+        self.__change_selector(self.__unregister, fileobj)
+
+    def __unregister(self, fileobj):
+        try:
+            self.__selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def is_registered(self, fileobj):
+        """
+        Returns whether a socket is watched
+        :param fileobj: socket or file object
+        :return: bool
+        """
+        try:
+            self.__selector.get_key(fileobj)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def call_soon(self, callback, *args):
+        """
+        Runs a callback on the reactor's thread. Safe to call from any thread
+        :param callback: callable
+        :param args: callback's arguments
+        """
+        with self.__lock:
+            self.__ready.append((callback, args))
+        if not self.__on_reactor_thread():
+            self.__wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Runs a callback on the reactor's thread after a delay. Safe to call from any thread
+        :param delay: float; seconds
+        :param callback: callable
+        :param args: callback's arguments
+        :return: Timer; call `cancel()` to cancel the call
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.__lock:
+            heapq.heappush(self.__timers, (timer.when, next(self.__sequence), timer))
+        if not self.__on_reactor_thread():
+            self.__wakeup()
+        return timer
+
+    def __timeout(self):
+        """
+        Returns how long the selector may sleep
+        :return: float or None; None to sleep until a socket is ready
+        """
+        with self.__lock:
+            if self.__ready:
+                return 0
+            if self.__timers:
+                return max(0, self.__timers[0][0] - time.monotonic())
+        return None
+
+    def __run_callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    def run_once(self, timeout=None):
+        """
+        Waits for ready sockets and due timers (up to the timeout) and runs their callbacks
+        :param timeout: float or None; max time to wait in seconds, None to wait for the next event
+        """
+        sleep = self.__timeout()
+        if timeout is not None:
+            sleep = timeout if sleep is None else min(sleep, timeout)
+        for key, mask in self.__selector.select(sleep):
+            self.__run_callback(key.data, key.fileobj, mask)
+
+        now = time.monotonic()
+        with self.__lock:
+            due = []
+            while self.__timers and self.__timers[0][0] <= now:
+                due.append(heapq.heappop(self.__timers)[2])
+            ready = self.__ready
+            self.__ready = collections.deque()
+        for timer in due:
+            if not timer.cancelled:
+                self.__run_callback(timer.callback, *timer.args)
+        for callback, args in ready:
+            self.__run_callback(callback, *args)
+
+    def run(self):
+        """
+        Runs the reactor on the calling thread until `stop()` is called
+        """
+        with self.__lock:
+            # from here on other threads queue their changes of the watched sockets
+            self.__running = True
+            self.__thread_id = threading.get_ident()
+        try:
+            while self.__running:
+                self.run_once()
+        finally:
+            with self.__lock:
+                self.__running = False
+                self.__thread_id = None
+
+    def run_in_thread(self):
+        """
+        Runs the reactor on a new thread
+        :return: Thread
+        """
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stops the reactor after the current iteration. Safe to call from any thread
+        """
+        self.__running = False
+        self.__wakeup()
+
+    def close(self):
+        """
+        Releases the selector (the registered sockets aren't closed)
+        """
+        self.__selector.close()
+        self.__wakeup_reader.close()
+        self.__wakeup_writer.close()
@@ -0,0 +1,138 @@
+import abc, pickle, marshal, json, struct
+from . import constants
+
+"""
+ Serializers
+
+ Objects and lists are serialized by the session's serializer before they are encrypted. The serializer's id is
+ sent with every object pack, so the receiving side deserializes with the same codec (both sides must have it
+ registered under the same id).
+ * pickle - any python object (the default)
+ * marshal - python's built-in types only, faster than pickle for plain data
+ * JSON - dicts, lists, strings, numbers, booleans and None. Lists are received as lists and dict keys as strings
+ * struct - fixed schema records, the fastest and most compact (see StructSerializer)
+"""
+
+
+class Serializer(abc.ABC):
+    """
+    Objects serializer. Subclasses implement `dumps()` and `loads()`
+    """
+    def __init__(self, serializer_id, name):
+        """
+        :param serializer_id: int; serializer's id on the wire (0-255)
+        :param name: str; serializer's name
+        """
+        self.id = serializer_id
+        self.name = name
+
+    @abc.abstractmethod
+    def dumps(self, obj):
+        """
+        Serializes an object
+        :param obj: object
+        :return: bytes
+        """
+
+    @abc.abstractmethod
+    def loads(self, data):
+        """
+        Deserializes an object
+        :param data: bytes-like object
+        :return: object
+        """
+
+
+class PickleSerializer(Serializer):
+    def __init__(self):
+        Serializer.__init__(self, constants.SERIALIZER_PICKLE, "pickle")
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class MarshalSerializer(Serializer):
+    def __init__(self):
+        Serializer.__init__(self, constants.SERIALIZER_MARSHAL, "marshal")
+
+    def dumps(self, obj):
+        return marshal.dumps(obj)
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+
+class JsonSerializer(Serializer):
+    def __init__(self):
+        Serializer.__init__(self, constants.SERIALIZER_JSON, "json")
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(bytes(data))
+
+
+class StructSerializer(Serializer):
+    """
+    Fixed schema codec based on the struct module. Serializes tuples (or lists) of values in the schema's order,
+    or dicts if the schema's field names are given.
+    Example: StructSerializer(16, "position", "! I d d", ("id", "x", "y"))
+    """
+    def __init__(self, serializer_id, name, schema, fields=None):
+        """
+        :param serializer_id: int; serializer's id (must not collide with the built-in ids)
+        :param name: str; serializer's name
+        :param schema: str; struct format
+        :param fields: iterable; field names, in the schema's order, for dict objects
+        """
+        Serializer.__init__(self, serializer_id, name)
+        self.__struct = struct.Struct(schema)
+        self.__fields = tuple(fields) if fields else None
+
+    def dumps(self, obj):
+        if self.__fields:
+            return self.__struct.pack(*[obj[field] for field in self.__fields])
+        return self.__struct.pack(*obj)
+
+    def loads(self, data):
+        values = self.__struct.unpack(data)
+        if self.__fields:
+            return dict(zip(self.__fields, values))
+        return values
+
+
+__registry = {}
+
+
+def register(serializer):
+    """
+    Registers a serializer. Raises exception if its id or name is taken
+    :param serializer: Serializer
+    """
+    for registered in __registry.values():
+        if registered.id == serializer.id or registered.name == serializer.name:
+            raise Exception("Serializer id or name is already registered")
+    __registry[serializer.id] = serializer
+
+
+def get_serializer(serializer):
+    """
+    Returns a registered serializer. Raises exception if it isn't registered
+    :param serializer: int, str or Serializer; serializer's id, name or the serializer itself
+    :return: Serializer
+    """
+    if isinstance(serializer, Serializer):
+        serializer = serializer.id
+    for registered in __registry.values():
+        if registered.id == serializer or registered.name == serializer:
+            return registered
+    raise Exception("Unknown serializer")
+
+
+register(PickleSerializer())
+register(MarshalSerializer())
+register(JsonSerializer())
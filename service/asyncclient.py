@@ -0,0 +1,130 @@
+import asyncio, os
+from .. import asyncsession, asyncsock, handshake, constants
+
+NO_CERT = 0
+CERT_VER = 1
+DEFAULT_KEY_SIZE = 16
+
+
+class AsyncBaseClient:
+    """
+    asyncio client
+    """
+    def __init__(self):
+        self.__wrapper = None
+        self.__mode = NO_CERT
+        self.__ca_public_key = None
+        self.__session = None
+        self.__session_key = os.urandom(DEFAULT_KEY_SIZE)
+        self.__wire_version = constants.WIRE_V1
+        self.__key_exchange = constants.KEY_EXCHANGE_RSA
+        self.__ticket = None
+
+    def set_wire_version(self, version):
+        self.__wire_version = version
+
+    def set_cert_mode(self, ca_public_key):
+        self.__ca_public_key = ca_public_key
+        self.__mode = CERT_VER
+
+    def set_key_exchange(self, method):
+        """
+        Sets how the session key is exchanged. Must match the server's method
+        :param method: int; KEY_EXCHANGE_RSA (default) or KEY_EXCHANGE_ECDH
+        """
+        self.__key_exchange = method
+
+    def set_ticket(self, ticket):
+        """
+        Sets the resumption ticket presented on the next connection (e.g. one kept from another client)
+        :param ticket: Ticket or None
+        """
+        self.__ticket = ticket
+
+    def get_ticket(self):
+        """
+        Returns the last resumption ticket received from the server. The client presents it on its next
+        `connect()`, and skips the key exchange if the server accepts it
+        :return: Ticket or None
+        """
+        if self.__session and self.__session.get_ticket():
+            self.__ticket = self.__session.get_ticket()
+        return self.__ticket
+
+    async def connect(self, ip, port, early_data=None):
+        """
+        Connects to the server. Reconnects if the client was connected already, resuming the session with the last
+        ticket received from the server, if any
+        :param ip: str
+        :param port: int
+        :param early_data: bytes, str, dict or list; the session's first message, sent in the same write as the
+                           handshake's last pack instead of after it (early data)
+        """
+        if self.__wrapper:
+            self.get_ticket()
+            await self.close()
+            self.__session_key = os.urandom(DEFAULT_KEY_SIZE)
+        reader, writer = await asyncio.open_connection(ip, port)
+        self.__wrapper = asyncsock.AsyncWrapper(reader, writer)
+        if early_data is None:
+            result = await self.__establish_connection()
+        else:
+            self.__wrapper.cork()
+            result = await self.__establish_connection()
+            await self.__send_early_data(early_data)
+            self.__wrapper.uncork()
+            await self.__wrapper.drain()
+        if result.tickets:
+            # taken in at connect, so a client that never receives still has a ticket for its next connect
+            await self.__session.receive_ticket()
+
+    async def __send_early_data(self, data):
+        """
+        Sends the session's first message (held by the corked wrapper until the handshake's last pack is sent)
+        :param data: bytes, str, dict or list
+        """
+        if isinstance(data, str):
+            await self.__session.send_text(data)
+        elif isinstance(data, dict):
+            await self.__session.send_object(data)
+        elif isinstance(data, (list, tuple)):
+            await self.__session.send_list(data)
+        else:
+            await self.__session.send_bytes(data)
+
+    async def __establish_connection(self):
+        if self.__mode == CERT_VER and not self.__ca_public_key:
+            raise Exception("Certificate authority server's public key is not provided")
+        self.__session = None
+        if self.__key_exchange == constants.KEY_EXCHANGE_ECDH:
+            if self.__mode == NO_CERT:
+                result = await handshake.async_client_handshake_ecdh(self.__wrapper, wire_version=self.__wire_version,
+                                                                     ticket=self.__ticket)
+            else:
+                result = await handshake.async_client_handshake_ecdh_cert(self.__wrapper, self.__ca_public_key,
+                                                                          wire_version=self.__wire_version,
+                                                                          ticket=self.__ticket)
+        elif self.__mode == NO_CERT:
+            result = await handshake.async_client_handshake(self.__wrapper, self.__session_key,
+                                                            wire_version=self.__wire_version, ticket=self.__ticket)
+        elif self.__ca_public_key:
+            result = await handshake.async_client_handshake_cert(self.__session_key, self.__wrapper,
+                                                                 self.__ca_public_key,
+                                                                 wire_version=self.__wire_version,
+                                                                 ticket=self.__ticket)
+        else:
+            raise Exception("Certificate authority server's public key is not provided")
+
+        self.__session = asyncsession.AsyncSession.from_handshake(self.__wrapper, result, True)
+        return result
+
+    def get_session(self):
+        return self.__session
+
+    def get_wrapper(self):
+        return self.__wrapper
+
+    async def close(self):
+        if self.__wrapper:
+            self.__wrapper.close()
+            await self.__wrapper.wait_closed()
@@ -0,0 +1,113 @@
+import asyncio, inspect, traceback
+from .. import handshake, asyncsock, asyncsession, constants, keyprovider, metrics
+
+NO_CERT = 0
+CERT_VER = 1
+DEFAULT_RSA_KEY_SIZE = 1024
+
+
+class AsyncBaseServer:
+    """
+    asyncio server. Every connection is served by a task of the event loop (no thread per connection)
+    """
+    def __init__(self, rsa_key=None):
+        """
+        :param rsa_key: RSA key or KeyProvider; server's keys (generated on first use if not provided, see
+                        keyprovider module)
+        """
+        self.__keys = keyprovider.provider(rsa_key, DEFAULT_RSA_KEY_SIZE)
+        self.__handshake_mode = NO_CERT
+        self.__certificate = None
+        self.__key_exchange = constants.KEY_EXCHANGE_RSA
+        self.__tickets = None
+        self.__server = None
+
+        # function or coroutine function that receives each AsyncSession
+        self.handler = None
+
+    def set_cert_mode(self, certificate):
+        self.__handshake_mode = CERT_VER if certificate else NO_CERT
+        self.__certificate = certificate
+
+    def set_key_exchange(self, method):
+        """
+        Sets how session keys are exchanged. Clients must use the same method
+        :param method: int; KEY_EXCHANGE_RSA (default) or KEY_EXCHANGE_ECDH
+        """
+        self.__key_exchange = method
+
+    def set_tickets(self, ticket_keys):
+        """
+        Issues resumption tickets after every handshake, and accepts them instead of a key exchange on reconnect
+        (see tickets module)
+        :param ticket_keys: TicketKeys or None; server's ticket keys (lifetime and rotation). None turns it off
+        """
+        self.__tickets = ticket_keys
+
+    async def start(self, ip, port):
+        """
+        Serves connections until the server is stopped
+        """
+        if self.__handshake_mode == CERT_VER or self.__key_exchange == constants.KEY_EXCHANGE_RSA:
+            # the first handshakes wait for the key, the server listens right away
+            self.__keys.prefetch()
+        self.__server = await asyncio.start_server(self.__handle_client, ip, port)
+        print ("listening...")
+        try:
+            async with self.__server:
+                await self.__server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def run(self, ip, port):
+        """
+        Runs the server on a new event loop (blocking)
+        """
+        asyncio.run(self.start(ip, port))
+
+    def stop(self):
+        if self.__server:
+            self.__server.close()
+
+    async def __private_key(self):
+        """
+        Returns the server's key, waiting on an executor thread if it's still being loaded or generated
+        :return: RSA key
+        """
+        if self.__keys.is_ready():
+            return self.__keys.get()
+        return await asyncio.get_running_loop().run_in_executor(None, self.__keys.get)
+
+    async def __handle_client(self, reader, writer):
+        network = asyncsock.AsyncWrapper(reader, writer)
+        try:
+            if self.__key_exchange == constants.KEY_EXCHANGE_ECDH:
+                if self.__handshake_mode == NO_CERT:
+                    result = await handshake.async_server_handshake_ecdh(network, tickets=self.__tickets)
+                else:
+                    result = await handshake.async_server_handshake_ecdh_cert(await self.__private_key(), network,
+                                                                              self.__certificate,
+                                                                              tickets=self.__tickets)
+            elif self.__handshake_mode == NO_CERT:
+                result = await handshake.async_server_handshake(await self.__private_key(), network,
+                                                                tickets=self.__tickets)
+            else:
+                result = await handshake.async_server_handshake_cert(await self.__private_key(), network,
+                                                                     self.__certificate, tickets=self.__tickets)
+
+            _session = asyncsession.AsyncSession.from_handshake(network, result)
+            if self.__tickets:
+                await _session.issue_ticket(self.__tickets)
+            with metrics.active_session("async"):
+                await self.handle_session(_session)
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+        finally:
+            network.close()
+
+    # after the session is established, this method will use the session in anyway you want it
+    async def handle_session(self, session):
+        if self.handler:
+            result = self.handler(session)
+            if inspect.isawaitable(result):
+                await result
@@ -1,12 +1,17 @@
-import socket, os, threading
-from .. import session, handshake, sock
+import socket, os, traceback
+from .. import session, handshake, sock, constants, reactor
+from . import workerpool
 
 NO_CERT = 0
 CERT_VER = 1
 DEFAULT_KEY_SIZE = 16
 
 class BaseClient:
-    def __init__(self):
+    def __init__(self, event_loop=None):
+        """
+        :param event_loop: Reactor; shared reactor for the non-blocking connection. The client runs its own if not
+                           provided
+        """
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__wrapper = None
         self.__mode = NO_CERT
@@ -14,26 +19,115 @@ class BaseClient:
         self.__session = None
         self.__session_key = os.urandom(DEFAULT_KEY_SIZE)
         self.__non_block_mode = False
+        # receives and handles income data off the reactor's thread (non-blocking connection)
+        self.__receiver = None
+        self.__owns_reactor = event_loop is None
+        self.__reactor = event_loop
+        self.__wire_version = constants.WIRE_V1
+        self.__key_exchange = constants.KEY_EXCHANGE_RSA
+        self.__ticket = None
+
+    def set_wire_version(self, version):
+        self.__wire_version = version
 
     def set_cert_mode(self, ca_public_key):
         self.__ca_public_key = ca_public_key
         self.__mode = CERT_VER
 
-    def connect(self, ip, port):
+    def set_key_exchange(self, method):
+        """
+        Sets how the session key is exchanged. Must match the server's method
+        :param method: int; KEY_EXCHANGE_RSA (default) or KEY_EXCHANGE_ECDH
+        """
+        self.__key_exchange = method
+
+    def set_ticket(self, ticket):
+        """
+        Sets the resumption ticket presented on the next connection (e.g. one kept from another client)
+        :param ticket: Ticket or None
+        """
+        self.__ticket = ticket
+
+    def get_ticket(self):
+        """
+        Returns the last resumption ticket received from the server. The client presents it on its next
+        `connect()`, and skips the key exchange if the server accepts it
+        :return: Ticket or None
+        """
+        if self.__session and self.__session.get_ticket():
+            self.__ticket = self.__session.get_ticket()
+        return self.__ticket
+
+    def connect(self, ip, port, early_data=None):
+        """
+        Connects to the server. Reconnects if the client was connected already, resuming the session with the last
+        ticket received from the server, if any
+        :param ip: str
+        :param port: int
+        :param early_data: bytes, str, dict or list; the session's first message, sent in the same write as the
+                           handshake's last pack instead of after it (early data)
+        """
+        if self.__wrapper:
+            self.get_ticket()
+            self.__socket.close()
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.__session_key = os.urandom(DEFAULT_KEY_SIZE)
         self.__socket.connect((ip, port))
-        self.__establish_connection()
+        # every pack is written at once (see BaseServer)
+        self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__establish_connection(early_data)
 
-    def __establish_connection(self):
+    def __establish_connection(self, early_data=None):
         self.__wrapper = sock.Wrapper(self.__socket)
-        if self.__mode == NO_CERT:
-            handshake.client_handshake(self.__wrapper, self.__session_key)
+        self.__session = None
+        if early_data is None:
+            result = self.__handshake()
+        else:
+            self.__wrapper.cork()
+            result = self.__handshake()
+            self.__send_early_data(early_data)
+            self.__wrapper.uncork()
+        if result.tickets:
+            # taken in at connect, so a client that never receives still has a ticket for its next connect
+            self.__session.receive_ticket()
+
+    def __send_early_data(self, data):
+        """
+        Sends the session's first message (held by the corked wrapper until the handshake's last pack is sent)
+        :param data: bytes, str, dict or list
+        """
+        if isinstance(data, str):
+            self.__session.send_text(data)
+        elif isinstance(data, dict):
+            self.__session.send_object(data)
+        elif isinstance(data, (list, tuple)):
+            self.__session.send_list(data)
+        else:
+            self.__session.send_bytes(data)
+
+    def __handshake(self):
+        result = None
+        if self.__key_exchange == constants.KEY_EXCHANGE_ECDH:
+            if self.__mode == NO_CERT:
+                result = handshake.client_handshake_ecdh(self.__wrapper, wire_version=self.__wire_version,
+                                                         ticket=self.__ticket)
+            elif self.__ca_public_key:
+                result = handshake.client_handshake_ecdh_cert(self.__wrapper, self.__ca_public_key,
+                                                              wire_version=self.__wire_version, ticket=self.__ticket)
+            else:
+                raise Exception("Certificate authority server's public key is not provided")
+        elif self.__mode == NO_CERT:
+            result = handshake.client_handshake(self.__wrapper, self.__session_key,
+                                                wire_version=self.__wire_version, ticket=self.__ticket)
         elif self.__mode == CERT_VER:
             if self.__ca_public_key:
-                handshake.client_handshake_cert(self.__session_key, self.__wrapper, self.__ca_public_key)
+                result = handshake.client_handshake_cert(self.__session_key, self.__wrapper, self.__ca_public_key,
+                                                         wire_version=self.__wire_version, ticket=self.__ticket)
             else:
                 raise Exception("Certificate authority server's public key is not provided")
 
-        self.__session = session.Session(self.__wrapper, self.__session_key, True)
+        self.__session = session.Session.from_handshake(self.__wrapper, result, True)
+        return result
 
     def get_session(self):
         return self.__session
@@ -42,20 +136,57 @@ class BaseClient:
         return self.__wrapper
 
     def non_blocking_connection(self):
+        """
+        Handles income data (see `handle_income_data()`) whenever the socket is readable, instead of blocking on
+        `receive()`. The reactor only waits for the socket: the message is received and handled on the client's own
+        receiving thread, so a slow handler or a large message doesn't hold up other services on a shared reactor.
+        Messages are handled one at a time, in order. Sending is done from any thread as usual
+        """
         self.__non_block_mode = True
-        threading.Thread(target=self.__non_blocking_connection).start()
+        if self.__reactor is None:
+            self.__reactor = reactor.Reactor()
+        if self.__receiver is None:
+            self.__receiver = workerpool.WorkerPool(1, 1)
+            self.__receiver.start()
+        self.__reactor.register(self.__socket, reactor.EVENT_READ, self.__on_readable)
+        if self.__owns_reactor and not self.__reactor.is_running():
+            self.__reactor.run_in_thread()
 
     def stop_non_block_socket(self):
         self.__non_block_mode = False
+        if self.__reactor:
+            self.__reactor.unregister(self.__socket)
+            if self.__owns_reactor:
+                self.__reactor.stop()
+        if self.__receiver:
+            self.__receiver.shutdown()
+            self.__receiver = None
+
+    def __on_readable(self, connection, mask):
+        # the socket isn't watched while its message is received; the receiving thread watches it again after
+        self.__reactor.unregister(self.__socket)
+        receiver = self.__receiver
+        if receiver is not None:
+            receiver.submit(self.__receive_income)
 
-    def __non_blocking_connection(self):
-        self.__wrapper.set_non_blocking()
-        while self.__non_block_mode:
-            self.__wrapper.get_non_blocking().select()
-            if self.__wrapper.get_non_blocking().is_readable():
+    def __receive_income(self):
+        """
+        Receiving thread: receives and handles the socket's next message
+        """
+        try:
+            self.handle_income_data(self.__session.receive())
+            # messages left from a received batch are handled without waiting for the socket
+            while self.__session.pending():
                 self.handle_income_data(self.__session.receive())
-            if self.__wrapper.get_non_blocking().is_writeable():
-                self.__wrapper.send_from_queue()
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+            self.stop_non_block_socket()
+            return
+        self.__reactor.call_soon(self.__watch)
+
+    def __watch(self):
+        if self.__non_block_mode:
+            self.__reactor.register(self.__socket, reactor.EVENT_READ, self.__on_readable)
 
     def handle_income_data(self, received_data):
         """
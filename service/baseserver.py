@@ -1,77 +1,223 @@
 import socket, threading, traceback
-from .. import handshake, session, sock
+from .. import handshake, session, sock, reactor, constants, keyprovider, metrics
+from . import workerpool
 
 NO_CERT = 0
 CERT_VER = 1
 DEFAULT_RSA_KEY_SIZE = 1024
+# seconds a refused client is asked to wait before reconnecting
+DEFAULT_RETRY_AFTER = 1.0
+# max sessions served at once
+DEFAULT_MAX_SESSIONS = 1024
 
 
 class BaseServer:
-    def __init__(self, rsa_key=None):
-        self.__set_keys(rsa_key)
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(self, rsa_key=None, event_loop=None, workers=workerpool.DEFAULT_WORKERS,
+                 backlog=workerpool.DEFAULT_QUEUE_SIZE, max_wait=None, retry_after=DEFAULT_RETRY_AFTER,
+                 max_sessions=DEFAULT_MAX_SESSIONS):
+        """
+        Handshakes run on a bounded pool of worker threads. Accepted connections wait in a bounded backlog for a
+        free worker; once the backlog is full, new connections get a busy response and are closed right away (the
+        client's handshake raises handshake.ServerBusy). Once its handshake is done, a session is served on a thread
+        of its own and the worker takes the next connection, so long-lived sessions don't hold the workers. Sessions
+        have their own limit: a connection that comes in while max_sessions are served gets the busy response too
+        :param rsa_key: RSA key or KeyProvider; server's keys (generated on first use if not provided, see
+                        keyprovider module)
+        :param event_loop: Reactor; shared reactor that accepts the connections. The server runs its own if not
+                           provided
+        :param workers: int; max handshakes run at once
+        :param backlog: int; max accepted connections waiting for a worker
+        :param max_wait: float or None; connections that waited longer than this (seconds) for a worker get a busy
+                         response instead of a handshake
+        :param retry_after: float; seconds refused clients are asked to wait before reconnecting
+        :param max_sessions: int or None; max sessions served at once (None for no limit)
+        """
+        self.__keys = keyprovider.provider(rsa_key, DEFAULT_RSA_KEY_SIZE)
+        self.__socket = None
         self.__handshake_mode = NO_CERT
         self.__certificate = None
+        self.__key_exchange = constants.KEY_EXCHANGE_RSA
+        self.__tickets = None
         self.__run = False
         self.__lock = threading.Lock()
         self.__non_block = False
+        self.__owns_reactor = event_loop is None
+        self.__reactor = event_loop or reactor.Reactor()
+        self.__retry_after = retry_after
+        self.__refused = 0
+        self.__max_sessions = max_sessions
+        self.__sessions = 0
+        self.__pool = workerpool.WorkerPool(workers, backlog, max_wait, self.__refuse)
 
         self.handler = None
 
-    def __set_keys(self, rsa_key):
-        if rsa_key:
-            self.__private_key = rsa_key
-            self.__public_key = rsa_key.publickey()
-        else:
-            key = handshake.generate_rsa_keys(DEFAULT_RSA_KEY_SIZE)
-            self.__private_key = key
-            self.__public_key = key.publickey()
-
     def set_cert_mode(self, certificate):
         self.__handshake_mode = CERT_VER if certificate else NO_CERT
         self.__certificate = certificate
 
-    def start(self, ip, port, non_blocked=False):
+    def set_key_exchange(self, method):
+        """
+        Sets how session keys are exchanged. Clients must use the same method
+        :param method: int; KEY_EXCHANGE_RSA (default) or KEY_EXCHANGE_ECDH (ephemeral X25519, see handshake module)
+        """
+        self.__key_exchange = method
+
+    def set_tickets(self, ticket_keys):
+        """
+        Issues resumption tickets after every handshake, and accepts them instead of a key exchange on reconnect
+        (see tickets module)
+        :param ticket_keys: TicketKeys or None; server's ticket keys (lifetime and rotation). None turns it off
+        """
+        self.__tickets = ticket_keys
+
+    def start(self, ip, port, non_blocked=False, reuse_port=False):
+        """
+        Starts accepting connections. Blocks while the server's own reactor runs (until `stop()`); with a shared
+        reactor the method returns and the reactor's owner runs it
+        :param ip: str
+        :param port: int
+        :param non_blocked: bool; kept for compatibility, connections are always accepted by the reactor
+        :param reuse_port: bool; binds with SO_REUSEPORT, so several processes can listen on the same address and
+                           the kernel spreads the connections between them (see prefork module)
+        """
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise Exception("SO_REUSEPORT isn't supported on this platform")
+            self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.__socket.bind((ip, port))
-        self.__socket.listen(5)
+        self.__socket.listen(socket.SOMAXCONN)
+        self.__socket.setblocking(False)
         self.__run = True
+        self.__non_block = non_blocked
+        self.__pool.start()
+        if self.__handshake_mode == CERT_VER or self.__key_exchange == constants.KEY_EXCHANGE_RSA:
+            # the first handshakes wait for the key, the server listens right away
+            self.__keys.prefetch()
+        self.__reactor.register(self.__socket, reactor.EVENT_READ, self.__accept_connections)
         print ("listening...")
-        if non_blocked:
-            self.__non_blocked_listen()
-        else:
-            while self.__run:
-                self.__accept_connections()
+        if self.__owns_reactor:
+            self.__reactor.run()
 
     def stop(self):
         with self.__lock:
             self.__run = False
+        if self.__socket:
+            self.__reactor.unregister(self.__socket)
+        if self.__owns_reactor:
+            self.__reactor.stop()
+        self.__pool.shutdown()
 
-    def __accept_connections(self):
-        connection, address = self.__socket.accept()
-        print ("connection from ", address)
-        threading.Thread(target=self.__handle_client, args=(connection,)).start()
+    def get_stats(self):
+        """
+        Returns the connection handling statistics: the worker pool's (queue depth, wait times, rejected
+        connections etc.), the number of refused connections and the number of sessions served
+        :return: dict
+        """
+        stats = self.__pool.get_stats()
+        with self.__lock:
+            stats["refused"] = self.__refused
+            stats["sessions"] = self.__sessions
+        return stats
 
-    def __non_blocked_listen(self):
-        self.__non_block = True
-        wrap = sock.NonBlockingSocket(self.__socket)
+    def __accept_connections(self, server_socket, mask):
+        # accepts every pending connection
         while self.__run:
-            wrap.select()
-            if wrap.is_readable():
-                self.__accept_connections()
+            try:
+                connection, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            if not self.__pool.submit(self.__handle_client, connection):
+                self.__refuse(connection)
+                continue
+            print ("connection from ", address)
+
+    def __refuse(self, connection):
+        """
+        Sends the busy response and closes the connection. Doesn't block (the response fits in the socket's empty
+        send buffer)
+        :param connection: socket
+        """
+        with self.__lock:
+            self.__refused += 1
+        try:
+            connection.setblocking(False)
+            header_first = self.__handshake_mode == CERT_VER or self.__key_exchange == constants.KEY_EXCHANGE_ECDH
+            connection.send(handshake.busy_pack(header_first, self.__retry_after))
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+    def __reserve_session(self):
+        """
+        Takes a session slot
+        :return: bool; False if max sessions are served
+        """
+        with self.__lock:
+            if self.__max_sessions is not None and self.__sessions >= self.__max_sessions:
+                return False
+            self.__sessions += 1
+            return True
+
+    def __release_session(self):
+        with self.__lock:
+            self.__sessions -= 1
 
     def __handle_client(self, connection):
-        network = sock.Wrapper(connection)
-        session_key = None
+        if not self.__reserve_session():
+            self.__refuse(connection)
+            return
         try:
-            if self.__handshake_mode == NO_CERT:
-                session_key = handshake.server_handshake(self.__private_key, network)
-            elif self.__handshake_mode == CERT_VER:
-                session_key = handshake.server_handshake_cert(self.__private_key, network, self.__certificate)
+            _session = self.__handshake(connection)
+        except Exception as e:
+            self.__release_session()
+            connection.close()
+            traceback.print_exception(type(e), e, e.__traceback__)
+            return
+        threading.Thread(target=self.__serve_session, args=(_session,), daemon=True).start()
 
-            _session = session.Session(network, session_key)
-            self.handle_session(_session)
+    def __serve_session(self, _session):
+        """
+        Session thread: runs the session's handler, then frees its slot
+        :param _session: Session
+        """
+        try:
+            with metrics.active_session("base"):
+                self.handle_session(_session)
         except Exception as e:
             traceback.print_exception(type(e), e, e.__traceback__)
+        finally:
+            self.__release_session()
+
+    def __handshake(self, connection):
+        """
+        Runs the server's handshake on a worker thread
+        :param connection: socket
+        :return: Session
+        """
+        connection.setblocking(True)
+        # every pack is written at once, so Nagle's algorithm only delays a pack that follows an unacknowledged one
+        # (e.g. the first response after the resumption ticket)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        network = sock.Wrapper(connection)
+        result = None
+        if self.__key_exchange == constants.KEY_EXCHANGE_ECDH:
+            if self.__handshake_mode == NO_CERT:
+                result = handshake.server_handshake_ecdh(network, tickets=self.__tickets)
+            else:
+                result = handshake.server_handshake_ecdh_cert(self.__keys.get(), network, self.__certificate,
+                                                              tickets=self.__tickets)
+        elif self.__handshake_mode == NO_CERT:
+            result = handshake.server_handshake(self.__keys.get(), network, tickets=self.__tickets)
+        elif self.__handshake_mode == CERT_VER:
+            result = handshake.server_handshake_cert(self.__keys.get(), network, self.__certificate,
+                                                     tickets=self.__tickets)
+
+        _session = session.Session.from_handshake(network, result)
+        if self.__tickets:
+            _session.issue_ticket(self.__tickets)
+        return _session
 
     # after the session is established, this method will use the session in anyway you want it
     def handle_session(self, session):
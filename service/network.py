@@ -3,7 +3,8 @@ import struct
 import uuid
 import os
 from Crypto.PublicKey import RSA
-from ..handshake import generate_rsa_keys, _send_symmetric_key, _receive_symmetric_key
+from ..handshake import _send_symmetric_key, _receive_symmetric_key
+from .. import keyprovider, metrics
 from ..sock import Wrapper
 from ..session import Session
 
@@ -80,9 +81,25 @@ class NetworkClient:
     def __init__(self):
         self.__connection = None
         self.session = None
-        self.keys = generate_rsa_keys(1024)
+        # the client's ephemeral keys are taken from the shared pool when joining a network
+        self.__key_pool = keyprovider.get_pool(keyprovider.DEFAULT_KEY_SIZE)
+        self.__keys = None
         self.encryption_key = None
 
+    @property
+    def keys(self):
+        """
+        Client's RSA keys (taken out of the pre-generated keys pool on first use)
+        :return: RSA key
+        """
+        if self.__keys is None:
+            self.__keys = self.__key_pool.get()
+        return self.__keys
+
+    @keys.setter
+    def keys(self, rsa_key):
+        self.__keys = rsa_key
+
     def connect(self, ip, port):
         """
         Connects to the network server
@@ -138,10 +155,14 @@ class NetworkServer:
     """
     Network server. Managing the networks and broadcasts income data.
     """
-    def __init__(self):
+    def __init__(self, rsa_key=None):
+        """
+        :param rsa_key: RSA key or KeyProvider; server's keys (generated on first use if not provided, see
+                        keyprovider module)
+        """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.networks = {}
-        self.keys = generate_rsa_keys(1024)
+        self.__keys = keyprovider.provider(rsa_key, keyprovider.DEFAULT_KEY_SIZE)
         network = Network('test', os.urandom(16))
         self.networks['test'] = network
 
@@ -153,12 +174,21 @@ class NetworkServer:
         """
         self.socket.bind((ip, port))
         self.socket.listen(5)
+        self.__keys.prefetch()
         print('listening...')
         while True:
             conn, addr = self.socket.accept()
             print(addr)
             threading.Thread(target=self.handle_client, args=(conn,)).start()
 
+    @property
+    def keys(self):
+        """
+        Server's RSA keys
+        :return: RSA key
+        """
+        return self.__keys.get()
+
     def handle_creation(self, node, network_name, connection):
         """
         Handles new network creation
@@ -219,10 +249,11 @@ class NetworkServer:
                 else:
                     connection.send(struct.pack('!B', FAILED))
             if network:
-                while True:
-                    # use socket object directly
-                    data = connection.connection.recv(1024)
-                    if data:
-                        network.broadcast(_id, data)
+                with metrics.active_session("network"):
+                    while True:
+                        # use socket object directly
+                        data = connection.connection.recv(1024)
+                        if data:
+                            network.broadcast(_id, data)
         except Exception as e:
             traceback.print_exception(type(e), e, e.__traceback__)
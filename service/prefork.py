@@ -0,0 +1,229 @@
+import os, socket, signal, time, multiprocessing
+from multiprocessing import connection as mp_connection
+from .. import constants, keyprovider, reactor
+from . import baseserver
+
+"""
+ Pre-fork server
+
+ Handshakes and session encryption are CPU bound, and a single process runs them on one core at a time (GIL).
+ PreforkServer starts several worker processes, each one running its own BaseServer bound to the same address with
+ SO_REUSEPORT, so the kernel spreads the incoming connections between them and every core runs handshakes.
+ The RSA key and the certificate are created (or loaded) once in the supervising process and shared by all the
+ workers, so clients see the same server whichever worker accepts them. The supervisor restarts workers that exit;
+ a worker that keeps crashing right after it starts is restarted with a growing delay.
+ Requires fork (POSIX) and SO_REUSEPORT (Linux, BSD, macOS).
+"""
+
+# a worker that exits sooner than this (seconds) is considered crashing on start
+MIN_UPTIME = 1.0
+# restart delay of a crashing worker (doubles on every crash, up to the max)
+RESTART_DELAY = 0.5
+MAX_RESTART_DELAY = 30.0
+# seconds workers get to exit on stop before they're killed
+STOP_TIMEOUT = 5.0
+
+
+class _Worker:
+    """
+    A worker process slot
+    """
+    def __init__(self):
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = None
+        self.delay = RESTART_DELAY
+        self.restarts = 0
+
+
+class PreforkServer:
+    """
+    Runs BaseServer in several processes that share one listening address
+    """
+    def __init__(self, rsa_key=None, processes=None, server_class=baseserver.BaseServer, **options):
+        """
+        :param rsa_key: RSA key or KeyProvider; servers' keys (loaded or generated once on start, and shared by all
+                        the workers)
+        :param processes: int; number of worker processes (number of cores if not provided)
+        :param server_class: BaseServer class (or subclass) each worker runs
+        :param options: BaseServer's other parameters (workers, backlog, max_wait etc.), per process. Every worker
+                        runs its own reactor
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise Exception("SO_REUSEPORT isn't supported on this platform")
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("Pre-fork mode requires fork")
+        self.__keys = keyprovider.provider(rsa_key, baseserver.DEFAULT_RSA_KEY_SIZE)
+        self.__key = None
+        self.__certificate = None
+        self.__key_exchange = constants.KEY_EXCHANGE_RSA
+        self.__tickets = None
+        self.__processes = processes or os.cpu_count() or 1
+        self.__server_class = server_class
+        self.__options = options
+        self.__context = multiprocessing.get_context("fork")
+        self.__workers = []
+        self.__address = None
+        self.__run = False
+        self.__wakeup_reader, self.__wakeup_writer = socket.socketpair()
+
+        self.handler = None
+
+    def set_cert_mode(self, certificate):
+        """
+        Sets the certificate all the workers use (see BaseServer.set_cert_mode)
+        :param certificate: dict; certificate granted by the CA server
+        """
+        self.__certificate = certificate
+
+    def set_key_exchange(self, method):
+        """
+        Sets the key exchange method all the workers use (see BaseServer.set_key_exchange)
+        :param method: int; KEY_EXCHANGE_RSA or KEY_EXCHANGE_ECDH
+        """
+        self.__key_exchange = method
+
+    def set_tickets(self, ticket_keys):
+        """
+        Sets the ticket keys all the workers use (see BaseServer.set_tickets). The workers derive the same keys
+        from the same master key, so a ticket issued by one worker is accepted by all of them
+        :param ticket_keys: TicketKeys or None
+        """
+        self.__tickets = ticket_keys
+
+    def get_pids(self):
+        """
+        Returns the process ids of the running workers
+        :return: list
+        """
+        return [worker.process.pid for worker in self.__workers if worker.process and worker.process.is_alive()]
+
+    def get_restarts(self):
+        """
+        Returns how many times workers were restarted
+        :return: int
+        """
+        return sum(worker.restarts for worker in self.__workers)
+
+    def start(self, ip, port):
+        """
+        Starts the workers and supervises them. Blocks until `stop()` is called
+        :param ip: str
+        :param port: int
+        """
+        self.__address = (ip, port)
+        self.__key = self.__keys.get()
+        self.__run = True
+        self.__workers = [_Worker() for i in range(self.__processes)]
+        for worker in self.__workers:
+            self.__start_worker(worker)
+        try:
+            self.__supervise()
+        finally:
+            self.__stop_workers()
+
+    def stop(self):
+        """
+        Stops the workers. Safe to call from any thread or from a signal handler
+        """
+        self.__run = False
+        try:
+            self.__wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def __start_worker(self, worker):
+        worker.process = self.__context.Process(target=self.__serve, daemon=True)
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+
+    def __serve(self):
+        """
+        Worker process' main function
+        """
+        self.__wakeup_reader.close()
+        self.__wakeup_writer.close()
+        loop = reactor.Reactor()
+        server = self.__server_class(self.__key, event_loop=loop, **self.__options)
+        server.set_cert_mode(self.__certificate)
+        server.set_key_exchange(self.__key_exchange)
+        server.set_tickets(self.__tickets)
+        server.handler = self.handler
+        # SIGTERM only wakes the reactor up (the signal number is written to the wakeup socket), and the server is
+        # stopped by the reactor's callback: the handler may interrupt the reactor thread while it holds the
+        # server's or the pool's locks
+        signal_reader, signal_writer = socket.socketpair()
+        signal_reader.setblocking(False)
+        signal_writer.setblocking(False)
+        signal.set_wakeup_fd(signal_writer.fileno())
+        signal.signal(signal.SIGTERM, lambda signum, frame: None)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        loop.register(signal_reader, reactor.EVENT_READ, lambda reader, mask: self.__on_signal(reader, server, loop))
+        server.start(self.__address[0], self.__address[1], reuse_port=True)
+        loop.run()
+
+    @staticmethod
+    def __on_signal(reader, server, loop):
+        """
+        Stops the worker's server and reactor once SIGTERM arrives (reactor callback)
+        :param reader: socket; signal wakeup socket
+        :param server: BaseServer
+        :param loop: Reactor
+        """
+        try:
+            signals = reader.recv(4096)
+        except BlockingIOError:
+            return
+        if signal.SIGTERM in signals:
+            server.stop()
+            loop.stop()
+
+    def __supervise(self):
+        """
+        Waits for workers to exit and restarts them
+        """
+        while self.__run:
+            now = time.monotonic()
+            timeout = None
+            for worker in self.__workers:
+                if worker.restart_at is not None:
+                    if worker.restart_at <= now:
+                        self.__start_worker(worker)
+                    else:
+                        wait = worker.restart_at - now
+                        timeout = wait if timeout is None else min(timeout, wait)
+
+            sentinels = [worker.process.sentinel for worker in self.__workers if worker.restart_at is None]
+            ready = mp_connection.wait(sentinels + [self.__wakeup_reader], timeout)
+            if self.__wakeup_reader in ready:
+                self.__wakeup_reader.recv(4096)
+            if not self.__run:
+                return
+
+            now = time.monotonic()
+            for worker in self.__workers:
+                if worker.restart_at is None and worker.process.sentinel in ready:
+                    worker.process.join()
+                    print ("worker {} exited with code {}".format(worker.process.pid, worker.process.exitcode))
+                    worker.restarts += 1
+                    if now - worker.started_at < MIN_UPTIME:
+                        worker.restart_at = now + worker.delay
+                        worker.delay = min(worker.delay * 2, MAX_RESTART_DELAY)
+                    else:
+                        worker.delay = RESTART_DELAY
+                        worker.restart_at = now
+
+    def __stop_workers(self):
+        """
+        Asks the workers to exit (SIGTERM) and kills the ones that don't
+        """
+        processes = [worker.process for worker in self.__workers if worker.process and worker.process.is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
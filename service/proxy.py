@@ -1,5 +1,5 @@
-import socket, threading, struct
-from ..sock import NonBlockingSocket
+import socket, struct, errno
+from .. import reactor, metrics
 from .baseclient import BaseClient
 
 class ProxyClient(BaseClient):
@@ -23,57 +23,202 @@ class ProxyClient(BaseClient):
         # runs BaseClient
         self._BaseClient__establish_connection()
 
+# max bytes read from a socket at once
+_RELAY_CHUNK = 64 * 1024
+# target address pack: ip, port
+_TARGET_FORMAT = "! 4s I"
+_TARGET_SIZE = 8
+
+
+class _Tunnel:
+    """
+    Relays data between a client and its target server without blocking. Reading from one side stops while the
+    data already read from it waits to be written to the other side, so a slow side holds the fast one back
+    instead of filling the proxy's memory.
+    """
+    def __init__(self, event_loop, client):
+        """
+        :param event_loop: Reactor
+        :param client: socket; client's connection (non-blocking)
+        """
+        self.__reactor = event_loop
+        self.__client = client
+        self.__target = None
+        self.__target_pack = b''
+        # data waiting to be written to each socket
+        self.__pending = {}
+        # events each socket is registered for
+        self.__events = {}
+        self.__is_closing = False
+        self.__is_counted = metrics.session_opened("proxy")
+        self.__reactor.register(client, reactor.EVENT_READ, self.__read_target)
+
+    def __read_target(self, client, mask):
+        """
+        Reads the target server's address and connects to it
+        """
+        try:
+            data = client.recv(_TARGET_SIZE - len(self.__target_pack))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return
+        self.__target_pack += data
+        if len(self.__target_pack) < _TARGET_SIZE:
+            return
+
+        self.__reactor.unregister(client)
+        ip, port = struct.unpack(_TARGET_FORMAT, self.__target_pack)
+        self.__target = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__target.setblocking(False)
+        error = self.__target.connect_ex((socket.inet_ntoa(ip), port))
+        if error and error != errno.EINPROGRESS:
+            print ('Connection to target failed')
+            self.close()
+            return
+        self.__reactor.register(self.__target, reactor.EVENT_WRITE, self.__on_connected)
+
+    def __on_connected(self, target, mask):
+        """
+        Starts relaying once the target server accepted the connection
+        """
+        self.__reactor.unregister(target)
+        if target.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            print ('Connection to target failed')
+            self.close()
+            return
+        self.__pending = {self.__client: bytearray(), self.__target: bytearray()}
+        self.__events = {self.__client: 0, self.__target: 0}
+        self.__update(self.__client)
+        self.__update(self.__target)
+
+    def __peer(self, connection):
+        return self.__target if connection is self.__client else self.__client
+
+    def __on_event(self, connection, mask):
+        if mask & reactor.EVENT_READ:
+            try:
+                data = connection.recv(_RELAY_CHUNK)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b''
+            if data == b'':
+                # the side closed the connection; closes the tunnel once the other side got all the data
+                self.__is_closing = True
+            elif data:
+                self.__pending[self.__peer(connection)] += data
+                self.__flush(self.__peer(connection))
+        if mask & reactor.EVENT_WRITE:
+            self.__flush(connection)
+        if self.__is_closing and not self.__pending[self.__client] and not self.__pending[self.__target]:
+            print('Connection lost')
+            self.close()
+            return
+        if self.__target is not None:
+            self.__update(self.__client)
+            self.__update(self.__target)
+
+    def __flush(self, connection):
+        """
+        Writes as much of the data waiting for a socket as it accepts
+        """
+        pending = self.__pending[connection]
+        if not pending:
+            return
+        try:
+            sent = connection.send(pending)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            pending.clear()
+            self.__is_closing = True
+            return
+        del pending[:sent]
+
+    def __update(self, connection):
+        """
+        Registers a socket for the events it's waiting for
+        """
+        events = 0
+        if not self.__is_closing and not self.__pending[self.__peer(connection)]:
+            events |= reactor.EVENT_READ
+        if self.__pending[connection]:
+            events |= reactor.EVENT_WRITE
+        if events == self.__events.get(connection):
+            return
+        if not events:
+            self.__reactor.unregister(connection)
+        elif self.__events.get(connection):
+            self.__reactor.modify(connection, events, self.__on_event)
+        else:
+            self.__reactor.register(connection, events, self.__on_event)
+        self.__events[connection] = events
+
+    def close(self):
+        """
+        Closes both connections
+        """
+        for connection in (self.__client, self.__target):
+            if connection is not None:
+                self.__reactor.unregister(connection)
+                connection.close()
+        if self.__is_counted:
+            self.__is_counted = False
+            metrics.session_closed("proxy")
+
+
 class ProxyServer:
     """
     Connects two nodes on network.
+    All tunnels are relayed by one reactor (no thread per connection).
     """
-    def __init__(self):
+    def __init__(self, event_loop=None):
+        """
+        :param event_loop: Reactor; shared reactor. The server runs its own if not provided
+        """
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__run = False
+        self.__owns_reactor = event_loop is None
+        self.__reactor = event_loop or reactor.Reactor()
 
     def run(self, ip, port):
         """
-        Runs the server
+        Runs the server. Blocks while the server's own reactor runs (until `stop()`)
         :param ip: str; server's ip address
         :param port: int; port address
         """
         self.__run = True
         self.__socket.bind((ip, port))
-        self.__socket.listen(5)
-        wrapped_socket = NonBlockingSocket(self.__socket)
+        self.__socket.listen(socket.SOMAXCONN)
+        self.__socket.setblocking(False)
+        self.__reactor.register(self.__socket, reactor.EVENT_READ, self.__accept_connections)
         print ('listening...')
-        while self.__run:
-            wrapped_socket.select()
-            if wrapped_socket.is_readable():
-                connection, address = self.__socket.accept()
-                threading.Thread(target=self.__handle_client, args=(connection,)).start()
+        if self.__owns_reactor:
+            self.__reactor.run()
 
-    def __handle_client(self, client):
+    def stop(self):
         """
-        Connects client to it's server and delivers sent data between them
-        :param client: socket; socket connection
+        Stops accepting connections
         """
-        target_server = client.recv(8)
-        # target node's ip address and port number
-        ip, port = struct.unpack("! 4s I", target_server)
-        target_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        target_server.connect((socket.inet_ntoa(ip), port))
-        threading.Thread(target=self.__connect_nodes, args=(client, target_server)).start()
-        threading.Thread(target=self.__connect_nodes, args=(target_server, client)).start()
+        self.__run = False
+        self.__reactor.unregister(self.__socket)
+        if self.__owns_reactor:
+            self.__reactor.stop()
 
-    def __connect_nodes(self, first_edge, second_edge):
+    def __accept_connections(self, server_socket, mask):
         """
-        Receives ands sends data from one node to the other
-        :param first_edge: socket
-        :param second_edge: socket
+        Accepts new clients
+        :param server_socket: socket; listening socket
+        :param mask: int; ready events
         """
-        while True:
+        while self.__run:
             try:
-                income_data = first_edge.recv(1024)
-                second_edge.sendall(income_data)
-            except Exception as e:
-                print (e)
-                print('Connection lost')
-                break
-
-
+                connection, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            connection.setblocking(False)
+            _Tunnel(self.__reactor, connection)
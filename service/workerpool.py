@@ -0,0 +1,152 @@
+import threading, queue, time, traceback
+
+"""
+ Worker pool
+
+ A fixed number of worker threads takes tasks from a bounded queue. When every worker is busy and the queue is
+ full, new tasks are refused right away instead of piling up, so the caller can shed the load (the server answers
+ such connections with a busy response). The pool measures the queue's depth and how long tasks wait in it.
+"""
+
+DEFAULT_WORKERS = 64
+DEFAULT_QUEUE_SIZE = 128
+
+
+class WorkerPool:
+    """
+    Bounded pool of worker threads with a bounded task queue
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, max_wait=None, on_expired=None):
+        """
+        :param workers: int; number of worker threads
+        :param queue_size: int; max tasks waiting for a worker
+        :param max_wait: float or None; tasks that waited longer than this (seconds) aren't run
+        :param on_expired: callable or None; called with an expired task's arguments instead of the task
+        """
+        if workers < 1:
+            raise Exception("Worker pool needs at least one worker")
+        self.__workers = workers
+        self.__queue_size = max(1, queue_size)
+        # the bound is checked on submit, so shutdown can always queue the workers' stop signals
+        self.__queue = queue.Queue()
+        self.__max_wait = max_wait
+        self.__on_expired = on_expired
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__running = False
+        # statistics
+        self.__active = 0
+        self.__submitted = 0
+        self.__rejected = 0
+        self.__expired = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__max_depth = 0
+        self.__total_wait = 0.0
+        self.__max_wait_seen = 0.0
+
+    def start(self):
+        """
+        Starts the worker threads
+        """
+        with self.__lock:
+            if self.__running:
+                return
+            self.__running = True
+            self.__threads = [threading.Thread(target=self.__work, daemon=True) for i in range(self.__workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def shutdown(self, wait=False):
+        """
+        Stops the workers once they finish their current tasks. Queued tasks are dropped
+        :param wait: bool; whether to wait for the workers to exit
+        """
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__running = False
+            threads = self.__threads
+            self.__threads = []
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except queue.Empty:
+            pass
+        for thread in threads:
+            # wakes up idle workers
+            self.__queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def submit(self, task, *args):
+        """
+        Queues a task. Doesn't block
+        :param task: callable
+        :param args: task's arguments
+        :return: bool; False if the pool is stopped or its queue is full (the task is refused)
+        """
+        with self.__lock:
+            if not self.__running:
+                self.__rejected += 1
+                return False
+            if self.__queue.qsize() >= self.__queue_size:
+                self.__rejected += 1
+                return False
+            self.__queue.put((task, args, time.monotonic()))
+            self.__submitted += 1
+            self.__max_depth = max(self.__max_depth, self.__queue.qsize())
+        return True
+
+    def __work(self):
+        while True:
+            item = self.__queue.get()
+            if item is None or not self.__running:
+                return
+            task, args, queued_at = item
+            waited = time.monotonic() - queued_at
+            with self.__lock:
+                self.__total_wait += waited
+                self.__max_wait_seen = max(self.__max_wait_seen, waited)
+                is_expired = self.__max_wait is not None and waited > self.__max_wait
+                if is_expired:
+                    self.__expired += 1
+                else:
+                    self.__active += 1
+            if is_expired:
+                if self.__on_expired:
+                    self.__run(self.__on_expired, args)
+                continue
+            is_failed = not self.__run(task, args)
+            with self.__lock:
+                self.__active -= 1
+                self.__completed += 1
+                self.__failed += is_failed
+
+    @staticmethod
+    def __run(task, args):
+        """
+        Runs a task. Task's exceptions are printed and don't stop the worker
+        :return: bool; whether the task finished without an exception
+        """
+        try:
+            task(*args)
+            return True
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+            return False
+
+    def get_stats(self):
+        """
+        Returns the pool's statistics
+        :return: dict
+        """
+        with self.__lock:
+            started = self.__completed + self.__active + self.__expired
+            return {"workers": self.__workers, "active_workers": self.__active,
+                    "queue_depth": self.__queue.qsize(), "max_queue_depth": self.__max_depth,
+                    "queue_size": self.__queue_size, "submitted": self.__submitted, "rejected": self.__rejected,
+                    "expired": self.__expired, "completed": self.__completed, "failed": self.__failed,
+                    "average_wait": self.__total_wait / started if started else 0.0,
+                    "max_wait": self.__max_wait_seen}
@@ -1,6 +1,6 @@
-import struct, ntpath, pickle, datetime, os
-from . import constants, datatypes
-from Crypto.Cipher import AES
+import struct, ntpath, pickle, datetime, os, threading, collections, contextlib, time
+from . import constants, datatypes, transfer, ciphers, serializers, compression, parallel, tickets, metrics, \
+    tracing, disksink, reactor
 import zlib
 
 # all data transfer is accompanied by a header indicating the exact lengths to be read
@@ -18,31 +18,215 @@ _FILE_HEADER_SIZE = 26
 _FILE_HEADER_PACK = "! B B I I I"
 _FILE_HEADER_UNPACK = "! x I I I"
 _FILE_CHUNKS_HEADER_SIZE = 13
-# header size, type, compression, data length
-_OBJECT_PACK_FORMAT = "!B B B I"
-_OBJECT_UNPACK_FORMAT = "!B B I"
-_OBJECT_HEADER_SIZE = 6
+# header size, type, compression, serializer, nonce length, mac length, data length
+_OBJECT_PACK_FORMAT = "! B B B B I I I"
+_OBJECT_UNPACK_FORMAT = "! B B B I I I"
+_OBJECT_HEADER_SIZE = 15
+# header size, type, payload type, compression, nonce prefix length, name length, segment size, payload length
+_SEGMENTED_PACK_FORMAT = "! B B B B B H I Q"
+_SEGMENTED_UNPACK_FORMAT = "! B B B B H I Q"
+_SEGMENTED_HEADER_SIZE = 18
+# previous object pack (a pickled dict of nonce, mac and cipher object): header size, type, compression, data length
+_LEGACY_OBJECT_UNPACK_FORMAT = "!B B I"
+_LEGACY_OBJECT_HEADER_SIZE = 6
+# wire format v2 (bytes, text, objects and lists): flags and type, serializer (objects and lists only),
+# cipher data length (varint), cipher data, MAC
+# The nonce isn't sent. Both sides derive it from the sender's direction and the pack's sequence number.
+# The first byte has the v2 marker bit on, which v1 header sizes never have, so both versions can be read
+_V2_MARKER = 0x80
+_V2_COMPRESSED = 0x40
+# compressed by the direction's compression stream
+_V2_STREAM = 0x20
+_V2_TYPE_MASK = 0x1f
+_TAG_SIZE = 16
+_CLIENT_DIRECTION = 0
+_SERVER_DIRECTION = 1
+# types compressed by the compression stream in stream mode (files are compressed one chunk at a time)
+_STREAM_TYPES = (constants.SEND_BYTES, constants.SEND_TEXT, constants.SEND_OBJECT, constants.SEND_LIST,
+                 constants.SEND_BATCH)
+# batch entry: type, serializer (objects and lists), payload length (varint), payload
+_BATCH_ENTRY_FORMAT = "!B B"
+# a batch is sent once its payload reaches this size (bytes)
+BATCH_MAX_BYTES = 64 * 1024
+# max time (seconds) an auto-flushed batch waits for more messages
+BATCH_MAX_DELAY = 0.005
+# seconds the flush thread of auto batching waits for the next batch before it exits
+FLUSHER_IDLE_TIMEOUT = 1.0
+# returned by `_receive_pack()` for the session's own packs (resumption tickets), which aren't handed to the caller
+_SESSION_PACK = object()
+
+
+def _pack_varint(value):
+    """
+    Encodes an unsigned int as a varint (7 bits per byte, least significant group first)
+    :param value: int
+    :return: bytes
+    """
+    pack = bytearray()
+    while value >= 0x80:
+        pack.append((value & 0x7f) | 0x80)
+        value >>= 7
+    pack.append(value)
+    return bytes(pack)
+
+
+def _unpack_varint(data, offset):
+    """
+    Decodes a varint out of a buffer
+    :param data: bytes-like object
+    :param offset: int; varint's offset
+    :return: tuple (int, int); value and the offset following the varint
+    """
+    value = shift = 0
+    while True:
+        if offset >= len(data) or shift > 63:
+            raise Exception("Invalid varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+class _Flusher:
+    """
+    Runs a session's delayed flushes (auto batching) on one thread, instead of starting a timer thread for every
+    batch. The thread exits once no batch came for FLUSHER_IDLE_TIMEOUT seconds, and the next batch starts it again
+    """
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__timer = None
+        self.__thread = None
+
+    def call_later(self, delay, callback):
+        """
+        Schedules the flush (replaces the scheduled one, if any)
+        :param delay: float; seconds
+        :param callback: callable
+        :return: reactor.Timer; call `cancel()` to cancel the call
+        """
+        timer = reactor.Timer(time.monotonic() + delay, callback, ())
+        with self.__condition:
+            self.__timer = timer
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            else:
+                self.__condition.notify()
+        return timer
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                timer = self.__timer
+                if timer is None or timer.cancelled:
+                    self.__timer = None
+                    if not self.__condition.wait(FLUSHER_IDLE_TIMEOUT) and self.__timer is None:
+                        self.__thread = None
+                        return
+                    continue
+                wait = timer.when - time.monotonic()
+                if wait > 0:
+                    self.__condition.wait(wait)
+                    continue
+                self.__timer = None
+            timer.callback(*timer.args)
+
 
 class Session:
     """
     Server-client session
     """
-    def __init__(self, network, session_key, compress_mode=False):
+    def __init__(self, network, session_key, compress_mode=False, cipher_suite=constants.SUITE_EAX,
+                 wire_version=constants.WIRE_V1, is_client=True, dictionary=None, transcript=None):
         """
         :param network: Wrapper; socket wrapper
         :param session_key: bytes; AES encryption key; The key to be used to encrypt traffic
-        :param compress_mode: bool; True for traffic compression during transfer
+        :param compress_mode: bool; True for traffic compression during transfer (with the default compression policy)
+        :param cipher_suite: int; cipher suite agreed during the handshake
+        :param wire_version: int; wire format of sent bytes, text, objects and lists (agreed during the handshake)
+        :param is_client: bool; whether this side initiated the connection (sets the direction of v2 nonces)
+        :param dictionary: int; id of the preset compression dictionary agreed during the handshake. Turns on
+                           compression stream mode
+        :param transcript: bytes; the handshake's offer and selection, bound into the key of v2 packs. Without it v2
+                           packs are encrypted with the session key itself, which must then never be used on another
+                           connection (v2 nonces repeat on every connection)
         """
         # session's creation date
         self.timestamp = datetime.datetime
         self.__network = network
         self.__session_key = session_key
-        self.__compress = compress_mode
+        self.__suite = ciphers.get_suite(cipher_suite)
+        self.__cipher_key = self.__suite.derive_key(session_key)
+        # v2 packs' key (their nonces are sequence numbers, see `__sequence_nonce()`)
+        self.__traffic_key = self.__suite.derive_traffic_key(session_key, transcript) if transcript \
+            else self.__cipher_key
+        self.__compression = compression.CompressionPolicy() if compress_mode else None
+        # compression streams of small packs (see compression module), created on first use
+        self.__dictionary = compression.get_dictionary(dictionary) if dictionary else None
+        self.__compression_stream = bool(dictionary)
+        self.__compressor = None
+        self.__decompressor = None
         # files transfer options
         self.__file_autosave = False
         # max bytes on memory when handling files transfer
         self.__max_memory = 1024
         self.__files_target_dir = ''
+        # when saved files are flushed to the disk (see disksink module)
+        self.__fsync = disksink.FSYNC_NONE
+        self.__fsync_interval = disksink.FSYNC_INTERVAL
+        # send files as pipelined streams (see transfer module)
+        self.__file_stream = False
+        # send files from a memory map of them instead of reading them (see transfer module)
+        self.__memory_map = False
+        # large payloads encryption (see parallel module)
+        self.__parallel = False
+        self.__parallel_min_size = parallel.MIN_SIZE
+        self.__segment_size = parallel.SEGMENT_SIZE
+        # wire format v2 state
+        self.__wire_version = wire_version
+        self.__direction = _CLIENT_DIRECTION if is_client else _SERVER_DIRECTION
+        self.__send_sequence = 0
+        self.__receive_sequence = 0
+        # keeps v2 sequence numbers and compression stream packs in the order the packs are written
+        self.__send_lock = threading.RLock()
+        self.__serializer = serializers.get_serializer(constants.SERIALIZER_PICKLE)
+        # batching state (guarded by the send lock)
+        self.__batch = []
+        self.__batch_size = 0
+        self.__batch_depth = 0
+        self.__auto_batch = False
+        self.__batch_max_bytes = BATCH_MAX_BYTES
+        self.__batch_max_delay = BATCH_MAX_DELAY
+        self.__batch_timer = None
+        self.__batch_error = None
+        # runs auto batching's flushes, created on first use
+        self.__flusher = None
+        # received messages of a batch that weren't returned yet
+        self.__received = collections.deque()
+        # the last resumption ticket received from the server (see tickets module)
+        self.__ticket = None
+        # the last payload returned by `receive_stream()`; read to its end before the next message is received
+        self.__stream = None
+        # max size of a received pack's payload, encrypted and decompressed (set while a stream's chunks are received)
+        self.__max_payload = None
+        # data path metrics, None while metrics are off (see metrics module)
+        self.__metrics = metrics.session_metrics(network)
+        # stages' spans and timings, None while tracing and metrics are off (see tracing module)
+        self.__tracer = tracing.session_tracer(self.__metrics)
+
+    @classmethod
+    def from_handshake(cls, network, result, compress_mode=False):
+        """
+        Creates a session with the parameters agreed during the handshake
+        :param network: Wrapper; socket wrapper
+        :param result: HandshakeResult
+        :param compress_mode: bool; True for traffic compression during transfer
+        :return: Session
+        """
+        return cls(network, result.session_key, compress_mode, result.cipher_suite, result.wire_version,
+                   result.is_client, result.dictionary, result.transcript)
 
     def set_autosave(self, status:bool):
         """
@@ -58,6 +242,121 @@ class Session:
         """
         self.__max_memory = max_size
 
+    def set_file_stream(self, status:bool):
+        """
+        Sets whether `send_file()` sends files as pipelined streams of large chunks instead of max_memory sized chunks
+        :param status: bool
+        """
+        self.__file_stream = status
+
+    def set_memory_map(self, status:bool):
+        """
+        Sets whether `send_file()` sends files from a read-only memory map of them instead of reading them into memory
+        (in file stream mode, the chunks are also encrypted into reused buffers)
+        :param status: bool
+        """
+        self.__memory_map = status
+
+    def set_parallel_encryption(self, status:bool, min_size=parallel.MIN_SIZE, segment_size=parallel.SEGMENT_SIZE):
+        """
+        Sets whether large bytes, text and complete files are sent as segmented packs, encrypted and decrypted on
+        all cores (see parallel module). Receiving segmented packs doesn't depend on this setting
+        :param status: bool
+        :param min_size: int; payloads of this size or larger are segmented
+        :param segment_size: int; segment size in bytes
+        """
+        self.__parallel = status
+        self.__parallel_min_size = min_size
+        self.__segment_size = segment_size
+
+    def set_compression_policy(self, policy):
+        """
+        Sets the policy that decides which packs are compressed and how (see compression module)
+        :param policy: CompressionPolicy or None; None turns compression off
+        """
+        self.__compression = policy
+
+    def get_compression_policy(self):
+        """
+        Returns the compression policy, with its statistics
+        :return: CompressionPolicy or None
+        """
+        return self.__compression
+
+    def get_metrics(self):
+        """
+        Returns the session's data path metrics (see metrics module)
+        :return: dict or None; None if metrics were off when the session was created
+        """
+        return self.__metrics.snapshot() if self.__metrics else None
+
+    def set_compression_stream(self, status:bool):
+        """
+        Sets whether bytes, text, objects and lists are compressed by one compression context kept across packs,
+        instead of each pack on its own. Pays off for streams of small, similar messages.
+        Note: applies to sent packs only and requires a compression policy; the other side follows each pack's flags
+        :param status: bool
+        """
+        self.__compression_stream = status
+
+    def __compress(self, data, data_type):
+        """
+        Compresses a pack's payload according to the compression policy
+        :param data: bytes
+        :param data_type: int; pack's type
+        :return: tuple (bytes, int); payload and its compression (see compression module)
+        """
+        if self.__compression is None:
+            return data, compression.NONE
+        span = self.__tracer and self.__tracer.start(metrics.COMPRESS)
+        stream = None
+        if self.__compression_stream and data_type in _STREAM_TYPES:
+            if self.__compressor is None:
+                self.__compressor = compression.CompressionStream(dictionary=self.__dictionary)
+            stream = self.__compressor
+        compressed, compression_type = self.__compression.compress(data, data_type, stream)
+        if span:
+            self.__tracer.end(span)
+            if self.__metrics:
+                self.__metrics.compressed(len(data), len(compressed))
+        return compressed, compression_type
+
+    def __decompress(self, data, compression_type):
+        """
+        Decompresses a received pack's payload
+        :param data: bytes-like object
+        :param compression_type: int; pack's compression (see compression module)
+        :return: bytes-like object
+        """
+        if compression_type == compression.NONE:
+            return data
+        span = self.__tracer and self.__tracer.start(metrics.DECOMPRESS)
+        if compression_type == compression.ZLIB and self.__max_payload is not None:
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data, self.__max_payload)
+            if decompressor.unconsumed_tail:
+                raise Exception("Decompressed payload is too large")
+            if not decompressor.eof:
+                raise Exception("Decompression failed")
+        elif compression_type == compression.ZLIB:
+            data = zlib.decompress(data)
+        elif compression_type == compression.STREAM:
+            if self.__decompressor is None:
+                self.__decompressor = compression.DecompressionStream(self.__dictionary)
+            data = self.__decompressor.decompress(data, self.__max_payload or 0)
+        else:
+            raise Exception("Unknown compression")
+        if span:
+            self.__tracer.end(span)
+        return data
+
+    def set_serializer(self, serializer):
+        """
+        Sets the serializer of sent objects and lists. The other side must have it registered (see serializers module)
+        :param serializer: int, str or Serializer; registered serializer's id, name or the serializer itself
+        """
+        self.__serializer = serializers.get_serializer(serializer)
+
     def set_files_dir(self, directory:str):
         """
         Sets target directory to which files would be saved if requested
@@ -65,27 +364,52 @@ class Session:
         """
         self.__files_target_dir = directory
 
+    def set_fsync_policy(self, policy, interval=disksink.FSYNC_INTERVAL):
+        """
+        Sets when files saved by auto-save are flushed to the disk (see disksink module)
+        :param policy: int; FSYNC_NONE (default), FSYNC_COMMIT or FSYNC_PERIODIC
+        :param interval: int; bytes written between flushes (FSYNC_PERIODIC)
+        """
+        self.__fsync = policy
+        self.__fsync_interval = interval
+
+    def __new_cipher(self, nonce=None):
+        """
+        Returns a new session cipher
+        :param nonce: bytes; None for a random nonce
+        :return: cipher object
+        """
+        return self.__suite.new(self.__cipher_key, nonce)
+
     def __encrypt(self, data):
         """
         Encrypts data and returns the cipher text, nonce and MAC
         :param data: bytes
         :return: tuple
         """
-        cipher = AES.new(self.__session_key, AES.MODE_EAX)
+        span = self.__tracer and self.__tracer.start(metrics.ENCRYPT)
+        cipher = self.__new_cipher()
         data = data.encode("utf-8") if isinstance(data, str) else data
         cipher_text, mac = cipher.encrypt_and_digest(data)
+        if span:
+            self.__tracer.end(span)
         return cipher_text, mac, cipher.nonce
 
 
-    def __decrypt(self, data, tag, nonce):
+    def __decrypt(self, data, tag, nonce, associated_data=None, key=None):
         """
         Decrypts data and verifies it authentication. Raised exception if decryption process fails
         :param data: bytes; cipher data
         :param tag: bytes; signature
         :param nonce: bytes; used for better verification
+        :param associated_data: bytes; authenticated but unencrypted data
+        :param key: bytes; cipher key, None for the session's cipher key
         :return: None
         """
-        cipher = AES.new(self.__session_key, AES.MODE_EAX, nonce)
+        span = self.__tracer and self.__tracer.start(metrics.DECRYPT)
+        cipher = self.__suite.new(key, nonce) if key is not None else self.__new_cipher(nonce)
+        if associated_data is not None:
+            cipher.update(associated_data)
         try:
             decrypted_data = cipher.decrypt(data)
             is_decrypted = True
@@ -95,9 +419,11 @@ class Session:
         if is_decrypted:
             try:
                 cipher.verify(tag)
-                return decrypted_data
             except Exception:
                 raise Exception("Verification failed")
+            if span:
+                self.__tracer.end(span)
+            return decrypted_data
 
     def receive(self):
         """
@@ -105,16 +431,392 @@ class Session:
         Note: Blocking function. Use non-blocking methods (such as NonBlockingSocket) to avoid it
         :return: DataType
         """
-        header = self.__network.read_header()
+        return self.__receive()
+
+    def receive_stream(self, max_buffered=transfer.STREAM_BUFFER_SIZE):
+        """
+        Receives the next message. Files and segmented payloads are returned as a Stream, received as it's read and
+        holding max_buffered bytes at most, so they can be written to disk or another socket in constant memory.
+        Other messages are returned as by `receive()`.
+        Note: data of an encrypted unit larger than half of max_buffered (such as a complete file's data) is handed
+              over before it's verified; a failed verification raises exception at the unit's end (see transfer
+              module). Chunked files are received chunk by chunk, so their chunks (the sender's `max_memory()`)
+              must be half of max_buffered at most; a larger chunk raises exception before it's read
+        :param max_buffered: int; max bytes held at once, half of it for received data and half for decompressed data
+        :return: Stream or DataType
+        """
+        self.__close_stream()
+        if self.__received:
+            return self.__received.popleft()
+        data = self._receive_pack(max_buffered)
+        while data is _SESSION_PACK:
+            data = self._receive_pack(max_buffered)
+        return data
+
+    def __close_stream(self):
+        """
+        Reads the rest of the last returned stream, so the next message can be received
+        """
+        stream, self.__stream = self.__stream, None
+        if stream is not None:
+            stream.close()
+
+    def __open_stream(self, name, size, payload_type, pieces):
+        """
+        Returns a received payload's stream
+        :param name: str or None; file's name
+        :param size: int or None; payload's size (None if it's compressed and its size is known only once it's read)
+        :param payload_type: int; FILE, BYTES or TEXT
+        :param pieces: iterator; the payload's pieces
+        :return: Stream
+        """
+        self.__stream = datatypes.Stream(name, size, payload_type, pieces)
+        return self.__stream
+
+    def pending(self):
+        """
+        Returns the number of received messages (of a batch) that `receive()` returns without reading the socket
+        :return: int
+        """
+        return len(self.__received)
+
+    def __receive(self):
+        """
+        Returns the next pending message or receives a pack
+        :return: DataType
+        """
+        self.__close_stream()
+        return self.__next_message()
+
+    def __next_message(self):
+        """
+        Returns the next pending message or receives a pack
+        :return: DataType
+        """
+        if self.__received:
+            return self.__received.popleft()
+        data = self._receive_pack()
+        while data is _SESSION_PACK:
+            data = self._receive_pack()
+        return data
+
+    def __write(self, buffers):
+        """
+        Sends buffers to the other side as one write
+        :param buffers: list; bytes-like objects
+        """
+        span = self.__tracer and self.__tracer.start(metrics.WRITE)
+        self.__network.send_buffers(buffers)
+        if span:
+            self.__tracer.end(span)
+
+    def _receive_pack(self, max_buffered=None):
+        """
+        Receives and dissects one pack
+        :param max_buffered: int or None; files and segmented payloads are returned as streams holding this many bytes
+                             at most (see `receive_stream()`). None to receive them whole
+        :return: DataType or _SESSION_PACK for the session's own packs (resumption tickets)
+        """
+        span = self.__tracer and self.__tracer.start(metrics.READ)
+        first = struct.unpack("!B", self.__network.receive(1))[0]
+        if span:
+            self.__tracer.end(span)
+        if first & _V2_MARKER:
+            return self.__unpack_frame(first)
+        # v1 pack; the first byte is the header's size
+        header = self.__network.receive(first)
         data_type = struct.unpack("!B", header[:1])[0]
-        if data_type == constants.SEND_BYTES or data_type == constants.SEND_TEXT:
+        if data_type in (constants.SEND_BYTES, constants.SEND_TEXT, constants.SEND_BATCH, constants.SEND_TICKET):
             return self.__unpack_bytes(header)
-        elif data_type == constants.SEND_FILE:
-            return self.__unpack_file(header)
+        elif data_type == constants.SEND_FILE or data_type == constants.SEND_FILE_STREAM:
+            return self.__unpack_file(header, max_buffered)
         elif data_type == constants.SEND_COMPLETE_FILE:
-            return self.__unpack_raw_file(header)
+            return self.__unpack_raw_file(header, max_buffered)
         elif data_type == constants.SEND_OBJECT or data_type == constants.SEND_LIST:
             return self.__unpack_object(header)
+        elif data_type == constants.SEND_SEGMENTED:
+            return self.__unpack_segmented(struct.pack("!B", first) + header, max_buffered)
+        else:
+            # its body's length is unknown, so the next pack can't be found
+            raise Exception("Unknown pack type")
+
+    def __check_payload(self, length):
+        """
+        Raises exception if a received pack's payload is larger than allowed, before it's read
+        :param length: int; payload's length
+        """
+        if self.__max_payload is not None and length > self.__max_payload:
+            raise Exception("Pack is too large")
+
+    def __receive_segments(self, *lengths):
+        """
+        Receives a pack's body in one read and splits it into its segments. The segments are views of the socket
+        wrapper's reusable buffer (no copies), so they are valid only until the next receive.
+        :param lengths: int; length of each segment in the order they were sent
+        :return: list of memoryview
+        """
+        body = self.__network.receive_view(sum(lengths))
+        segments = []
+        offset = 0
+        for length in lengths:
+            segments.append(body[offset:offset + length])
+            offset += length
+
+        return segments
+
+    """
+    Wire format v2
+
+    Compact pack for small messages: 1 byte of flags and type, a varint length and a 16 bytes MAC.
+    The nonce is implicit: both sides count the v2 packs sent in each direction. Since the counters start over on
+    every connection, v2 packs use a traffic key derived from the session key and the handshake's transcript, which
+    holds the server's per-connection random (see handshake module).
+    Pack structure: flags and type, cipher data length, cipher data, mac
+    """
+
+    def __sequence_nonce(self, direction, sequence):
+        """
+        Returns the implicit nonce of a v2 pack
+        :param direction: int; sender's direction
+        :param sequence: int; pack's sequence number in its direction
+        :return: bytes
+        """
+        return struct.pack("!B", direction) + bytes(self.__suite.nonce_size - 9) + struct.pack("!Q", sequence)
+
+    def __send_frame(self, data_type, data, compression_type, serializer=None):
+        """
+        Encrypts and sends a v2 pack
+        :param data_type: int; SEND_BYTES, SEND_TEXT, SEND_OBJECT or SEND_LIST
+        :param data: bytes; the (compressed) payload
+        :param compression_type: int; payload's compression
+        :param serializer: Serializer; objects and lists serializer
+        """
+        flags = _V2_MARKER | data_type
+        if compression_type == compression.ZLIB:
+            flags |= _V2_COMPRESSED
+        elif compression_type == compression.STREAM:
+            flags |= _V2_COMPRESSED | _V2_STREAM
+        header = struct.pack("!B", flags)
+        if serializer:
+            header += struct.pack("!B", serializer.id)
+        with self.__send_lock:
+            span = self.__tracer and self.__tracer.start(metrics.ENCRYPT)
+            cipher = self.__suite.new(self.__traffic_key, self.__sequence_nonce(self.__direction, self.__send_sequence))
+            self.__send_sequence += 1
+            cipher.update(header)
+            cipher_data, mac = cipher.encrypt_and_digest(data)
+            if span:
+                self.__tracer.end(span)
+            self.__write([header + _pack_varint(len(cipher_data)), cipher_data, mac])
+
+    def __receive_varint(self):
+        """
+        Receives a varint
+        :return: int
+        """
+        value = shift = 0
+        byte = _V2_MARKER
+        while byte & 0x80:
+            if shift > 63:
+                raise Exception("Invalid pack length")
+            byte = struct.unpack("!B", self.__network.receive(1))[0]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        return value
+
+    def __unpack_frame(self, flags):
+        """
+        Dissects a v2 pack
+        :param flags: int; pack's first byte
+        :return: DataType
+        """
+        header = struct.pack("!B", flags)
+        data_type = flags & _V2_TYPE_MASK
+        if data_type == constants.SEND_OBJECT or data_type == constants.SEND_LIST:
+            header += self.__network.receive(1)
+        length = self.__receive_varint()
+        self.__check_payload(length)
+        cipher_data, mac = self.__receive_segments(length, _TAG_SIZE)
+        nonce = self.__sequence_nonce(1 - self.__direction, self.__receive_sequence)
+        self.__receive_sequence += 1
+        data = self.__decrypt(cipher_data, mac, nonce, header, self.__traffic_key)
+        if flags & _V2_STREAM:
+            data = self.__decompress(data, compression.STREAM)
+        elif flags & _V2_COMPRESSED:
+            data = self.__decompress(data, compression.ZLIB)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, data_type, len(data))
+
+        if data_type == constants.SEND_BATCH:
+            return self.__unpack_batch(data)
+        elif data_type == constants.SEND_TICKET:
+            return self.__accept_ticket(data)
+        return self.__to_data_type(data_type, data, header[1] if len(header) > 1 else None)
+
+    def __to_data_type(self, data_type, data, serializer=None):
+        """
+        Wraps a received payload of bytes, text, object or list in its DataType
+        :param data_type: int; SEND_BYTES, SEND_TEXT, SEND_OBJECT or SEND_LIST
+        :param data: bytes-like object; decrypted and decompressed payload
+        :param serializer: int; objects and lists serializer's id
+        :return: DataType
+        """
+        if data_type == constants.SEND_BYTES:
+            return datatypes.Bytes(bytes(data))
+        elif data_type == constants.SEND_TEXT:
+            return datatypes.Text(bytes(data))
+        elif data_type == constants.SEND_OBJECT or data_type == constants.SEND_LIST:
+            return self.__to_object(data_type, self.__deserialize(serializers.get_serializer(serializer), data))
+        raise Exception("Unknown pack type")
+
+    def __deserialize(self, serializer, data):
+        """
+        Deserializes a received object or list
+        :param serializer: Serializer
+        :param data: bytes-like object
+        :return: object
+        """
+        span = self.__tracer and self.__tracer.start(metrics.DESERIALIZE)
+        obj = serializer.loads(data)
+        if span:
+            self.__tracer.end(span)
+        return obj
+
+    """
+    Batching
+
+    Many small messages can be sent as one pack: bytes, text, objects and lists are collected while a `batch()`
+    block is open, or continuously with auto batching (`set_batching()`), and sent together as a single compressed
+    and encrypted pack. The receiver returns them one at a time from `receive()`, in the order they were sent.
+    Files are never batched; sending a file flushes the pending batch first.
+    Batch payload structure: entries of type, serializer, payload length (varint), payload
+    """
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Collects the messages sent within the block and sends them as one pack when the block exits
+        (or earlier, whenever the batch reaches the max batch size). Blocks can be nested
+        """
+        with self.__send_lock:
+            self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.__send_lock:
+                self.__batch_depth -= 1
+                if not self.__batch_depth:
+                    self.__flush()
+
+    def set_batching(self, status:bool, max_bytes=BATCH_MAX_BYTES, max_delay=BATCH_MAX_DELAY):
+        """
+        Sets auto batching: sent messages are collected and sent together once the batch reaches max_bytes or
+        max_delay seconds after the first message of the batch, whichever comes first
+        :param status: bool
+        :param max_bytes: int; max batch size in bytes (also applies to `batch()` blocks)
+        :param max_delay: float; max time in seconds a message waits in the batch
+        """
+        with self.__send_lock:
+            self.__auto_batch = status
+            self.__batch_max_bytes = max_bytes
+            self.__batch_max_delay = max_delay
+            if not status:
+                self.__flush()
+
+    def flush(self):
+        """
+        Sends the pending batch, if any
+        """
+        self.__flush()
+
+    def __flush(self):
+        """
+        Sends the pending batch
+        """
+        with self.__send_lock:
+            if self.__batch_timer is not None:
+                self.__batch_timer.cancel()
+                self.__batch_timer = None
+            if self.__batch_error is not None:
+                error, self.__batch_error = self.__batch_error, None
+                raise error
+            if not self.__batch:
+                return
+            payload = b''.join(self.__batch)
+            self.__batch = []
+            self.__batch_size = 0
+            self.__send_bytes(payload, constants.SEND_BATCH)
+
+    def __flush_on_timer(self):
+        """
+        Sends the pending batch once its max delay passed. A failure is raised by the next send or flush
+        """
+        try:
+            self.__flush()
+        except Exception as e:
+            with self.__send_lock:
+                self.__batch_error = e
+
+    def __add_to_batch(self, data_type, data, serializer_id=0):
+        """
+        Adds a message to the pending batch if batching is on. Messages of the max batch size or larger aren't
+        batched (the pending batch is sent first so the order is kept)
+        :param data_type: int; SEND_BYTES, SEND_TEXT, SEND_OBJECT or SEND_LIST
+        :param data: bytes; message's payload (serialized objects and lists)
+        :param serializer_id: int; objects and lists serializer
+        :return: bool; whether the message was added to the batch
+        """
+        if not self.__batch_depth and not self.__auto_batch:
+            return False
+        with self.__send_lock:
+            if not self.__batch_depth and not self.__auto_batch:
+                return False
+            if len(data) >= self.__batch_max_bytes:
+                self.__flush()
+                return False
+            entry = struct.pack(_BATCH_ENTRY_FORMAT, data_type, serializer_id) + _pack_varint(len(data))
+            self.__batch.append(entry)
+            self.__batch.append(data)
+            self.__batch_size += len(entry) + len(data)
+            if self.__batch_size >= self.__batch_max_bytes:
+                self.__flush()
+            elif self.__auto_batch and self.__batch_timer is None:
+                self.__batch_timer = self._call_later(self.__batch_max_delay, self.__flush_on_timer)
+        return True
+
+    def _call_later(self, delay, callback):
+        """
+        Schedules a call (auto batching's flush). Runs it on the session's flush thread
+        :param delay: float; seconds
+        :param callback: callable
+        :return: object with a `cancel()` method
+        """
+        if self.__flusher is None:
+            self.__flusher = _Flusher()
+        return self.__flusher.call_later(delay, callback)
+
+    def __unpack_batch(self, data):
+        """
+        Dissects a batch payload. Returns its first message and keeps the rest for the following receive calls
+        :param data: bytes; decrypted and decompressed batch payload
+        :return: DataType
+        """
+        view = memoryview(data)
+        messages = []
+        offset = 0
+        while offset < len(view):
+            if offset + 2 > len(view):
+                raise Exception("Invalid batch")
+            data_type, serializer = struct.unpack_from(_BATCH_ENTRY_FORMAT, view, offset)
+            length, offset = _unpack_varint(view, offset + 2)
+            if offset + length > len(view):
+                raise Exception("Invalid batch")
+            messages.append(self.__to_data_type(data_type, view[offset:offset + length], serializer))
+            offset += length
+        if not messages:
+            raise Exception("Empty batch")
+        self.__received.extend(messages[1:])
+        return messages[0]
 
     """
     Handles text and raw bytes
@@ -131,14 +833,18 @@ class Session:
         :param header: bytes; pack's header segment
         :return: Bytes or Text;
         """
-        type, is_compressed, nonce_len, mac_len, data_len = struct.unpack(_BYTES_UNPACK_FORMAT, header)
-        nonce = self.__network.receive(nonce_len)
-        mac = self.__network.receive(mac_len)
-        data = self.__network.receive(data_len)
-        data = self.__decrypt(data, mac, nonce)
-        data = zlib.decompress(data) if is_compressed else data
+        type, compression_type, nonce_len, mac_len, data_len = struct.unpack(_BYTES_UNPACK_FORMAT, header)
+        self.__check_payload(nonce_len + mac_len + data_len)
+        nonce, mac, data = self.__receive_segments(nonce_len, mac_len, data_len)
+        data = self.__decompress(self.__decrypt(data, mac, nonce), compression_type)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, type, len(data))
 
-        if type == constants.SEND_TEXT:
+        if type == constants.SEND_BATCH:
+            return self.__unpack_batch(data)
+        elif type == constants.SEND_TICKET:
+            return self.__accept_ticket(data)
+        elif type == constants.SEND_TEXT:
             return datatypes.Text(data)
         else:
             return datatypes.Bytes(data)
@@ -147,29 +853,212 @@ class Session:
         """
         Builds and sends raw bytes data pack. Covers both bytes and text transfer as text is merely encoded bytes
         :param data: bytes; the data to be sent
-        :param action: SEND_BYTES or SEND_TEXT
+        :param action: SEND_BYTES, SEND_TEXT or SEND_BATCH
         """
-        data = zlib.compress(data) if self.__compress else data
-        cipher_data, mac, nonce = self.__encrypt(data)
-        header = struct.pack(_BYTES_PACK_FORMAT, _BYTES_HEADER_SIZE,
-                             action, self.__compress, len(nonce), len(mac), len(cipher_data))
-        pack = bytearray(header + nonce + mac + cipher_data)
+        # stream compressed packs must be written in the order they were compressed
+        with self.__send_lock:
+            size = len(data)
+            data, compression_type = self.__compress(data, action)
+            if action != constants.SEND_BATCH and self.__is_segmented(data):
+                self.__send_segmented(action, data, compression_type)
+            elif self.__wire_version == constants.WIRE_V2:
+                self.__send_frame(action, data, compression_type)
+            else:
+                cipher_data, mac, nonce = self.__encrypt(data)
+                header = struct.pack(_BYTES_PACK_FORMAT, _BYTES_HEADER_SIZE,
+                                     action, compression_type, len(nonce), len(mac), len(cipher_data))
 
-        self.__network.send(pack)
+                self.__write([header, nonce, mac, cipher_data])
+            if self.__metrics:
+                self.__metrics.frame(metrics.SENT, action, size)
 
     def send_bytes(self, data):
         """
         Sends bytes
         :param data: bytes
         """
-        self.__send_bytes(data, constants.SEND_BYTES)
+        if not self.__add_to_batch(constants.SEND_BYTES, data):
+            self.__send_bytes(data, constants.SEND_BYTES)
 
     def send_text(self, text:str):
         """
         Sends text
         :param text: str
         """
-        self.__send_bytes(text.encode('utf-8'), constants.SEND_TEXT)
+        data = text.encode('utf-8')
+        if not self.__add_to_batch(constants.SEND_TEXT, data):
+            self.__send_bytes(data, constants.SEND_TEXT)
+
+    """
+    Resumption tickets
+
+    The server sends a ticket after the handshake (see tickets module), encrypted like bytes. The client keeps the
+    last one it received; `receive()` takes ticket packs in and returns the following message.
+    Ticket payload: lifetime (seconds), ticket
+    """
+
+    def issue_ticket(self, ticket_keys):
+        """
+        Sends the client a resumption ticket of this session
+        :param ticket_keys: TicketKeys; server's ticket keys
+        """
+        payload = struct.pack("!I", ticket_keys.lifetime) + \
+            ticket_keys.issue(tickets.resumption_secret(self.__session_key))
+        with self.__send_lock:
+            if self.__wire_version == constants.WIRE_V2:
+                self.__send_frame(constants.SEND_TICKET, payload, compression.NONE)
+            else:
+                cipher_data, mac, nonce = self.__encrypt(payload)
+                header = struct.pack(_BYTES_PACK_FORMAT, _BYTES_HEADER_SIZE, constants.SEND_TICKET, compression.NONE,
+                                     len(nonce), len(mac), len(cipher_data))
+                self.__write([header, nonce, mac, cipher_data])
+            if self.__metrics:
+                self.__metrics.frame(metrics.SENT, constants.SEND_TICKET, len(payload))
+
+    def __accept_ticket(self, payload):
+        """
+        Keeps a received resumption ticket
+        :param payload: bytes-like object; decrypted ticket pack
+        :return: _SESSION_PACK
+        """
+        lifetime = struct.unpack("!I", payload[:4])[0]
+        self.__ticket = tickets.Ticket(bytes(payload[4:]), tickets.resumption_secret(self.__session_key),
+                                       time.time() + lifetime)
+        return _SESSION_PACK
+
+    def receive_ticket(self):
+        """
+        Receives the resumption ticket that a server with ticket keys sends before its first message (client side,
+        see HandshakeResult.tickets). A message received instead is kept for `receive()`
+        :return: Ticket or None
+        """
+        data = self._receive_pack()
+        if data is not _SESSION_PACK:
+            self.__received.appendleft(data)
+        return self.__ticket
+
+    def get_ticket(self):
+        """
+        Returns the last resumption ticket received from the server
+        :return: Ticket or None
+        """
+        return self.__ticket
+
+    """
+    Segmented packs
+
+    Large bytes, text and complete files, with parallel encryption on (`set_parallel_encryption()`), are split into
+    segments that are encrypted and decrypted on all cores (see parallel module). The file name, if any, is
+    encrypted as one more segment following the last one. The whole header is authenticated with every segment.
+    Header size: 18 bytes
+    Pack structure: header, nonce prefix, [cipher name, name mac], segments' macs, cipher data
+    """
+
+    def __is_segmented(self, data):
+        """
+        Returns whether a payload is sent as a segmented pack
+        :param data: bytes-like object; the (compressed) payload
+        :return: bool
+        """
+        return self.__parallel and len(data) >= self.__parallel_min_size
+
+    def __send_segmented(self, payload_type, data, compression_type, name=None):
+        """
+        Encrypts a payload's segments in parallel and sends them as one pack
+        :param payload_type: int; SEND_BYTES, SEND_TEXT or SEND_COMPLETE_FILE
+        :param data: bytes-like object; the (compressed) payload
+        :param compression_type: int; payload's compression
+        :param name: str; file name (complete files)
+        """
+        prefix = os.urandom(self.__suite.nonce_size - transfer.COUNTER_SIZE)
+        name = name.encode("utf-8") if name else b''
+        header = struct.pack(_SEGMENTED_PACK_FORMAT, _SEGMENTED_HEADER_SIZE, constants.SEND_SEGMENTED, payload_type,
+                             compression_type, len(prefix), len(name), self.__segment_size, len(data))
+        buffers = [header, prefix]
+        if name:
+            cipher = self.__new_cipher(transfer.chunk_nonce(prefix, parallel.segment_count(len(data),
+                                                                                           self.__segment_size)))
+            cipher.update(header)
+            buffers.extend(cipher.encrypt_and_digest(name))
+        span = self.__tracer and self.__tracer.start(metrics.ENCRYPT)
+        tags, cipher_data = parallel.encrypt(self.__new_cipher, prefix, data, self.__segment_size, header)
+        if span:
+            self.__tracer.end(span)
+        self.__write(buffers + [tags, cipher_data])
+
+    def __unpack_segmented(self, header, max_buffered=None):
+        """
+        Dissects a segmented pack; the payload is received into one buffer and decrypted there
+        :param header: bytes; pack's complete header (including its size)
+        :param max_buffered: int or None; returns the payload as a stream holding this many bytes at most
+        :return: Bytes, Text or File (Stream if max_buffered is set)
+        """
+        _type, payload_type, compression_type, prefix_len, name_len, segment_size, length = \
+            struct.unpack(_SEGMENTED_UNPACK_FORMAT, header[1:])
+        if not segment_size:
+            raise Exception("Invalid segment size")
+        self.__check_payload(length)
+        count = parallel.segment_count(length, segment_size)
+        prefix = self.__network.receive(prefix_len)
+        name = None
+        if name_len:
+            cipher_name, name_tag = self.__receive_segments(name_len, _TAG_SIZE)
+            name = self.__decrypt(cipher_name, name_tag, transfer.chunk_nonce(prefix, count), header).decode("utf-8")
+        tags = self.__network.receive(count * _TAG_SIZE)
+        if max_buffered:
+            if payload_type not in (constants.SEND_BYTES, constants.SEND_TEXT, constants.SEND_COMPLETE_FILE):
+                raise Exception("Unknown pack type")
+            if self.__metrics:
+                self.__metrics.frame(metrics.RECEIVED, payload_type, length)
+            pieces = self.__stream_segments(prefix, tags, length, segment_size, header, max_buffered // 2)
+            pieces = self.__stream_decompressed(pieces, compression_type, max_buffered // 2)
+            payload_type = constants.FILE if payload_type == constants.SEND_COMPLETE_FILE else payload_type
+            return self.__open_stream(name, None if compression_type else length, payload_type, pieces)
+        data = bytearray(length)
+        parallel.decrypt(self.__new_cipher, prefix, tags, self.__network.receive_into, data, segment_size, header)
+        data = self.__decompress(data, compression_type)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, payload_type, len(data))
+
+        if payload_type == constants.SEND_BYTES:
+            return datatypes.Bytes(data)
+        elif payload_type == constants.SEND_TEXT:
+            return datatypes.Text(data)
+        elif payload_type == constants.SEND_COMPLETE_FILE and name is not None:
+            return datatypes.File(name, len(data), data, constants.FILE)
+        raise Exception("Unknown pack type")
+
+    def __stream_segments(self, prefix, tags, length, segment_size, header, buffer_size):
+        """
+        Receives a segmented payload's segments one by one and yields their decrypted data
+        :param prefix: bytes; pack's nonce prefix
+        :param tags: bytes; the segments' MACs
+        :param length: int; payload's length
+        :param segment_size: int
+        :param header: bytes; pack's header (authenticated with every segment)
+        :param buffer_size: int; receive buffer's size
+        """
+        buffer = bytearray(min(buffer_size, segment_size + _TAG_SIZE))
+        for index in range(parallel.segment_count(length, segment_size)):
+            cipher = self.__new_cipher(transfer.chunk_nonce(prefix, index))
+            cipher.update(header)
+            size = min(segment_size, length - index * segment_size)
+            yield from transfer.receive_unit(self.__network, cipher, size, buffer,
+                                             tags[index * _TAG_SIZE:(index + 1) * _TAG_SIZE])
+
+    def __stream_decompressed(self, pieces, compression_type, max_size):
+        """
+        Decompresses a streamed payload's pieces
+        :param pieces: iterator; received pieces
+        :param compression_type: int; payload's compression (see compression module)
+        :param max_size: int; max size of a decompressed piece
+        :return: iterator
+        """
+        if compression_type == compression.NONE:
+            return pieces
+        elif compression_type == compression.ZLIB:
+            return transfer.inflate(pieces, max_size)
+        raise Exception("Unknown compression")
 
     """
     Handles Files
@@ -179,9 +1068,14 @@ class Session:
        It's likely to be more efficient with relatively small sized files (depends on available RAM).
     2. Sending files in chunks. Saves memory space but could be more expensive to runtime due to many
        system calls to disk reading. The size of each chunk is defined by the `max_memory()` method.
+       With file stream mode on (`set_file_stream()`) the file is sent as a pipelined stream instead: chunks grow
+       up to a few MB, each chunk's nonce is derived from a counter, and disk reads, encryption and socket writes
+       overlap (see transfer module).
 
     Files can also be received by those methods depends on the settings. If file auto-save is set on, received files
     would be written to disk - chunk by chunk or completely - depending on which method they are sent with.
+    Chunked and streamed files are written by a write-behind thread under a temporary name, and renamed once complete
+    (see disksink module and `set_fsync_policy()`).
 
     Note: Files are saved on local directory unless a new directory is set by the method `set_files_dir()`
     """
@@ -190,59 +1084,97 @@ class Session:
         """
         Sends complete file at once
         :param filename: str; original file name
-        :param bin_file: bytes; file's content
+        :param bin_file: bytes-like object; file's content (e.g. bytes, or a memory map of the file, which isn't
+                         copied into memory)
         """
-        bin_file = zlib.compress(bin_file) if self.__compress else bin_file
-        cipher_filename, filename_mac, filename_nonce = self.__encrypt(filename)
-        cipher_file, file_tag, file_nonce = self.__encrypt(bin_file)
-        header = struct.pack(_FILE_PACK_FORMAT, _FILE_HEADER_SIZE, constants.SEND_COMPLETE_FILE, self.__compress,
-                             len(filename_nonce), len(filename_mac), len(cipher_filename),
-                             len(file_nonce), len(file_tag), len(cipher_file))
-        pack = \
-            bytearray(header + filename_nonce + filename_mac + cipher_filename + file_nonce + file_tag + cipher_file)
+        self.__flush()
+        if not isinstance(bin_file, (bytes, bytearray)):
+            bin_file = memoryview(bin_file).cast("B")
+        size = len(bin_file)
+        bin_file, compression_type = self.__compress(bin_file, constants.SEND_COMPLETE_FILE)
+        if self.__is_segmented(bin_file):
+            self.__send_segmented(constants.SEND_COMPLETE_FILE, bin_file, compression_type, filename)
+        else:
+            cipher_filename, filename_mac, filename_nonce = self.__encrypt(filename)
+            cipher_file, file_tag, file_nonce = self.__encrypt(bin_file)
+            header = struct.pack(_FILE_PACK_FORMAT, _FILE_HEADER_SIZE, constants.SEND_COMPLETE_FILE, compression_type,
+                                 len(filename_nonce), len(filename_mac), len(cipher_filename),
+                                 len(file_nonce), len(file_tag), len(cipher_file))
 
-        self.__network.send(pack)
+            self.__write(
+                [header, filename_nonce, filename_mac, cipher_filename, file_nonce, file_tag, cipher_file])
+        if self.__metrics:
+            self.__metrics.frame(metrics.SENT, constants.SEND_COMPLETE_FILE, size)
 
-    def __unpack_raw_file(self, header):
+    def __unpack_raw_file(self, header, max_buffered=None):
         """
         Dissects complete file pack
         :param header: bytes; pack's header segment
-        :return: File DataType; the file is encompassed in the DataTpe
+        :param max_buffered: int or None; returns the file as a stream holding this many bytes at most
+        :return: File DataType; the file is encompassed in the DataTpe (Stream if max_buffered is set)
         """
         components = struct.unpack(_FILE_UNPACK_FORMAT, header)
-        is_compressed = self.__network.receive(components[1])
-        filename_nonce = self.__network.receive(components[2])
-        filename_tag = self.__network.receive(components[3])
-        cipher_filename = self.__network.receive(components[4])
-
-        file_nonce = self.__network.receive(components[5])
-        file_tag = self.__network.receive(components[6])
-        cipher_file = self.__network.receive(components[7])
+        compression_type = components[1]
+        if max_buffered:
+            return self.__stream_raw_file(components, compression_type, max_buffered)
+        filename_nonce, filename_tag, cipher_filename, file_nonce, file_tag, cipher_file = \
+            self.__receive_segments(*components[2:])
 
         filename = self.__decrypt(cipher_filename, filename_tag, filename_nonce)
         file_data = self.__decrypt(cipher_file, file_tag, file_nonce)
-        file_data = zlib.decompress(file_data) if is_compressed else file_data
-
+        file_data = self.__decompress(file_data, compression_type)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, constants.SEND_COMPLETE_FILE, len(file_data))
 
         return datatypes.File(filename.decode("utf-8"), len(file_data), file_data, constants.FILE)
 
 
-    def __pack_file_header(self, filename: str, total_size):
+    def __stream_raw_file(self, components, compression_type, max_buffered):
+        """
+        Returns a complete file pack's file as a stream
+        :param components: tuple; pack's header values
+        :param compression_type: int; file's compression
+        :param max_buffered: int; max bytes held at once
+        :return: Stream
+        """
+        filename_nonce, filename_tag, cipher_filename, file_nonce, file_tag = \
+            (bytes(segment) for segment in self.__receive_segments(*components[2:7]))
+        filename = self.__decrypt(cipher_filename, filename_tag, filename_nonce).decode("utf-8")
+        length = components[7]
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, constants.SEND_COMPLETE_FILE, length)
+        pieces = transfer.receive_unit(self.__network, self.__new_cipher(file_nonce), length,
+                                       bytearray(min(max_buffered // 2, length + _TAG_SIZE)), file_tag)
+        pieces = self.__stream_decompressed(pieces, compression_type, max_buffered // 2)
+        return self.__open_stream(filename, None if compression_type else length, constants.FILE, pieces)
+
+    def __pack_file_header(self, filename: str, total_size, send_type=constants.SEND_FILE, *extra):
         """
         Builds file pack header segment
         :param filename: dtr; file name
         :param total_size: int; total file's size
-        :return: bytes
+        :param send_type: SEND_FILE or SEND_FILE_STREAM
+        :param extra: additional header values (the stream's nonce prefix)
+        :return: list; pack's segments
         """
-        file_header = pickle.dumps((filename, total_size))
+        file_header = pickle.dumps((filename, total_size) + extra)
         cipher_header, mac, nonce = self.__encrypt(file_header)
-        header = struct.pack(_FILE_HEADER_PACK, _FILE_CHUNKS_HEADER_SIZE, constants.SEND_FILE,
+        header = struct.pack(_FILE_HEADER_PACK, _FILE_CHUNKS_HEADER_SIZE, send_type,
                              len(nonce), len(mac), len(cipher_header))
-        pack = bytearray(header + nonce + mac + cipher_header)
 
-        return pack
+        return [header, nonce, mac, cipher_header]
 
 
+    def __disk_sink(self, filename, total_size):
+        """
+        Returns a disk sink of a received file in the files directory
+        :param filename: str; file name
+        :param total_size: int; total file's size
+        :return: DiskSink
+        """
+        path = os.path.join(self.__files_target_dir, os.path.basename(filename))
+        return disksink.DiskSink(path, total_size, self.__fsync, self.__fsync_interval)
+
     def __save_file_on_disk(self, filename, total_size):
         """
         Writes received file to disk and returns it as SavedFile DataType
@@ -250,12 +1182,12 @@ class Session:
         :param total_size: int; total file's size
         :return: SavedFile
         """
-        _file = open(filename, "wb+")
-        total_received = 0
-        while total_received < total_size:
-            received_bytes = self.receive().get_data()
-            total_received += (len(received_bytes))
-            _file.write(received_bytes)
+        with self.__disk_sink(filename, total_size) as sink:
+            total_received = 0
+            while total_received < total_size:
+                received_bytes = self.__receive().get_data()
+                total_received += (len(received_bytes))
+                sink.write(received_bytes)
 
         return datatypes.SavedFile(filename, total_size)
 
@@ -270,70 +1202,179 @@ class Session:
         data = bytearray()
         total_received = 0
         while total_received < total_size:
-            received_bytes = self.receive().get_data()
+            received_bytes = self.__receive().get_data()
             total_received += (len(received_bytes))
             data += received_bytes
 
         return datatypes.File(filename, total_size, data, constants.FILE)
 
 
-    def __unpack_file(self, header):
+    def __receive_file_stream(self, filename, total_size, prefix):
+        """
+        Receives a streamed file, into memory or directly to disk when auto-save is on
+        :param filename: str; file name
+        :param total_size: int; total file's size
+        :param prefix: bytes; stream's nonce prefix
+        :return: File or SavedFile
+        """
+        receiver = transfer.FileStreamReceiver(self.__network, self.__new_cipher)
+        if self.__file_autosave:
+            with self.__disk_sink(filename, total_size) as sink:
+                receiver.receive(prefix, total_size, sink.write)
+            return datatypes.SavedFile(filename, total_size)
+
+        data = bytearray(total_size)
+        view = memoryview(data)
+        offset = 0
+        def write(chunk):
+            nonlocal offset
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        receiver.receive(prefix, total_size, write)
+
+        return datatypes.File(filename, total_size, data, constants.FILE)
+
+    def __receive_file_chunks(self, total_size, max_length):
+        """
+        Receives a chunked file's chunks and yields their data. A chunk larger than max_length (encrypted or
+        decompressed) raises exception before it's read, since chunks are received whole
+        :param total_size: int; total file's size
+        :param max_length: int; max chunk size
+        """
+        total_received = 0
+        while total_received < total_size:
+            self.__max_payload = max_length
+            try:
+                received_bytes = self.__next_message().get_data()
+            finally:
+                self.__max_payload = None
+            total_received += len(received_bytes)
+            yield received_bytes
+
+    def __unpack_file(self, header, max_buffered=None):
         """
         Dissects received file pack
         :param header: bytes; pack's header segment
-        :return: File or SavedFile; depends on the transfer method that is used
+        :param max_buffered: int or None; returns the file as a stream holding this many bytes at most
+        :return: File or SavedFile; depends on the transfer method that is used (Stream if max_buffered is set)
         """
+        send_type = struct.unpack("!B", header[:1])[0]
         nonce_len, mac_len, cipher_header_len = struct.unpack(_FILE_HEADER_UNPACK, header)
-        nonce = self.__network.receive(nonce_len)
-        mac = self.__network.receive(mac_len)
-        cipher_header = self.__network.receive(cipher_header_len)
+        nonce, mac, cipher_header = self.__receive_segments(nonce_len, mac_len, cipher_header_len)
         file_header = self.__decrypt(cipher_header, mac, nonce)
-        filename, total_size = pickle.loads(file_header)
+        if send_type == constants.SEND_FILE_STREAM and max_buffered:
+            filename, total_size, prefix = pickle.loads(file_header)
+            if self.__metrics:
+                self.__metrics.frame(metrics.RECEIVED, send_type, total_size)
+            pieces = transfer.receive_stream_chunks(self.__network, self.__new_cipher, prefix, total_size,
+                                                    bytearray(max_buffered // 2), max_buffered // 2)
+            return self.__open_stream(filename, total_size, constants.FILE, pieces)
+        elif send_type == constants.SEND_FILE_STREAM:
+            filename, total_size, prefix = pickle.loads(file_header)
+            received_file = self.__receive_file_stream(filename, total_size, prefix)
+            if self.__metrics:
+                self.__metrics.frame(metrics.RECEIVED, send_type, total_size)
+            return received_file
 
-        if self.__file_autosave:
-            return self.__save_file_to_disk(filename, total_size)
+        filename, total_size = pickle.loads(file_header)
+        if self.__metrics:
+            # the chunks are counted as bytes packs
+            self.__metrics.frame(metrics.RECEIVED, send_type, 0)
+        if max_buffered:
+            # the chunks are the sender's max_memory in size, and half of max_buffered at most
+            return self.__open_stream(filename, total_size, constants.FILE,
+                                      self.__receive_file_chunks(total_size, max_buffered // 2))
+        elif self.__file_autosave:
+            return self.__save_file_on_disk(filename, total_size)
         else:
-            return self.__load_file_to_memory(filename, total_size)
+            return self.__load_file_into_memory(filename, total_size)
 
     def send_file(self, path:str):
         """
         Sends a file from disk in chunks avoiding loading all of it onto memory
         :param path: str; file's path
         """
+        self.__flush()
         file_size = os.path.getsize(path)
         filename = ntpath.basename(path)
         with open(path, "rb") as _file:
-            self.__network.send(self.__pack_file_header(filename, file_size))
+            if self.__file_stream:
+                prefix = os.urandom(self.__suite.nonce_size - transfer.COUNTER_SIZE)
+                self.__write(
+                    self.__pack_file_header(filename, file_size, constants.SEND_FILE_STREAM, prefix))
+                compress = None
+                if self.__compression:
+                    compress = lambda chunk: self.__compress(chunk, constants.SEND_FILE_STREAM)
+                transfer.FileStreamSender(self.__network, self.__new_cipher, compress).send(_file, prefix,
+                                                                                          self.__memory_map)
+                if self.__metrics:
+                    self.__metrics.frame(metrics.SENT, constants.SEND_FILE_STREAM, file_size)
+                return
+
+            self.__write(self.__pack_file_header(filename, file_size))
+            if self.__metrics:
+                # the chunks are counted as bytes packs
+                self.__metrics.frame(metrics.SENT, constants.SEND_FILE, 0)
+            mapping = transfer.map_file(_file) if self.__memory_map else None
+            if mapping is not None:
+                self.__send_map_chunks(mapping)
+                return
             data = _file.read(self.__max_memory)
             while data:
-                self.send_bytes(data)
+                self.__send_bytes(data, constants.SEND_BYTES)
                 data = _file.read(self.__max_memory)
 
+    def __send_map_chunks(self, mapping):
+        """
+        Sends a memory mapped file's content in max_memory sized chunks (views of the map)
+        :param mapping: mmap; file's memory map, closed once sent
+        """
+        try:
+            view = memoryview(mapping)
+            for offset in range(0, len(view), self.__max_memory):
+                self.__send_bytes(view[offset:offset + self.__max_memory], constants.SEND_BYTES)
+            view.release()
+        finally:
+            transfer.close_map(mapping)
+
     """
     Serialized objects
 
     Supports dictionary, list and tuple data types. Very convenient, simple when sending complete objects.
+    Objects are serialized once by the session's serializer (pickle by default, see `set_serializer()`) and sent
+    in the same layout as raw bytes, with the serializer's id in the header.
+    Header size: 15 bytes
+    Pack structure: header, nonce, mac, cipher data
 
-    Note: The serialization is using 'pickle' module. Other serializations alternatives could be are more efficient,
-          both in serialized values length and faster run time. For most cases this procedure may be suffice,
-          in other cases it might be better to use alternatives and send the value normally as raw bytes.
+    Note: pickle is the most general serializer but not the fastest or the most compact. Hot paths may use
+          marshal, JSON or a fixed struct schema instead, or send the value normally as raw bytes.
     """
 
-    def __pack_object(self, obj, send_type):
+    def __to_object(self, send_type, obj):
+        """
+        Wraps a received object in its DataType
+        :param send_type: SEND_OBJECT or SEND_LIST
+        :param obj: object
+        :return: Object or List
+        """
+        if send_type == constants.SEND_OBJECT:
+            return datatypes.Object(obj)
+        elif send_type == constants.SEND_LIST:
+            return datatypes.List(obj)
+
+    def __pack_object(self, serialized_object, send_type):
         """
-        Builds and serializes a serialized object pack
-        :param obj: dict, list, tuple; the object be packed
+        Builds a serialized object pack
+        :param serialized_object: bytes; the object serialized by the session's serializer
         :param send_type: SEND_LIST or SEND_OBJECT; type of object so the receiver will know to refer to the exact data type
-        :return: bytearray; serialized object pack
+        :return: list; serialized object pack segments
         """
-        serialized_object = pickle.dumps(obj)
-        serialized_object = zlib.compress(serialized_object) if self.__compress else serialized_object
+        serialized_object, compression_type = self.__compress(serialized_object, send_type)
         cipher_object, mac, nonce = self.__encrypt(serialized_object)
-        data = {"nonce": nonce, "mac": mac, "object": cipher_object}
-        data = pickle.dumps(data)
-        header = struct.pack(_OBJECT_PACK_FORMAT, _OBJECT_HEADER_SIZE, send_type, self.__compress, len(data))
+        header = struct.pack(_OBJECT_PACK_FORMAT, _OBJECT_HEADER_SIZE, send_type, compression_type,
+                             self.__serializer.id, len(nonce), len(mac), len(cipher_object))
 
-        return bytearray(header + data)
+        return [header, nonce, mac, cipher_object]
 
     def __unpack_object(self, header):
         """
@@ -341,29 +1382,64 @@ class Session:
         :param header: bytes; pack's header segment
         :return: Object or List DataTypes
         """
-        _type, is_compressed, data_len = struct.unpack(_OBJECT_UNPACK_FORMAT, header)
-        data = self.__network.receive(data_len)
-        data = pickle.loads(data)
+        if len(header) == _LEGACY_OBJECT_HEADER_SIZE:
+            return self.__unpack_legacy_object(header)
+        _type, compression_type, serializer, nonce_len, mac_len, data_len = \
+            struct.unpack(_OBJECT_UNPACK_FORMAT, header)
+        nonce, mac, cipher_object = self.__receive_segments(nonce_len, mac_len, data_len)
+        obj = self.__decompress(self.__decrypt(cipher_object, mac, nonce), compression_type)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, _type, len(obj))
+
+        return self.__to_object(_type, self.__deserialize(serializers.get_serializer(serializer), obj))
+
+    def __unpack_legacy_object(self, header):
+        """
+        Dissects an object pack of the previous layout (a pickled dict of the nonce, mac and cipher object)
+        :param header: bytes; pack's header segment
+        :return: Object or List DataTypes
+        """
+        _type, is_compressed, data_len = struct.unpack(_LEGACY_OBJECT_UNPACK_FORMAT, header)
+        data = pickle.loads(self.__network.receive_view(data_len))
         obj = self.__decrypt(data["object"], data["mac"], data["nonce"])
         obj = zlib.decompress(obj) if is_compressed else obj
-        deserialized_object = pickle.loads(obj)
-        if _type == constants.SEND_OBJECT:
-            return datatypes.Object(deserialized_object)
-        elif _type == constants.SEND_LIST:
-            return datatypes.List(deserialized_object)
+        if self.__metrics:
+            self.__metrics.frame(metrics.RECEIVED, _type, len(obj))
+
+        return self.__to_object(_type, self.__deserialize(pickle, obj))
+
+    def __send_object(self, obj, send_type):
+        """
+        Serializes and sends an object in the session's wire format
+        :param obj: dict, list, tuple; the object be sent
+        :param send_type: SEND_LIST or SEND_OBJECT
+        """
+        span = self.__tracer and self.__tracer.start(metrics.SERIALIZE)
+        serialized_object = self.__serializer.dumps(obj)
+        if span:
+            self.__tracer.end(span)
+        if self.__add_to_batch(send_type, serialized_object, self.__serializer.id):
+            return
+        with self.__send_lock:
+            size = len(serialized_object)
+            if self.__wire_version == constants.WIRE_V2:
+                serialized_object, compression_type = self.__compress(serialized_object, send_type)
+                self.__send_frame(send_type, serialized_object, compression_type, self.__serializer)
+            else:
+                self.__write(self.__pack_object(serialized_object, send_type))
+            if self.__metrics:
+                self.__metrics.frame(metrics.SENT, send_type, size)
 
     def send_object(self, obj:dict):
         """
         Send a dictionary
         :param obj: dict
         """
-        pack = self.__pack_object(obj, constants.SEND_OBJECT)
-        self.__network.send(pack)
+        self.__send_object(obj, constants.SEND_OBJECT)
 
     def send_list(self, list_items:list):
         """
         Sends list or tuple
         :param list_items: list, tuple
         """
-        pack = self.__pack_object(list_items, constants.SEND_LIST)
-        self.__network.send(pack)
+        self.__send_object(list_items, constants.SEND_LIST)
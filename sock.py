@@ -1,4 +1,16 @@
-import struct, select, queue, socket
+import struct, select, queue, socket, os
+
+# received frames up to this size are read into the wrapper's reusable buffer, bigger ones get a buffer of their own
+# so a single huge transfer doesn't pin its size in memory for the rest of the connection
+_MAX_REUSED_BUFFER = 16 * 1024 * 1024
+# max number of buffers a single sendmsg call accepts
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    # no limit reported (-1)
+    _IOV_MAX = 1024
 
 class NonBlockingSocket:
     """
@@ -12,13 +24,16 @@ class NonBlockingSocket:
         self.__is_selecting = False
         self.__readable = self.__writeable = self.__exceptional = None
 
-    def select(self):
+    def select(self, timeout=0):
         """
         Checks if hardware is available for socket read or write (running select method of 'select' module)
+        Note: services run on the reactor (see reactor module) instead of polling with this method
+        :param timeout: float or None; max time to wait in seconds (0 returns immediately, None waits for an event)
         """
         inputs = [self.__socket]
         self.__is_selecting = True
-        self.__readable, self.__writeable, self.__exceptional = select.select(inputs, [self.__socket], inputs, 0)
+        self.__readable, self.__writeable, self.__exceptional = select.select(inputs, [self.__socket], inputs,
+                                                                              timeout)
 
     def quit_select(self):
         """
@@ -66,6 +81,13 @@ class Wrapper:
         self.connection = connection
         self.__non_blocking = None
         self.__outgoing_data = queue.Queue()
+        # reusable receive buffer (see receive_view)
+        self.__buffer = bytearray()
+        # buffers held while the wrapper is corked (see cork)
+        self.__corked = None
+        # bytes written to and read from the socket (see metrics module)
+        self.bytes_sent = 0
+        self.bytes_received = 0
 
     def read_header(self):
         """
@@ -97,31 +119,150 @@ class Wrapper:
         :param buffer: int; buffer length
         :return: bytes; received data from socket
         """
+        if buffer == 0:
+            return b''
+        if self.__corked:
+            self.__flush_corked()
         data = self.connection.recv(buffer)
         if not data:
             raise Exception("Connection is lost")
+        self.bytes_received += len(data)
+        if len(data) == buffer:
+            return data
+
+        # partial read; fill the rest in place instead of concatenating new bytes objects
+        received = bytearray(buffer)
+        received[:len(data)] = data
+        self.receive_into(memoryview(received)[len(data):])
+        return bytes(received)
+
+    def receive_into(self, view):
+        """
+        Fills the given writable buffer with data from the stream (using the socket's `recv_into`).
+        The method keeps reading until the whole buffer is filled.
+        :param view: bytearray or memoryview; target buffer
+        :return: int; number of received bytes
+        """
+        if self.__corked:
+            self.__flush_corked()
+        view = memoryview(view)
+        total = len(view)
+        received = 0
+        while received < total:
+            count = self.connection.recv_into(view[received:], total - received)
+            if not count:
+                raise Exception("Connection is lost")
+            received += count
+        self.bytes_received += received
+
+        return received
+
+    def receive_view(self, length):
+        """
+        Receives exactly `length` bytes into the wrapper's reusable buffer and returns a view of them without copying.
+        Note: The returned view is valid only until the next `receive_view` call. Copy it (or decrypt it) if the data
+        has to be kept.
+        :param length: int; number of bytes to receive
+        :return: memoryview
+        """
+        if length > _MAX_REUSED_BUFFER:
+            buffer = bytearray(length)
+        else:
+            if len(self.__buffer) < length:
+                self.__buffer = bytearray(length)
+            buffer = self.__buffer
+        view = memoryview(buffer)[:length]
+        self.receive_into(view)
 
-        while len(data) < buffer:
-            data += self.connection.recv(buffer - (len(data)))
+        return view
 
-        return data
+    def cork(self):
+        """
+        Holds sent data until `uncork()` is called, so several packs leave in one write (e.g. the handshake's last
+        pack and the session's first message, see early data). Reading from the wrapper sends the held data first,
+        so a corked wrapper never waits for a response to data it didn't send
+        """
+        if self.__corked is None:
+            self.__corked = []
+
+    def uncork(self):
+        """
+        Sends the held data and stops holding
+        """
+        self.__flush_corked()
+        self.__corked = None
+
+    def __flush_corked(self):
+        """
+        Sends the held data in one write
+        """
+        if self.__corked:
+            buffers, self.__corked = self.__corked, []
+            self.__send_vectored(buffers)
 
     def send(self, data):
         """
         Sends data through socket
         :param data: bytes
         """
-        if self.__non_blocking and self.__non_blocking.is_selecting():
-            self.__outgoing_data.put(data)
+        if self.__corked is not None:
+            self.__corked.append(bytes(data))
+        elif self.__non_blocking and self.__non_blocking.is_selecting():
+            # sent later, and the caller may reuse the buffer once it returns
+            self.__outgoing_data.put(bytes(data))
         else:
             self.connection.sendall(data)
+            self.bytes_sent += len(data)
+
+    def send_buffers(self, buffers):
+        """
+        Sends several buffers as one continuous stream without joining them into a new bytes object first
+        (scatter-gather I/O with the socket's `sendmsg`). Partial writes are resumed from where they stopped.
+        :param buffers: list; bytes-like objects, sent in the given order
+        """
+        if self.__corked is not None:
+            # the buffers may be reused by the caller once it returns
+            self.__corked.extend(buffer if isinstance(buffer, bytes) else bytes(buffer) for buffer in buffers)
+        elif self.__non_blocking and self.__non_blocking.is_selecting():
+            self.__outgoing_data.put([buffer if isinstance(buffer, bytes) else bytes(buffer) for buffer in buffers])
+        else:
+            self.__send_vectored(buffers)
+
+    def __send_vectored(self, buffers):
+        """
+        Writes all buffers to the socket
+        :param buffers: list; bytes-like objects
+        """
+        if not hasattr(self.connection, "sendmsg"):
+            # platforms without sendmsg (Windows)
+            data = b''.join(buffers)
+            self.connection.sendall(data)
+            self.bytes_sent += len(data)
+            return
+
+        views = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+        first = 0
+        while first < len(views):
+            sent = self.connection.sendmsg(views[first:first + _IOV_MAX])
+            self.bytes_sent += sent
+            # skips the buffers that were fully sent and trims the one that was sent partially
+            while sent and sent >= len(views[first]):
+                sent -= len(views[first])
+                first += 1
+            if sent:
+                views[first] = views[first][sent:]
 
     def send_from_queue(self):
         """
         Used when blocking mode is active. All data is first accumulated in a queue and then sent when socket is writable
         """
         if not self.__outgoing_data.empty():
-            self.connection.sendall(self.__outgoing_data.get_nowait())
+            data = self.__outgoing_data.get_nowait()
+            if isinstance(data, list):
+                self.__send_vectored(data)
+            else:
+                self.connection.sendall(data)
+                self.bytes_sent += len(data)
 
     def close(self):
         """
@@ -0,0 +1,258 @@
+import os, socket, struct, tempfile, threading, unittest, zlib
+from .. import constants, handshake, session, sock, transfer, ciphers
+
+"""
+ Session tests
+
+ Sessions are created over socket pairs: round trips run the handshake of both sides on two threads, and the
+ rejection tests feed a receiving session (or file stream receiver) packs written by the test itself.
+"""
+
+# small RSA keys keep the handshakes fast
+_RSA_KEY = handshake.generate_rsa_keys(1024)
+_TIMEOUT = 10
+
+
+def _handshake(key_exchange, wire_version):
+    """
+    Runs a handshake over a socket pair and returns both sides' results
+    :param key_exchange: int; KEY_EXCHANGE_RSA or KEY_EXCHANGE_ECDH
+    :param wire_version: int
+    :return: tuple (Wrapper, HandshakeResult, Wrapper, HandshakeResult); client's and server's
+    """
+    client_socket, server_socket = socket.socketpair()
+    client_socket.settimeout(_TIMEOUT)
+    server_socket.settimeout(_TIMEOUT)
+    client, server = sock.Wrapper(client_socket), sock.Wrapper(server_socket)
+    results = {}
+    if key_exchange == constants.KEY_EXCHANGE_ECDH:
+        run_server = lambda: handshake.server_handshake_ecdh(server)
+        run_client = lambda: handshake.client_handshake_ecdh(client, wire_version=wire_version)
+    else:
+        run_server = lambda: handshake.server_handshake(_RSA_KEY, server)
+        run_client = lambda: handshake.client_handshake(client, os.urandom(16), wire_version=wire_version)
+    thread = threading.Thread(target=lambda: results.__setitem__('server', run_server()))
+    thread.start()
+    client_result = run_client()
+    thread.join()
+    return client, client_result, server, results['server']
+
+
+def _raw_pair():
+    """
+    :return: tuple (socket, Wrapper); the raw end a test writes to and the wrapped end a session reads from
+    """
+    raw, wrapped = socket.socketpair()
+    raw.settimeout(_TIMEOUT)
+    wrapped.settimeout(_TIMEOUT)
+    return raw, sock.Wrapper(wrapped)
+
+
+def _read_available(raw):
+    """
+    Reads the bytes written to the other end of a socket so far
+    :param raw: socket
+    :return: bytes
+    """
+    raw.setblocking(False)
+    data = b''
+    try:
+        while True:
+            part = raw.recv(65536)
+            if not part:
+                break
+            data += part
+    except BlockingIOError:
+        pass
+    raw.settimeout(_TIMEOUT)
+    return data
+
+
+class RoundTripTest(unittest.TestCase):
+    """
+    Every message type both ways, for each wire version, key exchange and compression mode
+    """
+    def __round_trip(self, key_exchange, wire_version, compress_mode):
+        client, client_result, server, server_result = _handshake(key_exchange, wire_version)
+        try:
+            self.assertEqual(client_result.session_key, server_result.session_key)
+            self.assertEqual(client_result.wire_version, wire_version)
+            self.assertEqual(server_result.wire_version, wire_version)
+            client_session = session.Session.from_handshake(client, client_result, compress_mode)
+            server_session = session.Session.from_handshake(server, server_result, compress_mode)
+            # compressible and incompressible payloads
+            payload = b'session ' * 4096
+            noise = os.urandom(4096)
+            for sender, receiver in ((client_session, server_session), (server_session, client_session)):
+                sender.send_bytes(payload)
+                sender.send_bytes(noise)
+                sender.send_text("text é")
+                sender.send_object({'id': 1, 'items': [1, 2]})
+                sender.send_list([1, 'two', 3.0])
+                sender.send_raw_file("file.bin", payload)
+                self.assertEqual(receiver.receive().get_data(), payload)
+                self.assertEqual(receiver.receive().get_data(), noise)
+                self.assertEqual(receiver.receive().get_data(), "text é")
+                self.assertEqual(receiver.receive().get_data(), {'id': 1, 'items': [1, 2]})
+                self.assertEqual(list(receiver.receive().get_data()), [1, 'two', 3.0])
+                received_file = receiver.receive()
+                self.assertEqual(received_file.get_name(), "file.bin")
+                self.assertEqual(bytes(received_file.get_data()), payload)
+        finally:
+            client.connection.close()
+            server.connection.close()
+
+    def test_v1_rsa(self):
+        self.__round_trip(constants.KEY_EXCHANGE_RSA, constants.WIRE_V1, False)
+
+    def test_v1_rsa_compressed(self):
+        self.__round_trip(constants.KEY_EXCHANGE_RSA, constants.WIRE_V1, True)
+
+    def test_v1_ecdh(self):
+        self.__round_trip(constants.KEY_EXCHANGE_ECDH, constants.WIRE_V1, False)
+
+    def test_v1_ecdh_compressed(self):
+        self.__round_trip(constants.KEY_EXCHANGE_ECDH, constants.WIRE_V1, True)
+
+    def test_v2_rsa(self):
+        self.__round_trip(constants.KEY_EXCHANGE_RSA, constants.WIRE_V2, False)
+
+    def test_v2_rsa_compressed(self):
+        self.__round_trip(constants.KEY_EXCHANGE_RSA, constants.WIRE_V2, True)
+
+    def test_v2_ecdh(self):
+        self.__round_trip(constants.KEY_EXCHANGE_ECDH, constants.WIRE_V2, False)
+
+    def test_v2_ecdh_compressed(self):
+        self.__round_trip(constants.KEY_EXCHANGE_ECDH, constants.WIRE_V2, True)
+
+
+class RejectionTest(unittest.TestCase):
+    """
+    Tampered, replayed and oversize packs are rejected
+    """
+    def setUp(self):
+        self.__key = os.urandom(16)
+        self.__sockets = []
+
+    def tearDown(self):
+        for _socket in self.__sockets:
+            _socket.close()
+
+    def __session(self, wire_version, is_client):
+        """
+        Returns a session and the raw end of its socket pair
+        :param wire_version: int
+        :param is_client: bool
+        :return: tuple (Session, socket)
+        """
+        raw, wrapper = _raw_pair()
+        self.__sockets += [raw, wrapper.connection]
+        return session.Session(wrapper, self.__key, wire_version=wire_version, is_client=is_client,
+                               transcript=b'transcript'), raw
+
+    def __sent_pack(self, wire_version, data):
+        """
+        Returns the pack a client session writes for a bytes message
+        :param wire_version: int
+        :param data: bytes
+        :return: bytearray
+        """
+        sender, raw = self.__session(wire_version, True)
+        sender.send_bytes(data)
+        return bytearray(_read_available(raw))
+
+    def test_v1_tampered_mac(self):
+        pack = self.__sent_pack(constants.WIRE_V1, b'message')
+        header = pack[1:1 + pack[0]]
+        nonce_length = struct.unpack(session._BYTES_UNPACK_FORMAT, header)[2]
+        # the body is the nonce, the MAC and the cipher data
+        pack[1 + pack[0] + nonce_length] ^= 1
+        receiver, raw = self.__session(constants.WIRE_V1, False)
+        raw.sendall(pack)
+        with self.assertRaisesRegex(Exception, "Verification failed"):
+            receiver.receive()
+
+    def test_v2_tampered_mac(self):
+        pack = self.__sent_pack(constants.WIRE_V2, b'message')
+        # the MAC ends the pack
+        pack[-1] ^= 1
+        receiver, raw = self.__session(constants.WIRE_V2, False)
+        raw.sendall(pack)
+        with self.assertRaisesRegex(Exception, "Verification failed"):
+            receiver.receive()
+
+    def test_v2_replayed_pack(self):
+        pack = self.__sent_pack(constants.WIRE_V2, b'message')
+        receiver, raw = self.__session(constants.WIRE_V2, False)
+        raw.sendall(pack + pack)
+        self.assertEqual(receiver.receive().get_data(), b'message')
+        # the replayed pack's nonce is the next sequence number's, so its MAC doesn't verify
+        with self.assertRaisesRegex(Exception, "Verification failed"):
+            receiver.receive()
+
+    def test_oversize_file_chunk(self):
+        # the sender's chunks are larger than half of the streamed receive's buffer
+        sender, sender_raw = self.__session(constants.WIRE_V1, True)
+        receiver, receiver_raw = self.__session(constants.WIRE_V1, False)
+        sender.max_memory(64 * 1024)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "file.bin")
+        with open(path, "wb") as _file:
+            _file.write(os.urandom(256 * 1024))
+        threading.Thread(target=self.__forward, args=(sender_raw, receiver_raw), daemon=True).start()
+        threading.Thread(target=self.__send_file, args=(sender, path), daemon=True).start()
+        stream = receiver.receive_stream(max_buffered=32 * 1024)
+        with self.assertRaisesRegex(Exception, "Pack is too large"):
+            stream.read()
+
+    def test_oversize_stream_chunk(self):
+        raw, wrapper = _raw_pair()
+        self.__sockets += [raw, wrapper.connection]
+        suite = ciphers.get_suite(constants.SUITE_EAX)
+        receiver = transfer.FileStreamReceiver(wrapper, lambda nonce: suite.new(self.__key, nonce))
+        # announced before its data, which is never sent
+        raw.sendall(struct.pack(transfer._CHUNK_FORMAT, transfer._FINAL, transfer._MAX_CIPHER_LENGTH + 1))
+        with self.assertRaisesRegex(Exception, "Chunk is too large"):
+            receiver.receive(os.urandom(suite.nonce_size - transfer.COUNTER_SIZE), 1024, lambda data: None)
+
+    def test_stream_longer_than_announced(self):
+        raw, wrapper = _raw_pair()
+        self.__sockets += [raw, wrapper.connection]
+        suite = ciphers.get_suite(constants.SUITE_EAX)
+        new_cipher = lambda nonce: suite.new(self.__key, nonce)
+        prefix = os.urandom(suite.nonce_size - transfer.COUNTER_SIZE)
+        # a small chunk that decompresses to far more than the announced file's size
+        flags = transfer._FINAL | transfer._COMPRESSED
+        cipher = new_cipher(transfer.chunk_nonce(prefix, 0))
+        cipher.update(struct.pack("!B", flags))
+        cipher_data, mac = cipher.encrypt_and_digest(zlib.compress(bytes(1024 * 1024)))
+        raw.sendall(struct.pack(transfer._CHUNK_FORMAT, flags, len(cipher_data)) + cipher_data + mac)
+        receiver = transfer.FileStreamReceiver(wrapper, new_cipher)
+        received = []
+        with self.assertRaisesRegex(Exception, "File stream is longer than announced"):
+            receiver.receive(prefix, 1024, received.append)
+        self.assertEqual(received, [])
+
+    def __forward(self, source, target):
+        """
+        Copies a socket's incoming bytes to another socket until either is closed
+        :param source: socket
+        :param target: socket
+        """
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    return
+                target.sendall(data)
+        except OSError:
+            pass
+
+    def __send_file(self, sender, path):
+        try:
+            sender.send_file(path)
+        except OSError:
+            # the receiver rejected the file and its socket was closed
+            pass
@@ -0,0 +1,138 @@
+import os, struct, time, threading
+from Crypto.Cipher import AES
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Hash import SHA256
+
+"""
+ Session resumption tickets
+
+ After a full handshake the server sends the client a ticket: the session's resumption secret (derived from the
+ session key), sealed with the server's ticket key. On the next connection the client presents the ticket instead
+ of exchanging a new key; the server opens it and both sides derive a fresh session key from the secret and both
+ sides' random values, with no RSA or ECDH operation. The server stores nothing per client.
+
+ Ticket keys rotate: every rotation period has its own key, derived from the server's master key, so processes
+ (or hosts) sharing a master key issue and accept each other's tickets without talking to each other. Tickets
+ are accepted until their lifetime ends, whichever key sealed them.
+ Ticket structure: key period, nonce, sealed (issue time, resumption secret), MAC
+"""
+
+# seconds a ticket can be used for
+DEFAULT_LIFETIME = 2 * 60 * 60
+# seconds each ticket key is used to issue tickets
+DEFAULT_ROTATION = 60 * 60
+SECRET_SIZE = 32
+_MASTER_KEY_SIZE = 32
+# key period, nonce
+_TICKET_HEADER_FORMAT = "!I 12s"
+_TICKET_HEADER_SIZE = 16
+# issue time, resumption secret
+_TICKET_CONTENT_FORMAT = "!Q 32s"
+_TAG_SIZE = 16
+# issue times up to this far (seconds) in the future are accepted (clock differences between hosts)
+_CLOCK_SKEW = 60
+
+
+def resumption_secret(session_key):
+    """
+    Derives a session's resumption secret (both sides derive it from the session key)
+    :param session_key: bytes
+    :return: bytes
+    """
+    return HKDF(session_key, SECRET_SIZE, b'', SHA256, context=b"SDTP resumption")
+
+
+class Ticket:
+    """
+    A resumption ticket kept by the client
+    """
+    def __init__(self, ticket, secret, expires_at):
+        """
+        :param ticket: bytes; the sealed ticket, as issued by the server
+        :param secret: bytes; the resumption secret
+        :param expires_at: float; expiry time (time.time())
+        """
+        self.ticket = ticket
+        self.secret = secret
+        self.expires_at = expires_at
+
+    def is_valid(self):
+        """
+        Returns whether the ticket's lifetime hasn't ended
+        :return: bool
+        """
+        return time.time() < self.expires_at
+
+
+class TicketKeys:
+    """
+    Server's ticket keys. Issues and opens tickets
+    """
+    def __init__(self, lifetime=DEFAULT_LIFETIME, rotation=DEFAULT_ROTATION, master_key=None):
+        """
+        :param lifetime: int; seconds a ticket can be used for
+        :param rotation: int; seconds each ticket key is used to issue tickets
+        :param master_key: bytes; the ticket keys' master key (random if not provided). Share it between servers
+                           that should accept each other's tickets, and replace it to revoke all the tickets
+        """
+        if lifetime <= 0 or rotation <= 0:
+            raise Exception("Ticket lifetime and rotation must be positive")
+        self.lifetime = lifetime
+        self.rotation = rotation
+        self.__master_key = master_key or os.urandom(_MASTER_KEY_SIZE)
+        self.__keys = {}
+        self.__lock = threading.Lock()
+
+    def __key(self, period):
+        """
+        Returns a rotation period's ticket key
+        :param period: int
+        :return: bytes
+        """
+        with self.__lock:
+            key = self.__keys.get(period)
+            if key is None:
+                # keeps only the periods whose tickets may still be valid
+                oldest = period - self.lifetime // self.rotation - 1
+                for old in [old for old in self.__keys if old < oldest]:
+                    del self.__keys[old]
+                key = self.__keys[period] = HKDF(self.__master_key, 32, b'', SHA256,
+                                                 context=b"SDTP ticket key" + struct.pack("!I", period))
+            return key
+
+    def issue(self, secret):
+        """
+        Seals a resumption secret in a ticket with the current ticket key
+        :param secret: bytes; resumption secret
+        :return: bytes
+        """
+        now = time.time()
+        header = struct.pack(_TICKET_HEADER_FORMAT, int(now // self.rotation), os.urandom(12))
+        cipher = AES.new(self.__key(int(now // self.rotation)), AES.MODE_GCM, header[4:])
+        cipher.update(header)
+        sealed, tag = cipher.encrypt_and_digest(struct.pack(_TICKET_CONTENT_FORMAT, int(now), secret))
+        return header + sealed + tag
+
+    def open(self, ticket):
+        """
+        Opens a ticket
+        :param ticket: bytes
+        :return: bytes or None; the resumption secret, None if the ticket is invalid or expired
+        """
+        if len(ticket) != _TICKET_HEADER_SIZE + struct.calcsize(_TICKET_CONTENT_FORMAT) + _TAG_SIZE:
+            return None
+        now = time.time()
+        period, nonce = struct.unpack(_TICKET_HEADER_FORMAT, ticket[:_TICKET_HEADER_SIZE])
+        current = int(now // self.rotation)
+        if not current - self.lifetime // self.rotation - 1 <= period <= current + 1:
+            return None
+        cipher = AES.new(self.__key(period), AES.MODE_GCM, nonce)
+        cipher.update(ticket[:_TICKET_HEADER_SIZE])
+        try:
+            content = cipher.decrypt_and_verify(ticket[_TICKET_HEADER_SIZE:-_TAG_SIZE], ticket[-_TAG_SIZE:])
+        except ValueError:
+            return None
+        issued_at, secret = struct.unpack(_TICKET_CONTENT_FORMAT, content)
+        if not now - self.lifetime < issued_at <= now + _CLOCK_SKEW:
+            return None
+        return secret
@@ -0,0 +1,87 @@
+import argparse, os, struct
+from .. import compression
+
+"""
+ Compression dictionary trainer
+
+ Builds a preset compression dictionary out of traffic samples (typical payloads of bytes, text, object or list
+ packs) and reports how much it saves per sample. Register the output on both sides under the same id:
+     compression.register_dictionary(1, open("sdtp.dict", "rb").read())
+
+ Samples are read from files, one sample per file (directories are read recursively), or from capture files of
+ length prefixed samples (4 bytes big endian length, then the sample) with --framed.
+
+ Run: python -m <package>.tools.train_dictionary samples/ [-o sdtp.dict] [--size bytes] [--framed]
+"""
+
+
+def read_samples(paths, framed=False):
+    """
+    Reads traffic samples
+    :param paths: iterable; files and directories
+    :param framed: bool; whether files hold length prefixed samples
+    :return: list; samples (bytes)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+
+    samples = []
+    for path in files:
+        with open(path, "rb") as sample_file:
+            data = sample_file.read()
+        if not framed:
+            samples.append(data)
+            continue
+        offset = 0
+        while offset + 4 <= len(data):
+            length = struct.unpack("!I", data[offset:offset + 4])[0]
+            samples.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+    return samples
+
+
+def compressed_size(samples, dictionary=None):
+    """
+    Returns the total size of the samples, each compressed on its own (the worst case of a compression stream)
+    :param samples: iterable; samples (bytes)
+    :param dictionary: bytes; preset dictionary
+    :return: int
+    """
+    total = 0
+    for sample in samples:
+        stream = compression.CompressionStream(dictionary=dictionary)
+        total += len(stream.compress(sample))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preset compression dictionary trainer")
+    parser.add_argument("paths", nargs="+", help="sample files or directories")
+    parser.add_argument("-o", "--output", default="sdtp.dict", help="dictionary file")
+    parser.add_argument("--size", type=int, default=compression.DICTIONARY_SIZE, help="max dictionary size in bytes")
+    parser.add_argument("--framed", action="store_true", help="files hold length prefixed samples")
+    args = parser.parse_args()
+
+    samples = read_samples(args.paths, args.framed)
+    if not samples:
+        parser.error("no samples found")
+    # every tenth sample is kept out of the training to measure the dictionary
+    training = [sample for i, sample in enumerate(samples) if i % 10 or len(samples) < 10]
+    testing = [sample for i, sample in enumerate(samples) if not i % 10] if len(samples) >= 10 else samples
+    dictionary = compression.train_dictionary(training, args.size)
+    with open(args.output, "wb") as dictionary_file:
+        dictionary_file.write(dictionary)
+
+    original = sum(len(sample) for sample in testing)
+    print("samples: %d, dictionary: %d bytes -> %s" % (len(samples), len(dictionary), args.output))
+    print("test samples: %d bytes, compressed: %d bytes, with dictionary: %d bytes"
+          % (original, compressed_size(testing), compressed_size(testing, dictionary)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+import collections, contextlib, functools, inspect, math, signal, sys, threading, time, traceback
+
+"""
+ Tracing
+
+ Spans around the hot path's stages, for finding where a slow connection's time goes:
+ * handshake spans - the whole handshake ("handshake.<mode>.<side>", e.g. "handshake.rsa.server") and its phases:
+   handshake.read_header (waiting for and reading the peer's next pack), handshake.import_key (RSA.importKey),
+   handshake.rsa_encrypt and handshake.rsa_decrypt (PKCS1_OAEP), handshake.verify_certificate (the certificate's
+   pss signature), handshake.sign_share and handshake.verify_share (ECDH key share signature in certificate mode),
+   handshake.key_share (X25519 key generation) and handshake.key_agreement
+ * session spans - session.read (waiting for and reading the next pack's first byte), session.write (socket writes),
+   session.serialize, session.compress, session.encrypt, session.decrypt, session.decompress and session.deserialize
+ Hooks (`add_hook()`) are called when spans start and end, and latency histograms (`enable_histograms()`) keep
+ p50/p99/p999 per span name in fixed memory. Handshake spans follow the current settings; sessions are traced if
+ tracing (or metrics, see metrics module) was on when they were created. While tracing is off, a span costs one
+ check.
+ The sampling profiler samples all the threads' stacks and can be toggled on a running server (e.g. with a signal,
+ see `install_profiler_signal()`).
+"""
+
+# latency histograms: buckets per power of 2, and the range of powers of 2 (seconds) covered
+HISTOGRAM_BUCKETS_PER_OCTAVE = 8
+HISTOGRAM_MIN_OCTAVE = -20
+HISTOGRAM_MAX_OCTAVE = 7
+# seconds between the profiler's samples
+PROFILER_INTERVAL = 0.005
+# frames kept from the bottom of a sampled stack
+PROFILER_DEPTH = 32
+
+_SESSION_PREFIX = "session."
+
+_hooks = []
+_histograms = None
+_enabled = False
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed stage
+    """
+    __slots__ = ("name", "attributes", "started", "ended")
+
+    def __init__(self, name, attributes=None):
+        """
+        :param name: str; stage's name
+        :param attributes: dict or None; stage's details
+        """
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.ended = None
+
+    def duration(self):
+        """
+        Returns the span's duration in seconds (None while it runs)
+        :return: float or None
+        """
+        return None if self.ended is None else self.ended - self.started
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with log-spaced buckets (fixed memory, about 9% relative error)
+    """
+    def __init__(self):
+        # bucket 0 holds values below the range, the last bucket values above it
+        self.__counts = [0] * ((HISTOGRAM_MAX_OCTAVE - HISTOGRAM_MIN_OCTAVE) * HISTOGRAM_BUCKETS_PER_OCTAVE + 2)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__max = 0.0
+        self.__lock = threading.Lock()
+
+    def __index(self, seconds):
+        """
+        Returns the bucket of a value
+        :param seconds: float
+        :return: int
+        """
+        if seconds <= 0:
+            return 0
+        mantissa, exponent = math.frexp(seconds)
+        octave = exponent - 1 - HISTOGRAM_MIN_OCTAVE
+        if octave < 0:
+            return 0
+        index = octave * HISTOGRAM_BUCKETS_PER_OCTAVE + int((2 * mantissa - 1) * HISTOGRAM_BUCKETS_PER_OCTAVE) + 1
+        return min(index, len(self.__counts) - 1)
+
+    def __upper_bound(self, index):
+        """
+        Returns the upper bound of a bucket
+        :param index: int
+        :return: float
+        """
+        if index == 0:
+            return 2.0 ** HISTOGRAM_MIN_OCTAVE
+        octave, sub_bucket = divmod(index - 1, HISTOGRAM_BUCKETS_PER_OCTAVE)
+        return 2.0 ** (octave + HISTOGRAM_MIN_OCTAVE) * (1 + (sub_bucket + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE)
+
+    def record(self, seconds):
+        """
+        :param seconds: float
+        """
+        index = self.__index(seconds)
+        with self.__lock:
+            self.__counts[index] += 1
+            self.__count += 1
+            self.__sum += seconds
+            if seconds > self.__max:
+                self.__max = seconds
+
+    def percentile(self, fraction):
+        """
+        Returns the value below which the given fraction of the values are (a bucket's upper bound)
+        :param fraction: float; between 0 and 1 (e.g. 0.99)
+        :return: float or None; None if no value was recorded
+        """
+        with self.__lock:
+            if not self.__count:
+                return None
+            rank = max(1, math.ceil(fraction * self.__count))
+            cumulative = 0
+            for index, count in enumerate(self.__counts):
+                cumulative += count
+                if cumulative >= rank:
+                    return min(self.__upper_bound(index), self.__max)
+            return self.__max
+
+    def snapshot(self):
+        """
+        Returns the histogram's summary (seconds)
+        :return: dict; count, mean, max, p50, p99 and p999
+        """
+        with self.__lock:
+            count, total, maximum = self.__count, self.__sum, self.__max
+        return {"count": count, "mean": total / count if count else None, "max": maximum if count else None,
+                "p50": self.percentile(0.5), "p99": self.percentile(0.99), "p999": self.percentile(0.999)}
+
+
+def __update():
+    """
+    Turns tracing on while there are hooks or histograms
+    """
+    global _enabled
+    _enabled = bool(_hooks) or _histograms is not None
+
+
+def is_enabled():
+    """
+    Returns whether spans are traced (hooks are registered or histograms are on)
+    :return: bool
+    """
+    return _enabled
+
+
+def add_hook(on_start=None, on_end=None):
+    """
+    Registers span callbacks. Both are called with the Span, on the thread that runs the stage; keep them cheap.
+    A failing callback is reported and doesn't fail the stage
+    :param on_start: callable or None
+    :param on_end: callable or None; the span's `ended` is set
+    :return: tuple; the hook, for `remove_hook()`
+    """
+    hook = (on_start, on_end)
+    with _lock:
+        _hooks.append(hook)
+        __update()
+    return hook
+
+
+def remove_hook(hook):
+    """
+    :param hook: tuple; returned by `add_hook()`
+    """
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+        __update()
+
+
+def enable_histograms(status=True):
+    """
+    Turns the latency histograms on (kept) or off (dropped)
+    :param status: bool
+    """
+    global _histograms
+    with _lock:
+        if not status:
+            _histograms = None
+        elif _histograms is None:
+            _histograms = {}
+        __update()
+
+
+def histograms():
+    """
+    Returns the latency histograms' summaries
+    :return: dict; span name -> summary (see LatencyHistogram.snapshot)
+    """
+    current = _histograms
+    return {name: histogram.snapshot() for name, histogram in sorted(dict(current or {}).items())}
+
+
+def reset_histograms():
+    """
+    Clears the latency histograms
+    """
+    with _lock:
+        if _histograms is not None:
+            _histograms.clear()
+
+
+def _call_hooks(index, span):
+    """
+    Calls the registered start (0) or end (1) callbacks
+    """
+    for hook in list(_hooks):
+        callback = hook[index]
+        if callback:
+            try:
+                callback(span)
+            except Exception as e:
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+
+def start(name, attributes=None):
+    """
+    Starts a span
+    :param name: str
+    :param attributes: dict or None
+    :return: Span or None; None while tracing is off
+    """
+    if not _enabled:
+        return None
+    span = Span(name, attributes)
+    if _hooks:
+        _call_hooks(0, span)
+    return span
+
+
+def end(span):
+    """
+    Ends a span started by `start()`
+    :param span: Span or None
+    """
+    if span is None:
+        return
+    span.ended = time.perf_counter()
+    current = _histograms
+    if current is not None:
+        histogram = current.get(span.name)
+        if histogram is None:
+            with _lock:
+                histogram = current.setdefault(span.name, LatencyHistogram())
+        histogram.record(span.ended - span.started)
+    if _hooks:
+        _call_hooks(1, span)
+
+
+class _SpanContext:
+    def __init__(self, name, attributes):
+        self.__name = name
+        self.__attributes = attributes
+        self.__span = None
+
+    def __enter__(self):
+        self.__span = start(self.__name, self.__attributes)
+        return self.__span
+
+    def __exit__(self, *exc_info):
+        end(self.__span)
+
+
+__NULL_CONTEXT = contextlib.nullcontext()
+
+
+def span(name, attributes=None):
+    """
+    Traces the block as a span
+    :param name: str
+    :param attributes: dict or None
+    :return: context manager
+    """
+    if not _enabled:
+        return __NULL_CONTEXT
+    return _SpanContext(name, attributes)
+
+
+def traced(name):
+    """
+    Decorates a function (or coroutine function) to trace its calls as spans
+    :param name: str; span's name
+    :return: decorator
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def traced_function(*args, **kwargs):
+                if not _enabled:
+                    return await function(*args, **kwargs)
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def traced_function(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                with span(name):
+                    return function(*args, **kwargs)
+        return traced_function
+    return decorator
+
+
+class SessionTracer:
+    """
+    Traces a session's stages and adds their durations to the session's metrics
+    """
+    def __init__(self, session_metrics=None):
+        """
+        :param session_metrics: SessionMetrics or None
+        """
+        self.__metrics = session_metrics
+
+    def start(self, stage):
+        """
+        Starts a stage
+        :param stage: str; stage's name (see metrics module's operations)
+        :return: Span
+        """
+        span = Span(_SESSION_PREFIX + stage)
+        if _hooks:
+            _call_hooks(0, span)
+        return span
+
+    def end(self, span):
+        """
+        Ends a stage
+        :param span: Span
+        """
+        if self.__metrics:
+            self.__metrics.timed(span.name[len(_SESSION_PREFIX):], span.started)
+        end(span)
+
+
+def session_tracer(session_metrics=None):
+    """
+    Returns a new session's tracer, None while tracing and the session's metrics are off
+    :param session_metrics: SessionMetrics or None
+    :return: SessionTracer or None
+    """
+    if session_metrics or _enabled:
+        return SessionTracer(session_metrics)
+    return None
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the threads (except its own) on a background thread, and counts the functions seen
+    """
+    def __init__(self, interval=PROFILER_INTERVAL, depth=PROFILER_DEPTH):
+        """
+        :param interval: float; seconds between samples
+        :param depth: int; frames kept from the top of each stack
+        """
+        self.interval = interval
+        self.depth = depth
+        self.__samples = 0
+        # function -> samples running it (self) or with it on the stack (total)
+        self.__self = collections.Counter()
+        self.__total = collections.Counter()
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+
+    def is_running(self):
+        return self.__thread is not None
+
+    def start(self):
+        """
+        Starts sampling. Returns immediately
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops sampling (the counts are kept)
+        """
+        thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__stop.set()
+            thread.join()
+
+    def __run(self):
+        """
+        Sampling thread
+        """
+        own = threading.get_ident()
+        while not self.__stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.__lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    self.__sample(frame)
+
+    def __sample(self, frame):
+        """
+        Counts a stack's functions
+        :param frame: frame; the stack's top
+        """
+        self.__samples += 1
+        seen = set()
+        depth = 0
+        while frame is not None and depth < self.depth:
+            code = frame.f_code
+            function = "{}:{}({})".format(code.co_filename, code.co_firstlineno, code.co_name)
+            if not depth:
+                self.__self[function] += 1
+            if function not in seen:
+                seen.add(function)
+                self.__total[function] += 1
+            frame = frame.f_back
+            depth += 1
+
+    def get_stats(self):
+        """
+        Returns the samples counted so far
+        :return: dict; samples, and function -> count of samples running it ("self") or with it on the stack
+                 ("total")
+        """
+        with self.__lock:
+            return {"samples": self.__samples, "self": dict(self.__self), "total": dict(self.__total)}
+
+    def report(self, limit=20):
+        """
+        Returns the functions seen most, as text
+        :param limit: int; functions listed in each section
+        :return: str
+        """
+        stats = self.get_stats()
+        samples = stats["samples"] or 1
+        lines = ["{} stack samples".format(stats["samples"])]
+        for title, counts in (("self", stats["self"]), ("total", stats["total"])):
+            lines.append("{:>7}  {}".format(title, "function"))
+            for function, count in collections.Counter(counts).most_common(limit):
+                lines.append("{:>6.1%}  {}".format(count / samples, function))
+        return "\n".join(lines)
+
+
+_profiler = None
+
+
+def start_profiler(interval=PROFILER_INTERVAL):
+    """
+    Starts the process' sampling profiler (a new one, counting from zero)
+    :param interval: float; seconds between samples
+    :return: SamplingProfiler
+    """
+    global _profiler
+    stop_profiler()
+    _profiler = SamplingProfiler(interval)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler():
+    """
+    Stops the process' sampling profiler
+    :return: str or None; the profiler's report, None if it wasn't running
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    return profiler.report()
+
+
+def toggle_profiler(output=None):
+    """
+    Starts the profiler if it's stopped, otherwise stops it and writes its report
+    :param output: file or None; the report's output (stderr if not provided)
+    :return: bool; whether the profiler is running
+    """
+    if _profiler is None:
+        start_profiler()
+        return True
+    (output or sys.stderr).write(stop_profiler() + "\n")
+    return False
+
+
+def install_profiler_signal(signum=getattr(signal, "SIGUSR2", None), output=None):
+    """
+    Toggles the profiler whenever the process gets the signal (e.g. `kill -USR2 <pid>` starts it on a running server
+    and the next signal writes the report). Must be called on the main thread
+    :param signum: int; signal number (SIGUSR2 by default, not available on Windows)
+    :param output: file or None; the report's output (stderr if not provided)
+    """
+    if signum is None:
+        raise Exception("Profiler signal isn't supported on this platform")
+    signal.signal(signum, lambda received, frame: toggle_profiler(output))
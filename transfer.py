@@ -0,0 +1,457 @@
+import mmap, struct, threading, queue, zlib
+
+"""
+ File streams
+
+ A streamed file is sent as a sequence of independently encrypted chunks that follow the file header pack.
+ Every chunk is encrypted with a nonce derived from a random per-file prefix and the chunk's index, so chunks
+ carry no nonce of their own and can't be reordered or replayed within the stream.
+ Chunk structure: chunk header (flags, cipher data length), cipher data, MAC
+
+ The sender runs three stages - disk reads, compression/encryption and socket writes - on separate threads
+ connected by bounded queues, so the stages overlap instead of running one after the other for each chunk.
+ The receiver overlaps socket reads with decryption in the same way.
+ A file can also be sent from a read-only memory map of it: chunks are encrypted straight from the map's pages into
+ a few reused buffers, so the file isn't read into new bytes objects, and neither the file nor its cipher text adds
+ up in the process' memory.
+"""
+
+# flags, cipher data length
+_CHUNK_FORMAT = "! B I"
+_CHUNK_HEADER_SIZE = 5
+_TAG_SIZE = 16
+# chunk flags (authenticated as associated data)
+_FINAL = 1
+_COMPRESSED = 2
+
+# chunk's nonce is the stream's prefix followed by the chunk's index (the prefix fills the rest of the suite's nonce)
+COUNTER_SIZE = 8
+# chunks grow from the min size up to the max size (doubling every chunk), so small files are sent in one or two
+# small chunks while large files quickly reach big chunks with low per-chunk overhead
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# max cipher data length of a received chunk: the max chunk size and zlib's worst case expansion of it (stored
+# blocks' headers); the receiver rejects longer chunks before it allocates their buffer
+_MAX_CIPHER_LENGTH = MAX_CHUNK_SIZE + MAX_CHUNK_SIZE // 1024 + 64
+# max chunks waiting between two stages
+_QUEUE_DEPTH = 4
+# how often blocked stages check whether the transfer was stopped
+_POLL_INTERVAL = 0.1
+
+
+def chunk_nonce(prefix, index):
+    """
+    Returns the nonce of a stream's chunk
+    :param prefix: bytes; stream's random nonce prefix
+    :param index: int; chunk's index in the stream
+    :return: bytes
+    """
+    return prefix + struct.pack("!Q", index)
+
+
+def map_file(_file):
+    """
+    Maps a file into memory, read-only, for sequential reading
+    :param _file: file object opened for binary reading
+    :return: mmap or None; None if the file is empty (can't be mapped)
+    """
+    try:
+        mapping = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return None
+    if hasattr(mapping, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    return mapping
+
+
+def close_map(mapping):
+    """
+    Closes a file's memory map. If views of it are still referenced (e.g. by a failed send), it's closed once they're
+    released
+    :param mapping: mmap
+    """
+    try:
+        mapping.close()
+    except BufferError:
+        pass
+
+
+def _put(stage_queue, item, stop):
+    """
+    Puts an item in a bounded queue. Gives up if the transfer is stopped while waiting for a free slot
+    :param stage_queue: Queue
+    :param item: object
+    :param stop: Event
+    :return: bool; whether the item was queued
+    """
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _take(stage_queue, stop):
+    """
+    Takes an item from a queue. Gives up if the transfer is stopped while waiting for one
+    :param stage_queue: Queue
+    :param stop: Event
+    :return: object or None; None if the transfer was stopped
+    """
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _get(stage_queue):
+    """
+    Takes the next item from a stage's queue. Raises the exception of a failed stage
+    :param stage_queue: Queue
+    :return: object
+    """
+    item = stage_queue.get()
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+
+class FileStreamSender:
+    """
+    Sends a file's content as a stream of chunks through a pipeline
+    """
+    def __init__(self, network, new_cipher, compress=None, min_chunk=MIN_CHUNK_SIZE, max_chunk=MAX_CHUNK_SIZE):
+        """
+        :param network: Wrapper; socket wrapper
+        :param new_cipher: callable; returns a session cipher for a given nonce
+        :param compress: callable or None; returns a chunk's payload and whether it's compressed (see compression
+                         policy). None to send chunks uncompressed
+        :param min_chunk: int; first chunk's size
+        :param max_chunk: int; max chunk size, up to MAX_CHUNK_SIZE (receivers reject larger chunks)
+        """
+        self.__network = network
+        self.__new_cipher = new_cipher
+        self.__compress = compress
+        self.__min_chunk = min(min_chunk, MAX_CHUNK_SIZE)
+        self.__max_chunk = min(max(min_chunk, max_chunk), MAX_CHUNK_SIZE)
+
+    def send(self, _file, prefix, memory_map=False):
+        """
+        Sends the file's content. Blocks until the last chunk is written to the socket
+        :param _file: file object opened for binary reading
+        :param prefix: bytes; stream's nonce prefix
+        :param memory_map: bool; encrypts the chunks straight from a memory map of the file into reused buffers,
+                           instead of reading them
+        """
+        mapping = map_file(_file) if memory_map else None
+        read_queue = queue.Queue(_QUEUE_DEPTH)
+        send_queue = queue.Queue(_QUEUE_DEPTH)
+        # cipher data buffers (memory map); a chunk's buffer is taken back once the chunk is written to the socket
+        free_buffers = None
+        if mapping is not None:
+            free_buffers = queue.Queue()
+            for i in range(_QUEUE_DEPTH + 2):
+                free_buffers.put(bytearray())
+        stop = threading.Event()
+        if mapping is not None:
+            reader = threading.Thread(target=self.__read_map, args=(mapping, read_queue, stop), daemon=True)
+        else:
+            reader = threading.Thread(target=self.__read, args=(_file, read_queue, stop), daemon=True)
+        encryptor = threading.Thread(target=self.__encrypt, args=(prefix, read_queue, send_queue, stop, free_buffers),
+                                     daemon=True)
+        reader.start()
+        encryptor.start()
+        try:
+            pack = _get(send_queue)
+            while pack:
+                self.__network.send_buffers(pack[:3])
+                if free_buffers is not None:
+                    free_buffers.put(pack[3])
+                pack = _get(send_queue)
+        finally:
+            stop.set()
+            reader.join()
+            encryptor.join()
+            if mapping is not None:
+                close_map(mapping)
+
+    def __read(self, _file, read_queue, stop):
+        """
+        Reads the file in growing chunks. The last chunk is marked as final (an empty file is sent as one empty chunk)
+        :param _file: file object
+        :param read_queue: Queue; read chunks
+        :param stop: Event
+        """
+        try:
+            size = self.__min_chunk
+            data = _file.read(size)
+            while True:
+                size = min(size * 2, self.__max_chunk)
+                following = _file.read(size) if data else b''
+                if not _put(read_queue, (data, not following), stop) or not following:
+                    break
+                data = following
+        except Exception as e:
+            _put(read_queue, e, stop)
+
+    def __read_map(self, mapping, read_queue, stop):
+        """
+        Hands over a memory map's chunks (views of the map) in growing sizes, like __read
+        :param mapping: mmap; file's memory map
+        :param read_queue: Queue; chunks
+        :param stop: Event
+        """
+        try:
+            view = memoryview(mapping)
+            size = self.__min_chunk
+            offset = 0
+            while True:
+                chunk = view[offset:offset + size]
+                offset += len(chunk)
+                is_final = offset >= len(view)
+                if not _put(read_queue, (chunk, is_final), stop) or is_final:
+                    break
+                size = min(size * 2, self.__max_chunk)
+        except Exception as e:
+            _put(read_queue, e, stop)
+
+    def __encrypt(self, prefix, read_queue, send_queue, stop, free_buffers=None):
+        """
+        Compresses and encrypts read chunks and builds their packs
+        :param prefix: bytes; stream's nonce prefix
+        :param read_queue: Queue; read chunks
+        :param send_queue: Queue; packs ready to be sent
+        :param stop: Event
+        :param free_buffers: Queue or None; reused cipher data buffers. None to encrypt into new bytes
+        """
+        try:
+            index = 0
+            is_final = False
+            while not is_final:
+                data, is_final = _get(read_queue)
+                flags = _FINAL if is_final else 0
+                if self.__compress:
+                    data, is_compressed = self.__compress(data)
+                    flags |= _COMPRESSED if is_compressed else 0
+                cipher = self.__new_cipher(chunk_nonce(prefix, index))
+                cipher.update(struct.pack("!B", flags))
+                buffer = None
+                if free_buffers is None:
+                    cipher_data, tag = cipher.encrypt_and_digest(data)
+                else:
+                    buffer = _take(free_buffers, stop)
+                    if buffer is None:
+                        return
+                    if len(buffer) < len(data):
+                        buffer = bytearray(len(data))
+                    cipher_data = memoryview(buffer)[:len(data)]
+                    cipher.encrypt(data, output=cipher_data)
+                    tag = cipher.digest()
+                header = struct.pack(_CHUNK_FORMAT, flags, len(cipher_data))
+                if not _put(send_queue, [header, cipher_data, tag, buffer], stop):
+                    return
+                index += 1
+            _put(send_queue, None, stop)
+        except Exception as e:
+            _put(send_queue, e, stop)
+
+
+class FileStreamReceiver:
+    """
+    Receives a stream of chunks sent by FileStreamSender
+    """
+    def __init__(self, network, new_cipher):
+        """
+        :param network: Wrapper; socket wrapper
+        :param new_cipher: callable; returns a session cipher for a given nonce
+        """
+        self.__network = network
+        self.__new_cipher = new_cipher
+
+    def receive(self, prefix, total_size, write):
+        """
+        Receives, decrypts and verifies all stream's chunks and hands them over in order.
+        Raises exception if a chunk fails verification or the stream's length doesn't match the announced size.
+        :param prefix: bytes; stream's nonce prefix
+        :param total_size: int; file's size, as announced in the file header
+        :param write: callable; receives each decrypted chunk (bytes)
+        """
+        # the socket reader fills buffers from the free queue and hands them to the decryption stage
+        free_buffers = queue.Queue()
+        for i in range(_QUEUE_DEPTH):
+            free_buffers.put(bytearray())
+        received_queue = queue.Queue(_QUEUE_DEPTH)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.__read, args=(free_buffers, received_queue, stop), daemon=True)
+        reader.start()
+        try:
+            index = 0
+            total_received = 0
+            is_final = False
+            while not is_final:
+                flags, buffer, length = _get(received_queue)
+                is_final = bool(flags & _FINAL)
+                view = memoryview(buffer)
+                cipher = self.__new_cipher(chunk_nonce(prefix, index))
+                cipher.update(struct.pack("!B", flags))
+                data = cipher.decrypt(view[:length])
+                try:
+                    cipher.verify(view[length:length + _TAG_SIZE])
+                except ValueError:
+                    raise Exception("Verification failed")
+                free_buffers.put(buffer)
+                if flags & _COMPRESSED:
+                    # a chunk that decompresses past the announced size is cut one byte after it
+                    decompressor = zlib.decompressobj()
+                    data = decompressor.decompress(data, total_size - total_received + 1)
+                    if not decompressor.eof and len(data) <= total_size - total_received:
+                        raise Exception("Decompression failed")
+                total_received += len(data)
+                if total_received > total_size:
+                    raise Exception("File stream is longer than announced")
+                write(data)
+                index += 1
+            if total_received != total_size:
+                raise Exception("File stream is incomplete")
+            # the reader is done once it reads the final chunk
+            reader.join()
+        finally:
+            stop.set()
+
+    def __read(self, free_buffers, received_queue, stop):
+        """
+        Reads chunks from the socket until the final chunk is read
+        :param free_buffers: Queue; buffers available for reading
+        :param received_queue: Queue; received chunks
+        :param stop: Event
+        """
+        try:
+            is_final = False
+            while not is_final:
+                flags, length = struct.unpack(_CHUNK_FORMAT, self.__network.receive(_CHUNK_HEADER_SIZE))
+                if length > _MAX_CIPHER_LENGTH:
+                    raise Exception("Chunk is too large")
+                is_final = bool(flags & _FINAL)
+                buffer = _take(free_buffers, stop)
+                if buffer is None:
+                    return
+                if len(buffer) < length + _TAG_SIZE:
+                    buffer = bytearray(length + _TAG_SIZE)
+                self.__network.receive_into(memoryview(buffer)[:length + _TAG_SIZE])
+                if not _put(received_queue, (flags, buffer, length), stop):
+                    return
+        except Exception as e:
+            _put(received_queue, e, stop)
+
+
+"""
+ Streamed receive
+
+ Payloads received as they're read (see Session.receive_stream()), holding a fixed number of bytes at most: half
+ of it receives cipher data and the other half holds decompressed data.
+ An encrypted unit (a stream chunk, a segment, or a complete file's data) that fits in the receive buffer is
+ verified before its data is handed over. A larger unit is decrypted piece by piece and its MAC is verified after
+ its last piece, so its data is handed over before it's verified; a failed verification raises an exception at
+ the unit's end, and whatever was written out of it must be discarded.
+"""
+
+# default max bytes held by a streamed receive; file stream chunks fit its receive buffer, so they're verified before
+# they're handed over
+STREAM_BUFFER_SIZE = 2 * (MAX_CHUNK_SIZE + _TAG_SIZE)
+
+
+def _verify(cipher, tag):
+    """
+    Verifies a unit's MAC. Raises exception if it's invalid
+    :param cipher: session cipher
+    :param tag: bytes-like object
+    """
+    try:
+        cipher.verify(tag)
+    except ValueError:
+        raise Exception("Verification failed")
+
+
+def receive_unit(network, cipher, length, buffer, tag=None):
+    """
+    Receives an encrypted unit and yields its decrypted data in pieces of the buffer's size at most. The pieces are
+    views of the buffer, valid until the next piece is taken
+    :param network: Wrapper; socket wrapper
+    :param cipher: session cipher; the unit's associated data is already authenticated
+    :param length: int; unit's cipher data length
+    :param buffer: bytearray; reusable receive buffer
+    :param tag: bytes or None; unit's MAC, None if it follows the cipher data
+    """
+    view = memoryview(buffer)
+    tag_size = _TAG_SIZE if tag is None else 0
+    if length + tag_size <= len(view):
+        network.receive_into(view[:length + tag_size])
+        piece = view[:length]
+        cipher.decrypt(piece, output=piece)
+        _verify(cipher, view[length:length + tag_size] if tag is None else tag)
+        yield piece
+        return
+    remaining = length
+    while remaining:
+        piece = view[:min(remaining, len(view))]
+        network.receive_into(piece)
+        cipher.decrypt(piece, output=piece)
+        remaining -= len(piece)
+        yield piece
+    _verify(cipher, network.receive(_TAG_SIZE) if tag is None else tag)
+
+
+def inflate(pieces, max_size):
+    """
+    Decompresses a zlib stream's pieces, yielding max_size bytes of decompressed data at most at a time
+    :param pieces: iterable; compressed pieces
+    :param max_size: int
+    """
+    decompressor = zlib.decompressobj()
+    for piece in pieces:
+        data = piece
+        while True:
+            output = decompressor.decompress(data, max_size)
+            if output:
+                yield output
+            data = decompressor.unconsumed_tail
+            if not data and len(output) < max_size:
+                break
+    if not decompressor.eof:
+        raise Exception("Decompression failed")
+
+
+def receive_stream_chunks(network, new_cipher, prefix, total_size, buffer, max_size):
+    """
+    Receives a file stream's chunks (sent by FileStreamSender) and yields their decrypted data in pieces.
+    Raises exception if a chunk fails verification or the stream's length doesn't match the announced size
+    :param network: Wrapper; socket wrapper
+    :param new_cipher: callable; returns a session cipher for a given nonce
+    :param prefix: bytes; stream's nonce prefix
+    :param total_size: int; file's size, as announced in the file header
+    :param buffer: bytearray; reusable receive buffer
+    :param max_size: int; max size of a decompressed piece
+    """
+    index = 0
+    total_received = 0
+    is_final = False
+    while not is_final:
+        flags, length = struct.unpack(_CHUNK_FORMAT, network.receive(_CHUNK_HEADER_SIZE))
+        is_final = bool(flags & _FINAL)
+        cipher = new_cipher(chunk_nonce(prefix, index))
+        cipher.update(struct.pack("!B", flags))
+        pieces = receive_unit(network, cipher, length, buffer)
+        if flags & _COMPRESSED:
+            pieces = inflate(pieces, max_size)
+        for piece in pieces:
+            total_received += len(piece)
+            if total_received > total_size:
+                raise Exception("File stream is longer than announced")
+            yield piece
+        index += 1
+    if total_received != total_size:
+        raise Exception("File stream is incomplete")